@@ -12,6 +12,9 @@ kubectl apply -f deployment/redis_deployment.yaml
 echo "Bringing up redis_service"
 kubectl apply -f deployment/redis_service.yaml
 
+echo "Bringing up tts_voice_configmap"
+kubectl apply -f deployment/tts_voice_configmap.yaml
+
 # Deploy application services in order
 echo "Bringing up event_tracker"
 kubectl apply -f deployment/event_tracker_deployment.yaml
@@ -31,6 +34,9 @@ kubectl apply -f deployment/chunker_deployment.yaml
 echo "Bringing up tts_deployment"
 kubectl apply -f deployment/tts_deployment.yaml
 
+echo "Bringing up tts_dispatcher_deployment"
+kubectl apply -f deployment/tts_dispatcher_deployment.yaml
+
 echo "Bringing up audio_stitcher_deployment"
 kubectl apply -f deployment/audio_stitcher_deployment.yaml
 
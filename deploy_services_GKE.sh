@@ -12,6 +12,9 @@ kubectl apply -f deployment/GKE/GKE_redis_deployment.yaml
 echo "Bringing up redis_service"
 kubectl apply -f deployment/GKE/GKE_redis_service.yaml
 
+echo "Bringing up tts_voice_configmap"
+kubectl apply -f deployment/GKE/GKE_tts_voice_configmap.yaml
+
 # Deploy application services in order
 echo "Bringing up event_tracker"
 kubectl apply -f deployment/GKE/GKE_event_tracker_deployment.yaml
@@ -31,6 +34,9 @@ kubectl apply -f deployment/GKE/GKE_chunker_deployment.yaml
 echo "Bringing up tts_deployment"
 kubectl apply -f deployment/GKE/GKE_tts_deployment.yaml
 
+echo "Bringing up tts_dispatcher_deployment"
+kubectl apply -f deployment/GKE/GKE_tts_dispatcher_deployment.yaml
+
 echo "Bringing up audio_stitcher_deployment"
 kubectl apply -f deployment/GKE/GKE_audio_stitcher_deployment.yaml
 
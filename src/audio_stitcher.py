@@ -5,10 +5,11 @@ import pika
 from pydub import AudioSegment
 
 from constants import GCS_BUCKET_NAME, RABBITMQ_HOST, EVENT_TRACKER_QUEUE_NAME, STITCH_QUEUE_NAME, RABBITMQ_PASSWORD, \
-  RABBITMQ_USER
+  RABBITMQ_USER, CHUNK_STORAGE
+from chunking import chunk_index_blob_name
 from messages import remove_chapter, update_chapter_status
 from redis_ops import REMOVE_CHAPTER, UPDATE_CHAPTER_STATUS
-from utils import download_folder_from_gcs, upload_to_gcs
+from utils import download_file_from_gcs, download_folder_from_gcs, download_text_from_gcs, upload_to_gcs
 
 # ---- Initialize RabbitMQ client to pick split jobs ----
 # connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST))
@@ -73,13 +74,15 @@ def cleanup_temp_files(output_local_path, temp_input_dir):
     print(f"Error during cleanup: {cleanup_error}")
 
 
-def stitch_audio_files(bucket_name, input_folder_prefix, output_file_gcs_path):
+def stitch_audio_files(bucket_name, input_folder_prefix, output_file_gcs_path, chunk_count=None):
   """
   Stitches all chunk audio files from a GCS folder into a single audio file and uploads the result back to GCS.
 
   :param bucket_name: Name of the GCS bucket.
   :param input_folder_prefix: Prefix for the folder in GCS containing the audio chunks (e.g., "book123/chapter1/chunks/").
   :param output_file_gcs_path: Path in GCS to store the stitched audio file (e.g., "book123/chapter1/output.mp3").
+  :param chunk_count: Number of chunks of the chapter, when known; their audio files are then fetched by name
+                      instead of listing the folder.
   """
 
   # Temporary local directory for storing downloaded chunk files
@@ -89,15 +92,24 @@ def stitch_audio_files(bucket_name, input_folder_prefix, output_file_gcs_path):
   try:
     os.makedirs(temp_input_dir, exist_ok=True)
     os.makedirs(temp_output_dir, exist_ok=True)
-    # Download all files from the GCS folder to the local temp directory
-    print(f"Downloading files from GCS folder: {input_folder_prefix}...")
-    download_folder_from_gcs(bucket_name, input_folder_prefix, temp_input_dir)
-
-    # Get all downloaded chunk files in the local temp directory
-    chunk_files = sorted(
-      [os.path.join(temp_input_dir, f) for f in os.listdir(temp_input_dir) if f.endswith(".mp3")],
-      key=lambda x: int(os.path.basename(x).replace("chunk_", "").replace(".mp3", ""))
-    )
+    if chunk_count is not None:
+      # Fetch every chunk's audio by name, in order
+      print(f"Downloading {chunk_count} chunks from GCS folder: {input_folder_prefix}...")
+      chunk_files = []
+      for chunk_index in range(1, chunk_count + 1):
+        chunk_file = os.path.join(temp_input_dir, f"chunk_{chunk_index}.mp3")
+        download_file_from_gcs(bucket_name, f"{input_folder_prefix}/chunk_{chunk_index}.mp3", chunk_file)
+        chunk_files.append(chunk_file)
+    else:
+      # Download all files from the GCS folder to the local temp directory
+      print(f"Downloading files from GCS folder: {input_folder_prefix}...")
+      download_folder_from_gcs(bucket_name, input_folder_prefix, temp_input_dir)
+
+      # Get all downloaded chunk files in the local temp directory
+      chunk_files = sorted(
+        [os.path.join(temp_input_dir, f) for f in os.listdir(temp_input_dir) if f.endswith(".mp3")],
+        key=lambda x: int(os.path.basename(x).replace("chunk_", "").replace(".mp3", ""))
+      )
 
     if not chunk_files:
       print("No audio chunks found in the GCS folder.")
@@ -122,6 +134,17 @@ def stitch_audio_files(bucket_name, input_folder_prefix, output_file_gcs_path):
   #   # Cleanup temporary files
   #   cleanup_temp_files(output_local_path, temp_input_dir)
 
+def read_chunk_count(book_uuid, chapter_uuid):
+  """
+  Reads the number of chunks of a chapter from its chunk index, written by the chunker in the 'packed' storage.
+
+  :param book_uuid: UUID of the book
+  :param chapter_uuid: UUID of the chapter
+  :return: Number of chunks of the chapter
+  """
+  index = json.loads(download_text_from_gcs(GCS_BUCKET_NAME, chunk_index_blob_name(book_uuid, chapter_uuid)))
+  return len(index["chunks"])
+
 def process_job(book_uuid:str, chapter_uuid:str):
   print(f"Processing Audio Stitch job: UUID={book_uuid}, Chapter={chapter_uuid}")
 
@@ -131,7 +154,12 @@ def process_job(book_uuid:str, chapter_uuid:str):
   # define the output folder where the audio should be stored.
   destination_file_address = f"{book_uuid}/audio/{chapter_uuid}.mp3"
 
-  stitch_audio_files(GCS_BUCKET_NAME, source_folder_address, destination_file_address)
+  if CHUNK_STORAGE == 'packed':
+    # The chapter's chunk index tells how many audio chunks to expect, so the folder need not be listed.
+    stitch_audio_files(GCS_BUCKET_NAME, source_folder_address, destination_file_address,
+                       read_chunk_count(book_uuid, chapter_uuid))
+  else:
+    stitch_audio_files(GCS_BUCKET_NAME, source_folder_address, destination_file_address)
 
   # Remove the chapter from the book's tracking set
   # notify_event_tracker(REMOVE_CHAPTER, remove_chapter(book_uuid, chapter_uuid))
@@ -66,6 +66,41 @@ class TestAudioStitcher(unittest.TestCase):
         mock_stitch_chunks.assert_called_once()
         mock_upload.assert_called_once()
 
+    @patch('audio_stitcher.download_folder_from_gcs')
+    @patch('audio_stitcher.download_file_from_gcs')
+    @patch('audio_stitcher.upload_to_gcs')
+    @patch('audio_stitcher.stitch_chunks')
+    @patch('os.makedirs')
+    def test_stitch_audio_files_known_chunk_count(self, mock_makedirs, mock_stitch_chunks, mock_upload, mock_download,
+                                                  mock_download_folder):
+        mock_stitch_chunks.return_value = MagicMock()
+
+        stitch_audio_files("test_bucket", "input_folder", "output_file.mp3", 3)
+
+        # Chunks are fetched by name and in order; the folder is never listed.
+        mock_download_folder.assert_not_called()
+        self.assertEqual([c.args[1] for c in mock_download.call_args_list],
+                         ["input_folder/chunk_1.mp3", "input_folder/chunk_2.mp3", "input_folder/chunk_3.mp3"])
+        self.assertEqual([os.path.basename(path) for path in mock_stitch_chunks.call_args.args[0]],
+                         ["chunk_1.mp3", "chunk_2.mp3", "chunk_3.mp3"])
+
+    @patch('audio_stitcher.CHUNK_STORAGE', 'packed')
+    @patch('audio_stitcher.download_text_from_gcs')
+    @patch('audio_stitcher.stitch_audio_files')
+    @patch('audio_stitcher.notify_event_tracker')
+    def test_process_job_packed_storage(self, mock_notify, mock_stitch, mock_download_text):
+        mock_download_text.return_value = json.dumps({"chunks": [[0, 10], None, [10, 12]]})
+
+        process_job("book123", "chapter456")
+
+        mock_download_text.assert_called_once_with("dcsc-project-test", "book123/chunks/chapter456/chunks.index.json")
+        mock_stitch.assert_called_once_with(
+            "dcsc-project-test",
+            "book123/chunks/chapter456/audio",
+            "book123/audio/chapter456.mp3",
+            3
+        )
+
     @patch('audio_stitcher.stitch_audio_files')
     @patch('audio_stitcher.notify_event_tracker')
     def test_process_job(self, mock_notify, mock_stitch):
@@ -1,19 +1,40 @@
+import functools
 import json
 import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from io import BytesIO
+from itertools import islice
 
 import pika
+import redis
 
 from constants import CHUNKER_QUEUE_NAME, GCS_BUCKET_NAME, RABBITMQ_HOST, TTS_QUEUE_NAME, EVENT_TRACKER_QUEUE_NAME, \
-  RABBITMQ_PASSWORD, RABBITMQ_USER
-from messages import tts_job, update_chapter_status, add_chunk
-from redis_ops import ADD_CHUNK, UPDATE_CHAPTER_STATUS
-from utils import download_file_from_gcs, upload_to_gcs
+  RABBITMQ_PASSWORD, RABBITMQ_USER, CHUNK_PACKING, CHUNKER_UPLOAD_CONCURRENCY, CHUNKER_JOB_CONCURRENCY, \
+  INLINE_PAYLOAD_MAX_BYTES, INLINE_PAYLOAD_COMPRESSION, CHUNK_STORAGE, TTS_PRIORITY_SCHEDULING, TTS_FAIR_SHARE, \
+  REDIS_HOST, REDIS_PORT
+from chunking import chunk_blob_name, chunk_index_blob_name, chunk_pack_blob_name, is_inline_chunk, iter_text_chunks, \
+  pack_chunks
+from fair_scheduler import FairScheduler
+from messages import tts_job, update_chapter_status, add_chunks, tts_job_priority, tts_queue_arguments
+from redis_ops import ADD_CHUNKS, UPDATE_CHAPTER_STATUS
+from utils import call_threadsafe, download_text_from_gcs, upload_to_gcs
 
 # ---- Initialize RabbitMQ client to pick split jobs ----
 connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST, credentials=pika.PlainCredentials(username=RABBITMQ_USER, password=RABBITMQ_PASSWORD), heartbeat=3600))
 channel = connection.channel()
 
+# The thread that owns the connection; it is the only thread allowed to touch the channel.
+connection_thread = threading.current_thread()
+
+# ---- Per-book sub-queues of TTS jobs, with fair-share scheduling ----
+fair_scheduler = FairScheduler(
+  redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+) if TTS_FAIR_SHARE else None
+
+# Chunks registered with the event tracker per ADD_CHUNKS message.
+ADD_CHUNKS_BATCH_SIZE = 64
+
 def read_text_from_file(file_path):
   """Reads text content from the given file."""
   if not os.path.exists(file_path):
@@ -21,32 +42,13 @@ def read_text_from_file(file_path):
   with open(file_path, 'r', encoding='utf-8') as file:
     return file.read()
 
-def split_text_into_chunks(text, max_chunk_size=5000):
+def on_connection_thread(function, *args, **kwargs):
   """
-  Splits the input text into chunks of size less than max_chunk_size bytes,
-  ensuring the split does not occur mid-sentence or mid-paragraph.
+  Runs a channel operation on the connection's thread: directly when already there, otherwise handed over to it.
   """
-  chunks = []
-  current_chunk = ""
-  paragraphs = text.split('\n\n')  # Split text into paragraphs
-
-  for paragraph in paragraphs:
-    sentences = paragraph.split('. ')  # Split paragraph into sentences
-    for sentence in sentences:
-      sentence += '. ' if not sentence.endswith('. ') else ''
-      if len(current_chunk.encode('utf-8')) + len(sentence.encode('utf-8')) < max_chunk_size:
-        current_chunk += sentence
-      else:
-        chunks.append(current_chunk.strip())
-        current_chunk = sentence
-    # Append paragraph separator
-    current_chunk += '\n\n'
-
-  # Add the last chunk if not empty
-  if current_chunk.strip():
-    chunks.append(current_chunk.strip())
-
-  return chunks
+  if threading.current_thread() is connection_thread:
+    return function(*args, **kwargs)
+  return call_threadsafe(connection, function, *args, **kwargs)
 
 def notify_event_tracker(operation, message):
   """
@@ -55,32 +57,44 @@ def notify_event_tracker(operation, message):
   :param message: Message payload to send.
   """
   message["operation"] = operation
-  channel.basic_publish(
+  on_connection_thread(
+    channel.basic_publish,
     exchange="",
     routing_key=EVENT_TRACKER_QUEUE_NAME,
     body=json.dumps(message)
   )
   print(f"Notified event tracker: {operation} with message: {message}")
 
-def enqueue_tts_job(book_uuid:str, chapter_uuid:str, chunk_index:int):
+def enqueue_tts_job(book_uuid:str, chapter_uuid:str, chunk_index:int, chunk_text:str=None, chunk_range:list=None,
+                    priority:int=None):
   try:
-    message = tts_job(book_uuid, chapter_uuid, chunk_index)
+    message = tts_job(book_uuid, chapter_uuid, chunk_index, chunk_text, INLINE_PAYLOAD_COMPRESSION, chunk_range)
+    if fair_scheduler is not None:
+      # Queue the job on the book's sub-queue; the TTS dispatcher moves it to the TTS queue when the book's turn comes.
+      fair_scheduler.enqueue(book_uuid, message, priority)
+      print(f"Queued TTS job for book: {book_uuid}, chapter: {chapter_uuid}, chunk {chunk_index}.")
+      return
+
     # Publish the message to the RabbitMQ queue
-    channel.basic_publish(
+    on_connection_thread(
+      channel.basic_publish,
       exchange="",
       routing_key=TTS_QUEUE_NAME,
-      body=json.dumps(message)
+      body=json.dumps(message),
+      properties=pika.BasicProperties(priority=priority)
     )
     print(f"Added TTS job for book: {book_uuid}, chapter: {chapter_uuid}, chunk {chunk_index}.")
   except Exception as e:
     raise RuntimeError(f"Failed to enqueue job in TTS queue: {e}")
 
-def process_job(book_uuid, chapter_uuid):
+def process_job(book_uuid, chapter_uuid, chapter_number=None, preview=False):
   """
   Processes a single job by downloading, chunking, and uploading a chapter file.
 
   :param book_uuid: Unique identifier for the book under process.
   :param chapter_uuid: Unique identifier of the chapter to process
+  :param chapter_number: Position of the chapter in the book, which sets the priority of its TTS jobs
+  :param preview: True if a listener is waiting for the opening of the book
   """
   # Derive source and temporary file paths
   bucket_name = GCS_BUCKET_NAME
@@ -89,29 +103,140 @@ def process_job(book_uuid, chapter_uuid):
   notify_event_tracker(UPDATE_CHAPTER_STATUS, update_chapter_status(book_uuid, chapter_uuid, 'in_progress'))
 
   source_blob_name = f"{book_uuid}/chapters/{chapter_uuid}.txt"  # e.g., chapter_001.txt
-  temp_file_path = "temp_input.txt"  # Temporary file to save the downloaded content
 
-  # Download file from GCS
-  download_file_from_gcs(bucket_name, source_blob_name, temp_file_path)
+  # Download the chapter straight into memory, so concurrent jobs never share a file
+  text = download_text_from_gcs(bucket_name, source_blob_name)
 
-  # Read and process the text file
-  text = read_text_from_file(temp_file_path)
-  chunks = split_text_into_chunks(text)
+  chunks = iter_text_chunks(text, packing=CHUNK_PACKING)
 
-  for index, chunk in enumerate(chunks, start=1):
-    destination_blob_name = f"{book_uuid}/chunks/{chapter_uuid}/chunk_{index}.txt"
-    with BytesIO(chunk.encode('utf-8')) as file_like:
-      # Add the chunk to GCS
-      upload_to_gcs(file_like, bucket_name, destination_blob_name)
-    print(f"Uploaded chunk {index} to {destination_blob_name} on GCS")
+  def job_priority(chunk_index):
+    return tts_job_priority(chapter_number, chunk_index, preview) if TTS_PRIORITY_SCHEDULING else None
 
-    # Notify the event tracker that a new chunk has been under the given chapter.
-    notify_event_tracker(ADD_CHUNK, add_chunk(book_uuid, chapter_uuid, index))
+  if CHUNK_STORAGE == 'packed':
+    # The archive and its offset index are written whole, so packed storage needs every chunk up front.
+    chunks = list(chunks)
+    chunk_count = len(chunks)
+    if chunks:
+      notify_event_tracker(ADD_CHUNKS, add_chunks(book_uuid, chapter_uuid, range(1, chunk_count + 1)))
+    publish_packed_chunks(book_uuid, chapter_uuid, chunks, bucket_name, job_priority)
+    print(f"Chapter {chapter_uuid} has been split into {chunk_count} chunks and uploaded to GCS as one archive.")
+    return
 
-    # Add a job for the TTS to process the given chunk.
-    enqueue_tts_job(book_uuid, chapter_uuid, index)
+  # Chunks are uploaded on a bounded pool while the rest of the chapter is still being cut, and each chunk is queued
+  # for TTS as soon as its own upload completes.
+  chunk_count = 0
+  failed_chunks = []
+  with ThreadPoolExecutor(max_workers=CHUNKER_UPLOAD_CONCURRENCY) as upload_pool:
+    pending_uploads = {}
+
+    for index, chunk in registered_chunks(book_uuid, chapter_uuid, chunks):
+      chunk_count = index
+      # Small chunks skip GCS entirely and travel inside their TTS job.
+      if is_inline_chunk(chunk, INLINE_PAYLOAD_MAX_BYTES):
+        enqueue_tts_job(book_uuid, chapter_uuid, index, chunk, priority=job_priority(index))
+        continue
+
+      destination_blob_name = chunk_blob_name(book_uuid, chapter_uuid, index)
+      upload = upload_pool.submit(upload_chunk, chunk, bucket_name, destination_blob_name)
+      pending_uploads[upload] = index
+
+      # Publish whatever has finished so far; block only when the pool is full.
+      timeout = None if len(pending_uploads) >= CHUNKER_UPLOAD_CONCURRENCY else 0
+      publish_completed_uploads(book_uuid, chapter_uuid, pending_uploads, failed_chunks, timeout, job_priority)
+
+    while pending_uploads:
+      publish_completed_uploads(book_uuid, chapter_uuid, pending_uploads, failed_chunks, job_priority=job_priority)
+
+  if failed_chunks:
+    raise RuntimeError(f"Failed to upload {len(failed_chunks)} of {chunk_count} chunks of chapter {chapter_uuid}: "
+                       f"{sorted(failed_chunks)}")
+
+  print(f"Chapter {chapter_uuid} has been split into {chunk_count} chunks and uploaded to GCS.")
+
+def registered_chunks(book_uuid, chapter_uuid, chunks, batch_size=ADD_CHUNKS_BATCH_SIZE):
+  """
+  Registers the chunks of a chapter with the event tracker, batch_size chunks per ADD_CHUNKS message, as they are cut.
+  Every batch is registered before the chunks of the previous one are handed out, so the chapter's chunk set never
+  runs empty while chunks are still to come: the chapter is only stitched once its last chunk is done. At most two
+  batches of chunks are held at a time.
+
+  :param book_uuid: Unique identifier for the book under process.
+  :param chapter_uuid: Unique identifier of the chapter under process.
+  :param chunks: Iterable of the chapter's chunk texts, in order
+  :param batch_size: Number of chunks per ADD_CHUNKS message
+  :return: Iterator of (chunk index, chunk text) tuples, starting at 1
+  """
+  numbered_chunks = enumerate(chunks, start=1)
+  registered = []
+  batch = list(islice(numbered_chunks, batch_size))
+  while batch:
+    notify_event_tracker(ADD_CHUNKS, add_chunks(book_uuid, chapter_uuid, [index for index, _ in batch]))
+    yield from registered
+    registered = batch
+    batch = list(islice(numbered_chunks, batch_size))
+  yield from registered
+
+def publish_packed_chunks(book_uuid, chapter_uuid, chunks, bucket_name, job_priority=None):
+  """
+  Uploads the chunks of a chapter as one archive plus its offset index, then queues a TTS job per chunk carrying the
+  chunk's byte range in the archive. The index is written last, so it only ever describes a complete archive.
+
+  :param book_uuid: Unique identifier for the book under process.
+  :param chapter_uuid: Unique identifier of the chapter under process.
+  :param chunks: Texts of the chapter's chunks, in order
+  :param bucket_name: Name of the GCS bucket
+  :param job_priority: Optional function of the chunk index returning the priority of its TTS job
+  """
+  archive, index, ranges = pack_chunks(chunks, INLINE_PAYLOAD_MAX_BYTES)
+  with BytesIO(archive) as file_like:
+    upload_to_gcs(file_like, bucket_name, chunk_pack_blob_name(book_uuid, chapter_uuid))
+  with BytesIO(index) as file_like:
+    upload_to_gcs(file_like, bucket_name, chunk_index_blob_name(book_uuid, chapter_uuid))
+
+  for chunk_index, (chunk, chunk_range) in enumerate(zip(chunks, ranges), start=1):
+    # Inline chunks have no range and travel inside their TTS job.
+    enqueue_tts_job(book_uuid, chapter_uuid, chunk_index, chunk if chunk_range is None else None, chunk_range,
+                    priority=job_priority(chunk_index) if job_priority else None)
+
+def upload_chunk(chunk, bucket_name, destination_blob_name):
+  """
+  Uploads a chunk to GCS straight from memory. Runs on the upload pool.
+
+  :param chunk: Text of the chunk
+  :param bucket_name: Name of the GCS bucket
+  :param destination_blob_name: Path in the bucket where the chunk will be saved
+  """
+  with BytesIO(chunk.encode('utf-8')) as file_like:
+    # Add the chunk to GCS
+    upload_to_gcs(file_like, bucket_name, destination_blob_name)
+  print(f"Uploaded chunk to {destination_blob_name} on GCS")
+
+def publish_completed_uploads(book_uuid, chapter_uuid, pending_uploads, failed_chunks, timeout=None,
+                              job_priority=None):
+  """
+  Waits for at least one pending upload (or at most timeout seconds) and queues the TTS job of every upload that
+  finished. Publishing stays on the thread that owns the RabbitMQ connection.
+
+  :param book_uuid: Unique identifier for the book under process.
+  :param chapter_uuid: Unique identifier of the chapter under process.
+  :param pending_uploads: Dict of upload future -> chunk index; finished uploads are removed from it
+  :param failed_chunks: List collecting the indexes of chunks whose upload failed
+  :param timeout: Seconds to wait for an upload to finish; None waits until one does
+  :param job_priority: Optional function of the chunk index returning the priority of its TTS job
+  """
+  done, _ = wait(pending_uploads, timeout=timeout, return_when=FIRST_COMPLETED)
+
+  for upload in sorted(done, key=pending_uploads.get):
+    index = pending_uploads.pop(upload)
+    try:
+      upload.result()
+    except Exception as e:
+      print(f"Error uploading chunk {index} of chapter {chapter_uuid}: {e}")
+      failed_chunks.append(index)
+      continue
 
-  print(f"Chapter {chapter_uuid} has been split into {len(chunks)} chunks and uploaded to GCS.")
+    # Add a job for the TTS to process the given chunk.
+    enqueue_tts_job(book_uuid, chapter_uuid, index, priority=job_priority(index) if job_priority else None)
 
 def callback(ch, method, properties, body):
   """
@@ -128,25 +253,39 @@ def callback(ch, method, properties, body):
       raise ValueError("Invalid job message: missing 'book_uuid' or 'chapter_uuid'.")
 
     print(f"Processing job: UUID={book_uuid}, Chapter={chapter_uuid}")
-    process_job(book_uuid, chapter_uuid)  # Process the job
+    process_job(book_uuid, chapter_uuid, job.get("chapter_number"), job.get("preview", False))  # Process the job
 
     # Acknowledge the message
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    on_connection_thread(ch.basic_ack, delivery_tag=method.delivery_tag)
   except Exception as e:
     print(f"Error processing job: {e}")
     # Reject the message and requeue for future processing
-    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+    on_connection_thread(ch.basic_nack, delivery_tag=method.delivery_tag, requeue=True)
+
+def dispatch_job(job_pool, ch, method, properties, body):
+  """
+  Consumer callback when several chapters are processed at once: hands the delivery over to the job pool, so the
+  connection thread is free to keep the connection alive and to run the jobs' publishes and acks.
+  """
+  job_pool.submit(callback, ch, method, properties, body)
 
 def start_service():
-  # Set prefetch count to 1
-  channel.basic_qos(prefetch_count=1)
+  # Let the broker deliver as many chapters as the pod processes at once
+  channel.basic_qos(prefetch_count=CHUNKER_JOB_CONCURRENCY)
+
+  # Have the broker confirm every publish, so a chunk is only acknowledged once its messages are safely queued.
+  channel.confirm_delivery()
 
   # ---- Queue to hold split jobs ----
   channel.queue_declare(queue=CHUNKER_QUEUE_NAME)
-  channel.queue_declare(queue=TTS_QUEUE_NAME)
+  channel.queue_declare(queue=TTS_QUEUE_NAME, arguments=tts_queue_arguments(TTS_PRIORITY_SCHEDULING))
   channel.queue_declare(queue=EVENT_TRACKER_QUEUE_NAME)
   # Set up RabbitMQ consumer
-  channel.basic_consume(queue=CHUNKER_QUEUE_NAME, on_message_callback=callback)
+  if CHUNKER_JOB_CONCURRENCY > 1:
+    job_pool = ThreadPoolExecutor(max_workers=CHUNKER_JOB_CONCURRENCY)
+    channel.basic_consume(queue=CHUNKER_QUEUE_NAME, on_message_callback=functools.partial(dispatch_job, job_pool))
+  else:
+    channel.basic_consume(queue=CHUNKER_QUEUE_NAME, on_message_callback=callback)
 
   print("Waiting for chunker jobs.")
   # ---- Keep the program running ----
@@ -2,15 +2,23 @@ import unittest
 from unittest.mock import patch, MagicMock
 import json
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
+from chunking import split_text_into_chunks
+from messages import tts_job_priority, MAX_TTS_PRIORITY
 from chunker import (
     read_text_from_file,
-    split_text_into_chunks,
+    registered_chunks,
     notify_event_tracker,
     enqueue_tts_job,
     process_job,
-    callback
+    callback,
+    dispatch_job,
+    on_connection_thread,
+    start_service
 )
 
 class TestChunker(unittest.TestCase):
@@ -40,20 +48,221 @@ class TestChunker(unittest.TestCase):
         enqueue_tts_job("book123", "chapter456", 1)
         mock_channel.basic_publish.assert_called_once()
 
-    @patch('chunker.download_file_from_gcs')
     @patch('chunker.upload_to_gcs')
-    @patch('chunker.read_text_from_file')
+    @patch('chunker.download_text_from_gcs')
     @patch('chunker.notify_event_tracker')
     @patch('chunker.enqueue_tts_job')
-    def test_process_job(self, mock_enqueue, mock_notify, mock_read, mock_upload, mock_download):
-        mock_read.return_value = "This is a test chapter."
+    def test_process_job(self, mock_enqueue, mock_notify, mock_download, mock_upload):
+        mock_download.return_value = "This is a test chapter."
         process_job("book123", "chapter456")
-        mock_download.assert_called_once()
-        mock_read.assert_called_once()
+        mock_download.assert_called_once_with(unittest.mock.ANY, "book123/chapters/chapter456.txt")
         self.assertTrue(mock_upload.called)
         self.assertTrue(mock_notify.called)
         self.assertTrue(mock_enqueue.called)
 
+    @patch('chunker.CHUNKER_UPLOAD_CONCURRENCY', 3)
+    @patch('chunker.upload_to_gcs')
+    @patch('chunker.download_text_from_gcs')
+    @patch('chunker.notify_event_tracker')
+    @patch('chunker.enqueue_tts_job')
+    def test_process_job_uploads_concurrently(self, mock_enqueue, mock_notify, mock_download, mock_upload):
+        # Every chunk fills most of a chunk, so the chapter is cut into 6 chunks.
+        mock_download.return_value = '\n\n'.join(['word ' * 900] * 6)
+        # The first three uploads only finish once all three are in flight together.
+        barrier = threading.Barrier(3, timeout=5)
+        publishing_thread = threading.get_ident()
+
+        def upload(file_like, bucket_name, destination_blob_name):
+            if destination_blob_name.endswith(('chunk_1.txt', 'chunk_2.txt', 'chunk_3.txt')):
+                barrier.wait()
+
+        mock_upload.side_effect = upload
+        mock_enqueue.side_effect = lambda *args, **kwargs: self.assertEqual(threading.get_ident(), publishing_thread)
+
+        process_job("book123", "chapter456")
+
+        self.assertEqual(mock_upload.call_count, 6)
+        self.assertEqual(sorted(c.args[2] for c in mock_enqueue.call_args_list), [1, 2, 3, 4, 5, 6])
+        # in_progress, then a single ADD_CHUNKS for the whole chapter before any TTS job.
+        self.assertEqual(mock_notify.call_count, 2)
+        operation, message = mock_notify.call_args.args
+        self.assertEqual(operation, 'add_chunks')
+        self.assertEqual(message["chunk_indices"], [1, 2, 3, 4, 5, 6])
+
+    @patch('chunker.notify_event_tracker')
+    def test_registered_chunks_stay_one_batch_ahead(self, mock_notify):
+        registered = []
+        mock_notify.side_effect = lambda operation, message: registered.extend(message["chunk_indices"])
+        handed_out = []
+
+        def chunks():
+            for index in range(1, 8):
+                yield f"chunk {index}"
+
+        for index, chunk in registered_chunks("book123", "chapter456", chunks(), batch_size=3):
+            self.assertEqual(chunk, f"chunk {index}")
+            handed_out.append(index)
+            # The chunk set still holds chunks not handed out yet, until the last batch.
+            if index <= 3:
+                self.assertEqual(registered, [1, 2, 3, 4, 5, 6])
+            self.assertIn(index, registered)
+
+        self.assertEqual(handed_out, [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual([len(c.args[1]["chunk_indices"]) for c in mock_notify.call_args_list], [3, 3, 1])
+
+    @patch('chunker.upload_to_gcs')
+    @patch('chunker.download_text_from_gcs')
+    @patch('chunker.notify_event_tracker')
+    @patch('chunker.enqueue_tts_job')
+    def test_process_job_upload_failure(self, mock_enqueue, mock_notify, mock_download, mock_upload):
+        mock_download.return_value = '\n\n'.join(['word ' * 900] * 3)
+
+        def upload(file_like, bucket_name, destination_blob_name):
+            if destination_blob_name.endswith('chunk_2.txt'):
+                raise RuntimeError("Error uploading to GCS: boom")
+
+        mock_upload.side_effect = upload
+
+        with self.assertRaises(RuntimeError):
+            process_job("book123", "chapter456")
+
+        # Only the chunks that reached GCS are announced and queued.
+        self.assertEqual(sorted(c.args[2] for c in mock_enqueue.call_args_list), [1, 3])
+
+    @patch('chunker.connection')
+    @patch('chunker.process_job')
+    def test_dispatch_job_runs_chapters_concurrently(self, mock_process, mock_connection):
+        # Both chapters are only done once both are being processed at the same time.
+        barrier = threading.Barrier(2, timeout=5)
+        mock_process.side_effect = lambda *args: barrier.wait()
+        handed_over = queue.Queue()
+        mock_connection.add_callback_threadsafe.side_effect = handed_over.put
+        ch = MagicMock()
+
+        with ThreadPoolExecutor(max_workers=2) as job_pool:
+            for delivery_tag in (1, 2):
+                body = json.dumps({"book_uuid": "book123", "chapter_uuid": f"chapter{delivery_tag}"})
+                dispatch_job(job_pool, ch, MagicMock(delivery_tag=delivery_tag), MagicMock(), body)
+
+            # The acks are handed over to this thread, which owns the connection; run them as start_consuming would.
+            for _ in range(2):
+                handed_over.get(timeout=5)()
+
+        self.assertEqual(sorted(c.kwargs["delivery_tag"] for c in ch.basic_ack.call_args_list), [1, 2])
+        ch.basic_nack.assert_not_called()
+
+    @patch('chunker.connection')
+    def test_on_connection_thread(self, mock_connection):
+        # On the connection's thread the operation runs directly.
+        self.assertEqual(on_connection_thread(lambda value: value * 2, 21), 42)
+        mock_connection.add_callback_threadsafe.assert_not_called()
+
+        # Other threads hand it over and get its result (or exception) back.
+        mock_connection.add_callback_threadsafe.side_effect = lambda run: run()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            self.assertEqual(pool.submit(on_connection_thread, lambda value: value * 2, 21).result(), 42)
+            with self.assertRaises(ZeroDivisionError):
+                pool.submit(on_connection_thread, lambda value: value / 0, 1).result()
+        self.assertEqual(mock_connection.add_callback_threadsafe.call_count, 2)
+
+    @patch('chunker.INLINE_PAYLOAD_MAX_BYTES', 100)
+    @patch('chunker.upload_to_gcs')
+    @patch('chunker.download_text_from_gcs')
+    @patch('chunker.notify_event_tracker')
+    @patch('chunker.enqueue_tts_job')
+    def test_process_job_inline_payloads(self, mock_enqueue, mock_notify, mock_download, mock_upload):
+        # A small chunk travels inside its TTS job; a large one still goes through GCS.
+        mock_download.return_value = "word " * 996 + "\n\nSmall paragraph."
+
+        process_job("book123", "chapter456")
+
+        mock_enqueue.assert_any_call("book123", "chapter456", 1, priority=None)
+        mock_enqueue.assert_any_call("book123", "chapter456", 2, "Small paragraph..", priority=None)
+        mock_upload.assert_called_once()
+        self.assertTrue(mock_upload.call_args.args[2].endswith("chunk_1.txt"))
+
+    @patch('chunker.CHUNK_STORAGE', 'packed')
+    @patch('chunker.INLINE_PAYLOAD_MAX_BYTES', 100)
+    @patch('chunker.upload_to_gcs')
+    @patch('chunker.download_text_from_gcs')
+    @patch('chunker.notify_event_tracker')
+    @patch('chunker.enqueue_tts_job')
+    def test_process_job_packed_storage(self, mock_enqueue, mock_notify, mock_download, mock_upload):
+        mock_download.return_value = '\n\n'.join(['word ' * 996] * 3 + ['Small paragraph.'])
+        chunks = split_text_into_chunks(mock_download.return_value)
+        uploads = {}
+        mock_upload.side_effect = lambda file_like, bucket, blob: uploads.setdefault(blob, file_like.read())
+
+        process_job("book123", "chapter456")
+
+        # One archive and its index, whatever the number of chunks; the index is written last.
+        self.assertEqual(list(uploads), ["book123/chunks/chapter456/chunks.pack",
+                                         "book123/chunks/chapter456/chunks.index.json"])
+        archive = uploads["book123/chunks/chapter456/chunks.pack"]
+        ranges = json.loads(uploads["book123/chunks/chapter456/chunks.index.json"])["chunks"]
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(mock_enqueue.call_count, 4)
+        for chunk, chunk_range, call in zip(chunks[:3], ranges[:3], mock_enqueue.call_args_list):
+            self.assertEqual(call.args[3:], (None, chunk_range))
+            offset, length = chunk_range
+            self.assertEqual(archive[offset:offset + length].decode('utf-8'), chunk)
+        mock_enqueue.assert_any_call("book123", "chapter456", 4, "Small paragraph..", None, priority=None)
+
+    @patch('chunker.fair_scheduler')
+    @patch('chunker.channel')
+    def test_enqueue_tts_job_fair_share(self, mock_channel, mock_scheduler):
+        enqueue_tts_job("book123", "chapter456", 1, priority=9)
+        mock_scheduler.enqueue.assert_called_once_with(
+            "book123", {"book_uuid": "book123", "chapter_uuid": "chapter456", "chunk_index": 1}, 9
+        )
+        mock_channel.basic_publish.assert_not_called()
+
+    @patch('chunker.channel')
+    def test_enqueue_tts_job_priority(self, mock_channel):
+        enqueue_tts_job("book123", "chapter456", 1, priority=9)
+        self.assertEqual(mock_channel.basic_publish.call_args.kwargs["properties"].priority, 9)
+
+    def test_tts_job_priority(self):
+        # Early chapters before later ones, and the start of a chapter before the rest of it.
+        self.assertGreater(tts_job_priority(1, 1), tts_job_priority(1, 3))
+        self.assertGreater(tts_job_priority(1, 3), tts_job_priority(2, 1))
+        self.assertGreater(tts_job_priority(2, 5), tts_job_priority(9, 1))
+        self.assertEqual(tts_job_priority(40, 7), 1)
+        # The opening of a preview outranks everything, but only the opening.
+        self.assertEqual(tts_job_priority(1, 30, preview=True), MAX_TTS_PRIORITY)
+        self.assertEqual(tts_job_priority(2, 1, preview=True), tts_job_priority(2, 1))
+        self.assertIsNone(tts_job_priority(None, 1))
+
+    @patch('chunker.TTS_PRIORITY_SCHEDULING', True)
+    @patch('chunker.upload_to_gcs')
+    @patch('chunker.download_text_from_gcs')
+    @patch('chunker.notify_event_tracker')
+    @patch('chunker.enqueue_tts_job')
+    def test_process_job_prioritizes_tts_jobs(self, mock_enqueue, mock_notify, mock_download, mock_upload):
+        mock_download.return_value = '\n\n'.join(['word ' * 900] * 4)
+
+        process_job("book123", "chapter456", chapter_number=2)
+
+        priorities = {c.args[2]: c.kwargs["priority"] for c in mock_enqueue.call_args_list}
+        self.assertEqual(priorities, {1: 7, 2: 7, 3: 6, 4: 6})
+
+    @patch('chunker.process_job')
+    def test_callback_passes_chapter_number(self, mock_process):
+        body = json.dumps({"book_uuid": "book123", "chapter_uuid": "chapter456", "chapter_number": 3, "preview": True})
+        callback(MagicMock(), MagicMock(), MagicMock(), body)
+        mock_process.assert_called_once_with("book123", "chapter456", 3, True)
+
+    @patch('chunker.TTS_PRIORITY_SCHEDULING', True)
+    @patch('chunker.channel')
+    def test_start_service_declares_priority_queue(self, mock_channel):
+        start_service()
+        mock_channel.queue_declare.assert_any_call(queue='tts_queue', arguments={"x-max-priority": MAX_TTS_PRIORITY})
+
+    @patch('chunker.channel')
+    def test_start_service_enables_publisher_confirms(self, mock_channel):
+        start_service()
+        mock_channel.confirm_delivery.assert_called_once()
+
     @patch('chunker.process_job')
     def test_callback_success(self, mock_process):
         ch = MagicMock()
@@ -63,7 +272,7 @@ class TestChunker(unittest.TestCase):
         
         callback(ch, method, properties, body)
         
-        mock_process.assert_called_once_with("book123", "chapter456")
+        mock_process.assert_called_once_with("book123", "chapter456", None, False)
         ch.basic_ack.assert_called_once()
 
     @patch('chunker.process_job')
@@ -0,0 +1,211 @@
+# ---- Splits chapter text into chunks small enough for a single text-to-speech request. ----
+import json
+import math
+import re
+
+# Smallest chunk size that can hold any character (UTF-8 uses up to 4 bytes, and chunks stay below the limit).
+MIN_CHUNK_SIZE = 5
+
+# Ways of packing sentences into chunks, see iter_text_chunks.
+PACKING_MODES = ('greedy', 'balanced')
+
+PARAGRAPH_SEPARATOR = '\n\n'
+
+# Runs of non-space characters with the whitespace that follows them, or leading whitespace.
+WORD_PATTERN = re.compile(r'\S+\s*|\s+')
+
+
+def chunk_blob_name(book_uuid, chapter_uuid, chunk_index):
+  """
+  Path of a chunk in the GCS bucket.
+
+  :param book_uuid: UUID of the book
+  :param chapter_uuid: UUID of the chapter
+  :param chunk_index: 1-based index of the chunk within the chapter
+  """
+  return f"{book_uuid}/chunks/{chapter_uuid}/chunk_{chunk_index}.txt"
+
+
+def chunk_pack_blob_name(book_uuid, chapter_uuid):
+  """Path of the archive holding every stored chunk of a chapter, in the 'packed' chunk storage."""
+  return f"{book_uuid}/chunks/{chapter_uuid}/chunks.pack"
+
+
+def chunk_index_blob_name(book_uuid, chapter_uuid):
+  """Path of the offset index of a chapter's chunk archive, in the 'packed' chunk storage."""
+  return f"{book_uuid}/chunks/{chapter_uuid}/chunks.index.json"
+
+
+def pack_chunks(chunks, max_inline_bytes=0):
+  """
+  Packs the chunks of a chapter into a single archive: their UTF-8 encodings back to back. Chunks small enough to
+  travel inline are left out of the archive.
+
+  :param chunks: Texts of the chapter's chunks, in order
+  :param max_inline_bytes: Exclusive upper bound of the size of an inline chunk in bytes; 0 disables inlining
+  :return: (archive bytes, index bytes, ranges) where ranges[i] is the [offset, length] of chunk i + 1 in the
+           archive, or None for an inline chunk, and the index is ranges serialized as JSON
+  """
+  encoded_chunks = []
+  ranges = []
+  offset = 0
+  for chunk in chunks:
+    if is_inline_chunk(chunk, max_inline_bytes):
+      ranges.append(None)
+      continue
+    encoded = chunk.encode('utf-8')
+    encoded_chunks.append(encoded)
+    ranges.append([offset, len(encoded)])
+    offset += len(encoded)
+
+  index = json.dumps({"chunks": ranges}, separators=(',', ':')).encode('utf-8')
+  return b''.join(encoded_chunks), index, ranges
+
+
+def is_inline_chunk(chunk, max_inline_bytes):
+  """
+  Whether a chunk is small enough to travel inside its TTS job instead of through GCS.
+
+  :param chunk: Text of the chunk
+  :param max_inline_bytes: Exclusive upper bound of the size of an inline chunk in bytes; 0 disables inlining
+  """
+  return byte_length(chunk) < max_inline_bytes
+
+
+def split_text_into_chunks(text, max_chunk_size=5000):
+  """
+  Splits the input text into chunks of size less than max_chunk_size bytes,
+  ensuring the split does not occur mid-sentence or mid-paragraph.
+  """
+  return list(iter_text_chunks(text, max_chunk_size))
+
+
+def iter_text_chunks(text, max_chunk_size=5000, packing='greedy'):
+  """
+  Yields the chunks of the input text as soon as each one is complete. Every chunk is less than max_chunk_size
+  bytes when encoded as UTF-8. Chunks end at sentence boundaries; a sentence that cannot fit in a chunk on its own
+  is split between words, and a word that cannot fit is split between characters.
+
+  The byte length of the chunk under construction is tracked incrementally and the chunk is joined once, so the
+  work is linear in the length of the text.
+
+  :param text: Text of the chapter, with paragraphs separated by blank lines
+  :param max_chunk_size: Exclusive upper bound of the size of a chunk in bytes
+  :param packing: 'greedy' fills every chunk up to the limit; 'balanced' cuts about ceil(size / max_chunk_size)
+                  chunks of nearly equal size
+  :return: Generator of non-empty chunks in text order
+  """
+  if max_chunk_size < MIN_CHUNK_SIZE:
+    raise ValueError(f"max_chunk_size must be at least {MIN_CHUNK_SIZE} bytes, got {max_chunk_size}")
+  if packing not in PACKING_MODES:
+    raise ValueError(f"Unknown chunk packing mode: {packing}")
+
+  units = iter_text_units(text, max_chunk_size)
+  if packing == 'balanced':
+    # Plan ceil(size / limit) chunks. After every cut the remaining bytes are spread evenly over the remaining
+    # chunks, so a chunk that came out short or long does not skew the ones after it.
+    units = list(units)
+    remaining_bytes = sum(unit_bytes for _, unit_bytes in units)
+    remaining_chunks = max(1, math.ceil(remaining_bytes / max_chunk_size))
+
+  current_parts = []
+  current_bytes = 0
+
+  for unit, unit_bytes in units:
+    if unit == PARAGRAPH_SEPARATOR:
+      current_parts.append(unit)
+      current_bytes += unit_bytes
+      continue
+
+    if current_bytes + unit_bytes < max_chunk_size:
+      # Balanced packing also cuts early, when the chunk is closer to its target without the sentence than with it.
+      if packing == 'greedy' or not current_parts or \
+          current_bytes + unit_bytes / 2 < remaining_bytes / remaining_chunks:
+        current_parts.append(unit)
+        current_bytes += unit_bytes
+        continue
+
+    chunk = ''.join(current_parts).strip()
+    if chunk:
+      yield chunk
+    if packing == 'balanced':
+      remaining_bytes -= current_bytes
+      remaining_chunks = max(1, remaining_chunks - 1)
+
+    current_parts = [unit]
+    current_bytes = unit_bytes
+
+  # Add the last chunk if not empty
+  chunk = ''.join(current_parts).strip()
+  if chunk:
+    yield chunk
+
+
+def iter_text_units(text, max_chunk_size):
+  """
+  Yields the sentences and paragraph separators of the text with their size in bytes. Sentences of max_chunk_size
+  bytes or more are broken into pieces below the limit.
+
+  :param text: Text of the chapter, with paragraphs separated by blank lines
+  :param max_chunk_size: Exclusive upper bound of the size of a chunk in bytes
+  :return: Generator of (unit, size in bytes) tuples
+  """
+  for paragraph in text.split(PARAGRAPH_SEPARATOR):  # Split text into paragraphs
+    for sentence in paragraph.split('. '):  # Split paragraph into sentences
+      sentence += '. '
+      sentence_bytes = byte_length(sentence)
+      if sentence_bytes < max_chunk_size:
+        yield sentence, sentence_bytes
+      else:
+        for piece in split_long_sentence(sentence, max_chunk_size):
+          yield piece, byte_length(piece)
+
+    # Append paragraph separator
+    yield PARAGRAPH_SEPARATOR, 2
+
+
+def split_long_sentence(sentence, max_chunk_size):
+  """
+  Splits a sentence into pieces of less than max_chunk_size bytes, between words where possible.
+
+  :param sentence: Sentence of at least max_chunk_size bytes
+  :param max_chunk_size: Exclusive upper bound of the size of a piece in bytes
+  :return: Generator of pieces that concatenate to the sentence
+  """
+  piece_parts = []
+  piece_bytes = 0
+
+  for match in WORD_PATTERN.finditer(sentence):
+    word = match.group()
+    word_bytes = byte_length(word)
+
+    if piece_bytes + word_bytes < max_chunk_size:
+      piece_parts.append(word)
+      piece_bytes += word_bytes
+      continue
+
+    if piece_parts:
+      yield ''.join(piece_parts)
+
+    if word_bytes < max_chunk_size:
+      piece_parts = [word]
+      piece_bytes = word_bytes
+      continue
+
+    # A single word longer than the limit: cut its encoding at character boundaries.
+    encoded = word.encode('utf-8')
+    while len(encoded) >= max_chunk_size:
+      cut = max_chunk_size - 1
+      while encoded[cut] & 0xC0 == 0x80:  # Never cut inside a multi-byte character
+        cut -= 1
+      yield encoded[:cut].decode('utf-8')
+      encoded = encoded[cut:]
+    piece_parts = [encoded.decode('utf-8')]
+    piece_bytes = len(encoded)
+
+  yield ''.join(piece_parts)
+
+
+def byte_length(text):
+  """Size of text in bytes when encoded as UTF-8."""
+  return len(text) if text.isascii() else len(text.encode('utf-8'))
@@ -0,0 +1,119 @@
+"""
+Benchmarks the streaming chunker against the concatenating implementation it replaced, on synthetic chapters of
+growing size, and checks that both produce the same chunks.
+
+Then compares greedy and balanced chunk packing on a synthetic book: chunk size spread and the time each chapter
+waits for its slowest TTS job when every chunk gets its own replica.
+
+Usage: python chunking_benchmark.py [--sizes 10000 100000 1000000] [--chunk-sizes 5000 50000] [--repeat 3]
+                                    [--chapters 40]
+"""
+import argparse
+import math
+import random
+import statistics
+import time
+
+from chunking import iter_text_chunks, split_text_into_chunks
+
+TTS_BASE_SECONDS = 0.5          # TTS: request overhead per chunk
+TTS_BYTES_PER_SECOND = 2500     # TTS: synthesis throughput
+
+WORDS = ("the quick brown fox jumps over the lazy dog while narrators read every single chapter aloud "
+         "café naïve co-operate").split()
+
+
+def legacy_split_text_into_chunks(text, max_chunk_size=5000):
+  chunks = []
+  current_chunk = ""
+  for paragraph in text.split('\n\n'):
+    for sentence in paragraph.split('. '):
+      sentence += '. ' if not sentence.endswith('. ') else ''
+      if len(current_chunk.encode('utf-8')) + len(sentence.encode('utf-8')) < max_chunk_size:
+        current_chunk += sentence
+      else:
+        chunks.append(current_chunk.strip())
+        current_chunk = sentence
+    current_chunk += '\n\n'
+  if current_chunk.strip():
+    chunks.append(current_chunk.strip())
+  return chunks
+
+
+def synthetic_chapter(size, seed=5253):
+  """
+  Builds a chapter of about size characters with paragraphs of 3 to 12 sentences of 5 to 25 words.
+  """
+  rng = random.Random(seed)
+  paragraphs = []
+  length = 0
+  while length < size:
+    sentences = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 25))) for _ in range(rng.randint(3, 12))]
+    paragraph = '. '.join(sentences) + '.'
+    paragraphs.append(paragraph)
+    length += len(paragraph) + 2
+  return '\n\n'.join(paragraphs)
+
+
+def best_time(function, repeat):
+  best = float('inf')
+  result = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = function()
+    best = min(best, time.perf_counter() - start)
+  return best, result
+
+
+def run_benchmark(sizes, chunk_sizes, repeat):
+  print(f"{'chapter chars':>14} {'chunk bytes':>12} {'legacy (ms)':>12} {'streaming (ms)':>15} {'speedup':>8} {'same':>5}")
+  for size in sizes:
+    text = synthetic_chapter(size)
+    for max_chunk_size in chunk_sizes:
+      legacy_seconds, legacy_chunks = best_time(lambda: legacy_split_text_into_chunks(text, max_chunk_size), repeat)
+      streaming_seconds, chunks = best_time(lambda: split_text_into_chunks(text, max_chunk_size), repeat)
+      same = chunks == [chunk for chunk in legacy_chunks if chunk]
+      print(f"{len(text):>14} {max_chunk_size:>12} {legacy_seconds * 1000:>12.1f} {streaming_seconds * 1000:>15.1f} "
+            f"{legacy_seconds / streaming_seconds:>7.1f}x {str(same):>5}")
+
+
+def tts_seconds(chunk):
+  return TTS_BASE_SECONDS + len(chunk.encode('utf-8')) / TTS_BYTES_PER_SECOND
+
+
+def run_packing_benchmark(chapters, max_chunk_size=5000, seed=5253):
+  """
+  Chunks a book of chapters with lognormal sizes in both packing modes. With enough TTS replicas every chunk of a
+  chapter is synthesized in parallel, so the chapter is ready for stitching when its slowest chunk finishes.
+  """
+  rng = random.Random(seed)
+  sizes = [int(rng.lognormvariate(math.log(20000), 0.8)) for _ in range(chapters)]
+  texts = [synthetic_chapter(size, seed=seed + index) for index, size in enumerate(sizes)]
+
+  print(f"\nPacking {chapters} chapters ({sum(sizes) / 1000:.0f} kB) into chunks below {max_chunk_size} bytes")
+  print(f"{'packing':>9} {'chunks':>7} {'mean bytes':>11} {'stdev':>7} {'min':>6} {'mean wait (s)':>14} "
+        f"{'mean spread (s)':>16}")
+  for packing in ('greedy', 'balanced'):
+    chunk_bytes = []
+    waits = []
+    spreads = []
+    for text in texts:
+      chunks = list(iter_text_chunks(text, max_chunk_size, packing))
+      durations = [tts_seconds(chunk) for chunk in chunks]
+      chunk_bytes.extend(len(chunk.encode('utf-8')) for chunk in chunks)
+      # Time the chapter waits for its slowest chunk, and how far its fastest chunk finishes before that.
+      waits.append(max(durations))
+      spreads.append(max(durations) - min(durations))
+    print(f"{packing:>9} {len(chunk_bytes):>7} {statistics.mean(chunk_bytes):>11.0f} {statistics.pstdev(chunk_bytes):>7.0f} "
+          f"{min(chunk_bytes):>6} {statistics.mean(waits):>14.2f} {statistics.mean(spreads):>16.2f}")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+  parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[5000, 50000])
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--chapters', type=int, default=40)
+  args = parser.parse_args()
+  run_benchmark(args.sizes, args.chunk_sizes, args.repeat)
+  run_packing_benchmark(args.chapters)
@@ -0,0 +1,169 @@
+import inspect
+import json
+import random
+import re
+import unittest
+
+from chunking import (
+    iter_text_chunks,
+    split_text_into_chunks,
+    split_long_sentence,
+    chunk_blob_name,
+    chunk_index_blob_name,
+    chunk_pack_blob_name,
+    pack_chunks,
+    MIN_CHUNK_SIZE,
+    PACKING_MODES
+)
+
+WORDS = ['narrator', 'read', 'a', 'chapter', 'aloud', 'café', 'naïve', '日本語', '\U0001F600', 'end.', 'Mr.', '-']
+
+
+def legacy_split_text_into_chunks(text, max_chunk_size=5000):
+    """The quadratic implementation the streaming chunker replaces."""
+    chunks = []
+    current_chunk = ""
+    for paragraph in text.split('\n\n'):
+        for sentence in paragraph.split('. '):
+            sentence += '. ' if not sentence.endswith('. ') else ''
+            if len(current_chunk.encode('utf-8')) + len(sentence.encode('utf-8')) < max_chunk_size:
+                current_chunk += sentence
+            else:
+                chunks.append(current_chunk.strip())
+                current_chunk = sentence
+        current_chunk += '\n\n'
+    if current_chunk.strip():
+        chunks.append(current_chunk.strip())
+    return chunks
+
+
+def random_text(rng, max_sentence_words):
+    """Builds random paragraphs of random sentences, with the odd stray space and newline."""
+    paragraphs = []
+    for _ in range(rng.randint(0, 8)):
+        sentences = []
+        for _ in range(rng.randint(1, 6)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(0, max_sentence_words))]
+            sentences.append(rng.choice([' ', ' ', ' ', '  ', '\n']).join(words))
+        paragraphs.append('. '.join(sentences) + rng.choice(['', '.', ' ']))
+    return '\n\n'.join(paragraphs)
+
+
+def sentences_of(text):
+    """Non-whitespace content the chunks must carry, sentence terminators included."""
+    return re.sub(r'\s', '', ''.join(sentence + '. ' for paragraph in text.split('\n\n')
+                                     for sentence in paragraph.split('. ')))
+
+
+class TestChunking(unittest.TestCase):
+
+    def test_split_text_into_chunks(self):
+        text = "This is a test. It has multiple sentences. And even multiple paragraphs.\n\nHere's another paragraph. It's short."
+        self.assertEqual(split_text_into_chunks(text, max_chunk_size=50), [
+            "This is a test. It has multiple sentences.",
+            "And even multiple paragraphs..",
+            "Here's another paragraph. It's short..",
+        ])
+
+    def test_iter_text_chunks_is_a_generator(self):
+        self.assertTrue(inspect.isgenerator(iter_text_chunks("One. Two.")))
+
+    def test_parity_with_legacy_when_sentences_fit(self):
+        # Wherever the old chunker kept its guarantee, the new one produces the same chunks (minus empty ones).
+        rng = random.Random(5253)
+        for _ in range(500):
+            text = random_text(rng, max_sentence_words=8)
+            max_chunk_size = rng.randint(60, 300)
+            if any(len(sentence.encode('utf-8')) + 2 >= max_chunk_size
+                   for paragraph in text.split('\n\n') for sentence in paragraph.split('. ')):
+                continue
+            expected = [chunk for chunk in legacy_split_text_into_chunks(text, max_chunk_size) if chunk]
+            self.assertEqual(split_text_into_chunks(text, max_chunk_size), expected, (text, max_chunk_size))
+
+    def test_properties_on_random_text(self):
+        # Property: chunks are non-empty, below the byte limit and carry all the text in order, for any limit
+        # including ones smaller than a single sentence or word.
+        rng = random.Random(5253)
+        for _ in range(1000):
+            text = random_text(rng, max_sentence_words=40)
+            if rng.random() < 0.2:
+                text += '. ' + rng.choice(WORDS) * rng.randint(1, 100)  # A very long word
+            max_chunk_size = rng.choice([MIN_CHUNK_SIZE, rng.randint(MIN_CHUNK_SIZE, 40), rng.randint(40, 500)])
+            packing = rng.choice(PACKING_MODES)
+
+            chunks = list(iter_text_chunks(text, max_chunk_size, packing))
+
+            for chunk in chunks:
+                self.assertTrue(chunk)
+                self.assertEqual(chunk, chunk.strip())
+                self.assertLess(len(chunk.encode('utf-8')), max_chunk_size, (text, max_chunk_size))
+            self.assertEqual(re.sub(r'\s', '', ''.join(chunks)), sentences_of(text), (text, max_chunk_size))
+
+    def test_long_sentence_is_split_between_words(self):
+        sentence = ' '.join(['word'] * 30)
+        chunks = split_text_into_chunks(sentence, max_chunk_size=22)
+        self.assertEqual(chunks[0], 'word word word word')
+        self.assertTrue(all(len(chunk.encode('utf-8')) < 22 for chunk in chunks))
+
+    def test_split_long_sentence_respects_characters(self):
+        # 3-byte characters are never cut in half.
+        pieces = list(split_long_sentence('日' * 10, 8))
+        self.assertEqual(pieces, ['日日', '日日', '日日', '日日', '日日'])
+        self.assertEqual(''.join(split_long_sentence('abc def ghi jkl. ', 9)), 'abc def ghi jkl. ')
+
+    def test_balanced_packing_evens_out_chunks(self):
+        # 29 sentences of 100 bytes: greedy packs 10 + 10 + 9 and leaves a small tail, balanced cuts 3 even chunks.
+        sentence = 'x' * 98
+        text = '. '.join([sentence] * 29)
+        greedy = split_text_into_chunks(text, max_chunk_size=1001)
+        balanced = list(iter_text_chunks(text, max_chunk_size=1001, packing='balanced'))
+        self.assertEqual(len(greedy), 3)
+        self.assertEqual(len(balanced), 3)
+        sizes = [len(chunk) for chunk in balanced]
+        self.assertLessEqual(max(sizes) - min(sizes), 100)
+
+        text = '. '.join([sentence] * 21)
+        self.assertEqual([len(chunk) // 100 for chunk in split_text_into_chunks(text, 1001)], [9, 9, 0])
+        self.assertEqual([len(chunk) // 100 for chunk in iter_text_chunks(text, 1001, 'balanced')], [6, 6, 6])
+
+    def test_balanced_packing_chunk_count(self):
+        # Property: evening out the chunks costs at most one chunk more than greedy packing.
+        rng = random.Random(5253)
+        for _ in range(200):
+            text = random_text(rng, max_sentence_words=8)
+            max_chunk_size = rng.randint(300, 2000)
+            balanced = list(iter_text_chunks(text, max_chunk_size, 'balanced'))
+            greedy = split_text_into_chunks(text, max_chunk_size)
+            self.assertLessEqual(len(balanced), len(greedy) + 1)
+
+    def test_unknown_packing(self):
+        with self.assertRaises(ValueError):
+            list(iter_text_chunks("Any text.", 5000, 'optimal'))
+
+    def test_max_chunk_size_too_small(self):
+        with self.assertRaises(ValueError):
+            list(iter_text_chunks("Any text.", MIN_CHUNK_SIZE - 1))
+
+    def test_chunk_blob_name(self):
+        self.assertEqual(chunk_blob_name("book", "chapter", 3), "book/chunks/chapter/chunk_3.txt")
+        self.assertEqual(chunk_pack_blob_name("book", "chapter"), "book/chunks/chapter/chunks.pack")
+        self.assertEqual(chunk_index_blob_name("book", "chapter"), "book/chunks/chapter/chunks.index.json")
+
+    def test_pack_chunks_ranges_address_every_chunk(self):
+        # Property: slicing the archive at a chunk's range gives back exactly that chunk.
+        rng = random.Random(5253)
+        for _ in range(100):
+            chunks = split_text_into_chunks(random_text(rng, max_sentence_words=8), rng.randint(50, 1000))
+            archive, index, ranges = pack_chunks(chunks)
+            self.assertEqual(json.loads(index), {"chunks": ranges})
+            self.assertEqual(len(archive), sum(length for _, length in ranges))
+            for chunk, (offset, length) in zip(chunks, ranges):
+                self.assertEqual(archive[offset:offset + length].decode('utf-8'), chunk)
+
+    def test_pack_chunks_leaves_inline_chunks_out(self):
+        archive, index, ranges = pack_chunks(["A long chunk of text.", "Tiny.", "Another long chunk."], 10)
+        self.assertEqual(archive, b"A long chunk of text.Another long chunk.")
+        self.assertEqual(ranges, [[0, 21], None, [21, 19]])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import os
 
 UPLOAD_FOLDER = "uploads"
 DOWNLOAD_FOLDER = "downloads"
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
+MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', 10 * 1024 * 1024))  # 10 MB by default
 GCS_BUCKET_NAME = "dcsc-project-test"
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST', 'localhost')
 RABBITMQ_USER = os.getenv('RABBITMQ_USER', 'guest')
@@ -15,6 +15,93 @@ EVENT_TRACKER_QUEUE_NAME = "event_tracker_queue"
 REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
 REDIS_PORT = 6379
 
+# ---- Splitter settings ----
+# 'ebooklib' loads the whole book up front, 'streaming' reads one spine document at a time.
+SPLITTER_EXTRACTION_MODE = os.getenv('SPLITTER_EXTRACTION_MODE', 'ebooklib')
+# Number of processes converting HTML to text; 1 keeps the conversion in the main process.
+SPLITTER_WORKERS = int(os.getenv('SPLITTER_WORKERS', '1'))
+# Text extraction engine, see text_extraction.EXTRACTION_ENGINES ('bs4' or 'lxml').
+SPLITTER_EXTRACTION_ENGINE = os.getenv('SPLITTER_EXTRACTION_ENGINE', 'bs4')
+# Maximum number of chapter uploads in flight at once.
+SPLITTER_UPLOAD_CONCURRENCY = int(os.getenv('SPLITTER_UPLOAD_CONCURRENCY', '4'))
+# Order in which chapters are sent to the chunker: 'document' or 'largest_first'.
+SPLITTER_DISPATCH_ORDER = os.getenv('SPLITTER_DISPATCH_ORDER', 'document')
+# 'chunker' hands every chapter to the chunker service, 'fused' chunks chapters in the splitter and queues TTS jobs
+# directly, so the chunker deployment can be dropped.
+SPLITTER_PIPELINE_MODE = os.getenv('SPLITTER_PIPELINE_MODE', 'chunker')
+
+# ---- Chunking settings ----
+# 'greedy' fills every chunk up to the limit, 'balanced' cuts each chapter into chunks of nearly equal size.
+CHUNK_PACKING = os.getenv('CHUNK_PACKING', 'greedy')
+# Maximum number of chunk uploads the chunker keeps in flight at once.
+CHUNKER_UPLOAD_CONCURRENCY = int(os.getenv('CHUNKER_UPLOAD_CONCURRENCY', '8'))
+# Number of chapters a chunker pod processes at once.
+CHUNKER_JOB_CONCURRENCY = int(os.getenv('CHUNKER_JOB_CONCURRENCY', '4'))
+# Chunks below this many bytes travel inside their TTS job instead of through GCS; 0 disables inline payloads.
+INLINE_PAYLOAD_MAX_BYTES = int(os.getenv('INLINE_PAYLOAD_MAX_BYTES', '0'))
+# Compression of inline payloads: 'zlib' or 'none'.
+INLINE_PAYLOAD_COMPRESSION = os.getenv('INLINE_PAYLOAD_COMPRESSION', 'zlib')
+# 'blobs' stores every chunk of a chapter as its own object, 'packed' stores one archive per chapter plus an offset
+# index. Chunkers, TTS workers and stitchers must agree on it.
+CHUNK_STORAGE = os.getenv('CHUNK_STORAGE', 'blobs')
+
+# ---- TTS settings ----
+# Voice used for narration.
+TTS_LANGUAGE_CODE = os.getenv('TTS_LANGUAGE_CODE', 'en-US')
+TTS_VOICE_GENDER = os.getenv('TTS_VOICE_GENDER', 'FEMALE')  # MALE, FEMALE or NEUTRAL
+# Text-to-Speech engine: 'google' (Google Cloud Text-to-Speech) or 'local' (offline engine for load tests and CI).
+TTS_BACKEND = os.getenv('TTS_BACKEND', 'google')
+# Encoding of the chunk audio: chunks are stored as .mp3 and stitched as MP3.
+TTS_AUDIO_ENCODING = 'MP3'
+# Everything that decides how a narration sounds. It is part of an upload's content key, so a book narrated with another
+# engine, voice or encoding is never reused. The REST server and the TTS service read it from the same tts-voice config
+# map.
+TTS_SYNTHESIS_CONFIG = (TTS_BACKEND, TTS_LANGUAGE_CODE, TTS_VOICE_GENDER, TTS_AUDIO_ENCODING)
+# Synthetic delay of the 'local' engine: a fixed latency plus the text length over a throughput.
+TTS_LOCAL_LATENCY_MS = int(os.getenv('TTS_LOCAL_LATENCY_MS', '200'))
+TTS_LOCAL_CHARACTERS_PER_SECOND = int(os.getenv('TTS_LOCAL_CHARACTERS_PER_SECOND', '20000'))
+# 'true' makes the TTS queue a priority queue, so early chunks of early chapters are synthesized first. The splitter,
+# chunker and TTS service must agree on it, and the existing queue must be deleted when it changes.
+TTS_PRIORITY_SCHEDULING = os.getenv('TTS_PRIORITY_SCHEDULING', 'false').lower() == 'true'
+# 'true' queues TTS jobs in per-book sub-queues in Redis, from which the TTS dispatcher feeds the TTS queue
+# round-robin over the books. The splitter, chunker and TTS service must agree on it.
+TTS_FAIR_SHARE = os.getenv('TTS_FAIR_SHARE', 'false').lower() == 'true'
+# Maximum number of jobs of one book dispatched to the TTS queue and not yet synthesized; 0 for no cap.
+TTS_FAIR_SHARE_MAX_IN_FLIGHT_PER_BOOK = int(os.getenv('TTS_FAIR_SHARE_MAX_IN_FLIGHT_PER_BOOK', '32'))
+# Number of jobs the dispatcher keeps waiting in the TTS queue: enough to keep every TTS worker busy, few enough that
+# a newly uploaded book gets its turn quickly.
+TTS_DISPATCH_QUEUE_DEPTH = int(os.getenv('TTS_DISPATCH_QUEUE_DEPTH', '64'))
+# Seconds the dispatcher waits before looking again when it has nothing to dispatch.
+TTS_DISPATCH_POLL_SECONDS = float(os.getenv('TTS_DISPATCH_POLL_SECONDS', '0.5'))
+# 'blocking' synthesizes one chunk at a time, 'async' keeps up to TTS_CONCURRENCY chunks in flight on an event loop.
+TTS_WORKER_MODE = os.getenv('TTS_WORKER_MODE', 'blocking')
+# Number of chunks a TTS pod processes at once in the 'async' worker mode.
+TTS_CONCURRENCY = int(os.getenv('TTS_CONCURRENCY', '16'))
+# 'true' paces Text-to-Speech API calls of every TTS pod with one adaptive token bucket in Redis.
+TTS_RATE_LIMIT = os.getenv('TTS_RATE_LIMIT', 'false').lower() == 'true'
+# Fleet-wide calls per second: at start, and the bounds the rate adapts between (the upper one is the API quota).
+TTS_RATE_LIMIT_INITIAL_RATE = float(os.getenv('TTS_RATE_LIMIT_INITIAL_RATE', '5'))
+TTS_RATE_LIMIT_MIN_RATE = float(os.getenv('TTS_RATE_LIMIT_MIN_RATE', '0.5'))
+TTS_RATE_LIMIT_MAX_RATE = float(os.getenv('TTS_RATE_LIMIT_MAX_RATE', '16'))
+# Number of calls the fleet may make at once after an idle period.
+TTS_RATE_LIMIT_BURST = int(os.getenv('TTS_RATE_LIMIT_BURST', '5'))
+# 'true' sends a duplicate of a Text-to-Speech API call that runs past TTS_HEDGE_PERCENTILE of the recent latencies.
+TTS_HEDGING = os.getenv('TTS_HEDGING', 'false').lower() == 'true'
+TTS_HEDGE_PERCENTILE = float(os.getenv('TTS_HEDGE_PERCENTILE', '95'))
+# Maximum share of the API calls, in percent, that may be hedged.
+TTS_HEDGE_BUDGET_PERCENT = float(os.getenv('TTS_HEDGE_BUDGET_PERCENT', '5'))
+# Number of API calls a TTS pod makes before it has enough latencies to hedge.
+TTS_HEDGE_MIN_SAMPLES = int(os.getenv('TTS_HEDGE_MIN_SAMPLES', '20'))
+# When a TTS job is skipped because its chunk's audio is already in GCS: 'redelivered' only checks messages the broker
+# redelivers after a crash or a requeue, 'always' checks every job, 'never' always synthesizes.
+TTS_SKIP_EXISTING_AUDIO = os.getenv('TTS_SKIP_EXISTING_AUDIO', 'redelivered').lower()
+# Chunks up to this many bytes are processed in memory; larger ones go through temporary files.
+TTS_IN_MEMORY_MAX_BYTES = int(os.getenv('TTS_IN_MEMORY_MAX_BYTES', str(1024 * 1024)))
+# Size bound in bytes of each TTS worker's in-process synthesis cache; 0 disables it.
+TTS_CACHE_MEMORY_BYTES = int(os.getenv('TTS_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+# 'true' shares synthesized audio between TTS workers through GCS.
+TTS_CACHE_PERSISTENT = os.getenv('TTS_CACHE_PERSISTENT', 'false').lower() == 'true'
+
 
 
 # ---- PostgreSQL connection setup ----
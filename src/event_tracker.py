@@ -113,6 +113,40 @@ def get_relationship(parent_key):
   return redis_client.smembers(parent_key)
 
 
+# ---- Content-addressed index of narrated books ----
+def index_completed_book(book_uuid):
+  """
+  Points the content key of a completed book at the book, so re-uploads of the same EPUB reuse its audio.
+  :param book_uuid: Unique identifier of the completed book.
+  """
+  content_key = redis_client.get(f"book:{book_uuid}:content_key")
+  if content_key:
+    redis_client.set(f"epub:{content_key}", book_uuid)
+    print(f"Indexed book {book_uuid} under content key {content_key}.")
+
+
+# ---- Book completion ----
+def complete_book_if_done(book_uuid):
+  """
+  Marks the book completed and indexes it once the splitter has finished and all of its chapters are completed.
+  Chapters are registered while the book is still being split, so the running total is final only after that.
+  :param book_uuid: Unique identifier of the book.
+  :return: True if the book is completed, False otherwise.
+  """
+  if not redis_client.exists(f"book:{book_uuid}:split_finished"):
+    return False
+
+  completed_count = int(redis_client.get(f"book:{book_uuid}:completed_chapters") or 0)
+  total_count = int(redis_client.get(f"book:{book_uuid}:total_chapters") or 0)
+  if completed_count < total_count:
+    return False
+
+  set_status("book", book_uuid, "completed")
+  index_completed_book(book_uuid)
+  print(f"Book {book_uuid} marked as completed.")
+  return True
+
+
 # ---- Implementation for different operations ----
 def add_book_impl(job):
   """
@@ -127,6 +161,11 @@ def add_book_impl(job):
   # Set the initial status of the book
   set_status("book", book_uuid, "uploaded")
 
+  # Remember the content key of the upload, so the book can be reused once it is narrated.
+  content_key = job.get("content_key")
+  if content_key:
+    redis_client.set(f"book:{book_uuid}:content_key", content_key)
+
   print(f"Book added: {book_uuid}")
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -142,6 +181,11 @@ def add_chapter_impl(job):
   # Define the Redis key for the chapter title.
   chapter_key = f"chapter:{chapter_uuid}"
 
+  # Chapter IDs are deterministic, so a retried split job re-sends chapters we already track.
+  if redis_client.exists(chapter_key):
+    print(f"Chapter {chapter_title} (uuid: {chapter_uuid}) is already registered under {book_uuid}, ignoring.")
+    return
+
   # Store chapter title in a Redis hash set.
   redis_client.hset(chapter_key, mapping={
     "title": chapter_title
@@ -188,6 +232,32 @@ def add_chunk_impl(job):
 
 # ---------------------------------------------------------------------------------------------------------------------
 
+def add_chunks_impl(job):
+  """
+  Handles the ADD_CHUNKS operation by adding all the chunks of a chapter to its tracking set in a single pipelined
+  transaction.
+
+  :param job: Dictionary containing book UUID, chapter UUID, and the list of chunk indices.
+  """
+  book_uuid = job.get("book_uuid")
+  chapter_uuid = job.get("chapter_uuid")
+  chunk_indices = job.get("chunk_indices")
+
+  if not book_uuid or not chapter_uuid or not chunk_indices:
+    raise ValueError("Missing required fields: book_uuid, chapter_uuid, chunk_indices.")
+
+  chunks_key = f"chapter:{chapter_uuid}:chunks"
+  with redis_client.pipeline() as pipeline:
+    # Set the initial status of every chunk
+    pipeline.mset({f"status:chunk:{chapter_uuid}:chunk_{chunk_index}": "queued" for chunk_index in chunk_indices})
+    # Add the chunk indices to the chapter's chunk tracking set
+    pipeline.sadd(chunks_key, *(f"chunk_{chunk_index}" for chunk_index in chunk_indices))
+    pipeline.execute()
+
+  print(f"{len(chunk_indices)} chunks added to chapter {chapter_uuid} under book {book_uuid}.")
+
+# ---------------------------------------------------------------------------------------------------------------------
+
 def update_book_status_impl(job):
   """
   Handles the UPDATE_BOOK_STATUS operation by updating the book ID in Redis.
@@ -233,16 +303,10 @@ def update_chapter_status_impl(job):
   # Increment completed chapter count if status is 'completed'
   if status == "completed":
     completed_key = f"book:{book_uuid}:completed_chapters"
-    total_key = f"book:{book_uuid}:total_chapters"
-
     redis_client.incr(completed_key)
-    completed_count = int(redis_client.get(completed_key))
-    total_count = int(redis_client.get(total_key))
 
     # Mark the book as completed if all chapters are done
-    if completed_count == total_count:
-      set_status("book", book_uuid, "completed")
-      print(f"Book {book_uuid} marked as completed.")
+    complete_book_if_done(book_uuid)
 
 # ---------------------------------------------------------------------------------------------------------------------
 
@@ -270,6 +334,28 @@ def update_chunk_status_impl(job):
 
 # ---------------------------------------------------------------------------------------------------------------------
 
+def split_finished_impl(job):
+  """
+  Handles the SPLIT_FINISHED operation by recording the final chapter count of the book, which lets it complete.
+
+  :param job: Dictionary containing book UUID and the total number of chapters.
+  """
+  book_uuid = job.get("book_uuid")
+  total_chapters = job.get("total_chapters")
+
+  if not book_uuid or total_chapters is None:
+    raise ValueError("Missing required fields: book_uuid, total_chapters.")
+
+  # The splitter's count also covers chapters a retried split job skipped, so it replaces the running total.
+  redis_client.set(f"book:{book_uuid}:total_chapters", total_chapters)
+  redis_client.set(f"book:{book_uuid}:split_finished", 1)
+  print(f"Book {book_uuid} has been split into {total_chapters} chapters.")
+
+  # Every chapter may already be completed by now.
+  complete_book_if_done(book_uuid)
+
+# ---------------------------------------------------------------------------------------------------------------------
+
 def remove_chapter_impl(job):
   """
   Handles the REMOVE_CHAPTER operation by marking the chapter as completed,
@@ -298,11 +384,12 @@ def remove_chapter_impl(job):
   redis_client.srem(chapters_key, chapter_uuid)
   print(f"Chapter {chapter_uuid} removed from book {book_uuid}'s tracking set.")
 
-  # Check if all chapters are completed
+  # Check if all chapters are completed; until the splitter has finished, more chapters may still be added.
   remaining_chapters = redis_client.scard(chapters_key)
-  if remaining_chapters == 0:
+  if remaining_chapters == 0 and redis_client.exists(f"book:{book_uuid}:split_finished"):
     print(f"All chapters for book {book_uuid} have been processed. Book processing is complete.")
     set_status("book", book_uuid, "completed")
+    index_completed_book(book_uuid)
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -311,6 +398,7 @@ def remove_chunk_impl(job):
   """
   Handles the REMOVE_CHUNK operation by marking the chunk as completed,
   removing it from the chapter's chunk set, and checking if the set is empty.
+  The stitch job of a chapter is queued once, however many times its last chunk is reported.
 
   :param job: Dictionary containing book UUID, chapter UUID, and chunk index.
   """
@@ -327,13 +415,22 @@ def remove_chunk_impl(job):
 
   # Remove the chunk from the chapter's set
   chunks_key = f"chapter:{chapter_uuid}:chunks"
-  redis_client.srem(chunks_key, f"chunk_{chunk_index}")
-  print(f"Chunk {chunk_index} removed from chapter {chapter_uuid}'s tracking set.")
+  if redis_client.srem(chunks_key, f"chunk_{chunk_index}") == 1:
+    print(f"Chunk {chunk_index} removed from chapter {chapter_uuid}'s tracking set.")
+  else:
+    print(f"Chunk {chunk_index} of chapter {chapter_uuid} was already removed.")
 
-  # Check if the set is empty
+  # Check if the set is empty. A repeated report still gets here: if the stitch job failed to publish, the requeued
+  # message is what queues it.
   remaining_chunks = redis_client.scard(chunks_key)
   if remaining_chunks == 0:
-    # Placeholder for adding an audio stitch job
+    # Marks a chapter whose stitch job is queued. It is set only once the publish went through, so a failed publish is
+    # retried; the tracker consumes one message at a time, so two reports never both get past the check.
+    stitch_queued_key = f"chapter:{chapter_uuid}:stitch_queued"
+    if redis_client.exists(stitch_queued_key):
+      print(f"Audio stitch job for chapter {chapter_uuid} is already queued.")
+      return
+
     print(f"All chunks for chapter {chapter_uuid} have been processed. Queueing audio stitch job.")
     try:
       message = audio_stitch_job(book_uuid, chapter_uuid)
@@ -346,6 +443,7 @@ def remove_chunk_impl(job):
       print(f"Added audio stitch job for chapter: {chapter_uuid} of book: {book_uuid}")
     except Exception as e:
       raise RuntimeError(f"Failed to enqueue job in Audio stitch queue: {e}")
+    redis_client.set(stitch_queued_key, 1)
 
 # ---------------------------------------------------------------------------------------------------------------------
 
@@ -368,12 +466,16 @@ def process_message(ch, method, properties, body):
         add_chapter_impl(job)
       case redis_ops.ADD_CHUNK:
         add_chunk_impl(job)
+      case redis_ops.ADD_CHUNKS:
+        add_chunks_impl(job)
       case redis_ops.UPDATE_BOOK_STATUS:
         update_book_status_impl(job)
       case redis_ops.UPDATE_CHAPTER_STATUS:
         update_chapter_status_impl(job)
       case redis_ops.UPDATE_CHUNK_STATUS:
         update_chunk_status_impl(job)
+      case redis_ops.SPLIT_FINISHED:
+        split_finished_impl(job)
       case redis_ops.REMOVE_CHAPTER:
         remove_chapter_impl(job)
       case redis_ops.REMOVE_CHUNK:
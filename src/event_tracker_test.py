@@ -2,11 +2,28 @@ import unittest
 from unittest.mock import patch, MagicMock
 import json
 from event_tracker import (
-    add_book_impl, add_chapter_impl, add_chunk_impl,
+    add_book_impl, add_chapter_impl, add_chunk_impl, add_chunks_impl,
     update_book_status_impl, update_chapter_status_impl, update_chunk_status_impl,
-    remove_chapter_impl, remove_chunk_impl, process_message
+    remove_chapter_impl, remove_chunk_impl, split_finished_impl, process_message
 )
 
+
+def fake_redis(mock_redis, sets):
+    """Backs the set and key commands of a mocked Redis client with in-memory sets and strings."""
+    values = {}
+
+    def srem(key, member):
+        members = sets.setdefault(key, set())
+        if member not in members:
+            return 0
+        members.remove(member)
+        return 1
+
+    mock_redis.srem.side_effect = srem
+    mock_redis.scard.side_effect = lambda key: len(sets.get(key, ()))
+    mock_redis.exists.side_effect = lambda key: int(key in values)
+    mock_redis.set.side_effect = lambda key, value: values.__setitem__(key, value)
+
 class TestEventTracker(unittest.TestCase):
 
     @patch('event_tracker.set_status')
@@ -15,16 +32,93 @@ class TestEventTracker(unittest.TestCase):
         add_book_impl(job)
         mock_set_status.assert_called_once_with("book", "test_book_uuid", "uploaded")
 
+    @patch('event_tracker.redis_client')
+    @patch('event_tracker.set_status')
+    def test_add_book_impl_with_content_key(self, mock_set_status, mock_redis):
+        add_book_impl({"book_uuid": "test_book_uuid", "content_key": "abc"})
+        mock_redis.set.assert_called_once_with("book:test_book_uuid:content_key", "abc")
+
+    @patch('event_tracker.redis_client')
+    @patch('event_tracker.set_status')
+    def test_update_chapter_status_impl_indexes_completed_book(self, mock_set_status, mock_redis):
+        values = {"book:test_book_uuid:completed_chapters": "2", "book:test_book_uuid:total_chapters": "2",
+                  "book:test_book_uuid:content_key": "abc"}
+        mock_redis.get.side_effect = values.get
+        mock_redis.exists.return_value = 1
+        job = {"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid", "status": "completed"}
+        update_chapter_status_impl(job)
+        mock_set_status.assert_called_with("book", "test_book_uuid", "completed")
+        mock_redis.set.assert_called_once_with("epub:abc", "test_book_uuid")
+
+    @patch('event_tracker.redis_client')
+    @patch('event_tracker.set_status')
+    def test_update_chapter_status_impl_waits_for_split(self, mock_set_status, mock_redis):
+        # The first chapter finished while the splitter was still registering the others.
+        values = {"book:test_book_uuid:completed_chapters": "1", "book:test_book_uuid:total_chapters": "1",
+                  "book:test_book_uuid:content_key": "abc"}
+        mock_redis.get.side_effect = values.get
+        mock_redis.exists.return_value = 0
+        job = {"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid", "status": "completed"}
+        update_chapter_status_impl(job)
+        mock_set_status.assert_called_once_with("chapter", "test_chapter_uuid", "completed")
+        mock_redis.set.assert_not_called()
+
+    @patch('event_tracker.redis_client')
+    @patch('event_tracker.set_status')
+    def test_split_finished_impl(self, mock_set_status, mock_redis):
+        values = {"book:test_book_uuid:completed_chapters": "2", "book:test_book_uuid:content_key": "abc"}
+        mock_redis.get.side_effect = values.get
+        mock_redis.set.side_effect = values.__setitem__
+        mock_redis.exists.side_effect = lambda key: int(key in values)
+        mock_redis.incr.side_effect = lambda key: values.__setitem__(key, str(int(values.get(key, 0)) + 1))
+
+        split_finished_impl({"book_uuid": "test_book_uuid", "total_chapters": 3})
+        self.assertEqual(values["book:test_book_uuid:total_chapters"], 3)
+        mock_set_status.assert_not_called()
+        self.assertNotIn("epub:abc", values)
+
+        # The last chapter completes after the split finished.
+        update_chapter_status_impl({"book_uuid": "test_book_uuid", "chapter_uuid": "c3", "status": "completed"})
+        mock_set_status.assert_called_with("book", "test_book_uuid", "completed")
+        self.assertEqual(values["epub:abc"], "test_book_uuid")
+
+    @patch('event_tracker.redis_client')
+    @patch('event_tracker.set_status')
+    def test_split_finished_impl_after_all_chapters(self, mock_set_status, mock_redis):
+        values = {"book:test_book_uuid:completed_chapters": "2", "book:test_book_uuid:total_chapters": "2",
+                  "book:test_book_uuid:content_key": "abc"}
+        mock_redis.get.side_effect = values.get
+        mock_redis.set.side_effect = values.__setitem__
+        mock_redis.exists.side_effect = lambda key: int(key in values)
+
+        # Every chapter was completed before the marker arrived.
+        split_finished_impl({"book_uuid": "test_book_uuid", "total_chapters": 2})
+        mock_set_status.assert_called_once_with("book", "test_book_uuid", "completed")
+        self.assertEqual(values["epub:abc"], "test_book_uuid")
+
     @patch('event_tracker.redis_client')
     @patch('event_tracker.set_status')
     @patch('event_tracker.add_relationship')
     def test_add_chapter_impl(self, mock_add_relationship, mock_set_status, mock_redis):
         job = {"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid", "chapter_title": "Test Chapter"}
+        mock_redis.exists.return_value = 0
         add_chapter_impl(job)
         mock_redis.hset.assert_called_once()
         mock_set_status.assert_called_once_with("chapter", "test_chapter_uuid", "uploaded")
         mock_add_relationship.assert_called_once()
 
+    @patch('event_tracker.redis_client')
+    @patch('event_tracker.set_status')
+    @patch('event_tracker.add_relationship')
+    def test_add_chapter_impl_known_chapter(self, mock_add_relationship, mock_set_status, mock_redis):
+        job = {"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid", "chapter_title": "Test Chapter"}
+        mock_redis.exists.return_value = 1
+        add_chapter_impl(job)
+        mock_redis.hset.assert_not_called()
+        mock_redis.incr.assert_not_called()
+        mock_set_status.assert_not_called()
+        mock_add_relationship.assert_not_called()
+
     @patch('event_tracker.set_status')
     @patch('event_tracker.add_relationship')
     def test_add_chunk_impl(self, mock_add_relationship, mock_set_status):
@@ -33,6 +127,33 @@ class TestEventTracker(unittest.TestCase):
         mock_set_status.assert_called_once_with("chunk", "test_chapter_uuid:chunk_1", "queued")
         mock_add_relationship.assert_called_once()
 
+    @patch('event_tracker.redis_client')
+    def test_add_chunks_impl(self, mock_redis):
+        pipeline = mock_redis.pipeline.return_value.__enter__.return_value
+        job = {"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid", "chunk_indices": [1, 2, 3]}
+        add_chunks_impl(job)
+        pipeline.mset.assert_called_once_with({
+            "status:chunk:test_chapter_uuid:chunk_1": "queued",
+            "status:chunk:test_chapter_uuid:chunk_2": "queued",
+            "status:chunk:test_chapter_uuid:chunk_3": "queued",
+        })
+        pipeline.sadd.assert_called_once_with("chapter:test_chapter_uuid:chunks", "chunk_1", "chunk_2", "chunk_3")
+        pipeline.execute.assert_called_once()
+        mock_redis.set.assert_not_called()
+
+    def test_add_chunks_impl_missing_indices(self):
+        with self.assertRaises(ValueError):
+            add_chunks_impl({"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid", "chunk_indices": []})
+
+    @patch('event_tracker.add_chunks_impl')
+    def test_process_message_add_chunks(self, mock_add_chunks):
+        ch = MagicMock()
+        method = MagicMock()
+        body = json.dumps({"operation": "add_chunks", "book_uuid": "b", "chapter_uuid": "c", "chunk_indices": [1, 2]})
+        process_message(ch, method, MagicMock(), body)
+        mock_add_chunks.assert_called_once_with(json.loads(body))
+        ch.basic_ack.assert_called_once()
+
     @patch('event_tracker.set_status')
     def test_update_book_status_impl(self, mock_set_status):
         job = {"book_uuid": "test_book_uuid", "status": "in_progress"}
@@ -57,6 +178,7 @@ class TestEventTracker(unittest.TestCase):
     def test_remove_chapter_impl(self, mock_channel, mock_set_status, mock_redis):
         job = {"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid"}
         mock_redis.scard.return_value = 0
+        mock_redis.exists.return_value = 1
         remove_chapter_impl(job)
         mock_set_status.assert_called_with("book", "test_book_uuid", "completed")
 
@@ -65,11 +187,44 @@ class TestEventTracker(unittest.TestCase):
     @patch('event_tracker.channel')
     def test_remove_chunk_impl(self, mock_channel, mock_set_status, mock_redis):
         job = {"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid", "chunk_index": 1}
+        mock_redis.srem.return_value = 1
         mock_redis.scard.return_value = 0
+        mock_redis.exists.return_value = 0
         remove_chunk_impl(job)
         mock_set_status.assert_called_with("chunk", "test_chapter_uuid:chunk_1", "completed")
         mock_channel.basic_publish.assert_called_once()
 
+    @patch('event_tracker.redis_client')
+    @patch('event_tracker.set_status')
+    @patch('event_tracker.channel')
+    def test_remove_chunk_impl_twice_stitches_once(self, mock_channel, mock_set_status, mock_redis):
+        # The last chunk of a chapter, reported again by a redelivered TTS job.
+        fake_redis(mock_redis, {"chapter:test_chapter_uuid:chunks": {"chunk_1"}})
+        job = {"book_uuid": "test_book_uuid", "chapter_uuid": "test_chapter_uuid", "chunk_index": 1}
+
+        remove_chunk_impl(job)
+        remove_chunk_impl(job)
+
+        mock_channel.basic_publish.assert_called_once()
+
+    @patch('event_tracker.redis_client')
+    @patch('event_tracker.set_status')
+    @patch('event_tracker.channel')
+    def test_remove_chunk_impl_retries_failed_stitch_publish(self, mock_channel, mock_set_status, mock_redis):
+        fake_redis(mock_redis, {"chapter:test_chapter_uuid:chunks": {"chunk_1"}})
+        mock_channel.basic_publish.side_effect = [ConnectionError("Channel closed"), None]
+        body = json.dumps({"operation": "remove_chunk", "book_uuid": "test_book_uuid",
+                           "chapter_uuid": "test_chapter_uuid", "chunk_index": 1})
+        ch = MagicMock()
+
+        # The publish fails, so the message is requeued; its redelivery finds the chunk already removed.
+        process_message(ch, MagicMock(delivery_tag=1), MagicMock(), body)
+        ch.basic_nack.assert_called_once_with(delivery_tag=1, requeue=True)
+        process_message(ch, MagicMock(delivery_tag=2), MagicMock(), body)
+
+        self.assertEqual(mock_channel.basic_publish.call_count, 2)
+        ch.basic_ack.assert_called_once_with(delivery_tag=2)
+
     @patch('event_tracker.add_book_impl')
     @patch('event_tracker.add_chapter_impl')
     @patch('event_tracker.add_chunk_impl')
@@ -0,0 +1,174 @@
+# ---- Per-book fair-share scheduling of TTS jobs, shared by every service through Redis. ----
+# Every book gets its own sub-queue of TTS jobs, and the books with queued jobs are served round-robin: one job per
+# book per turn, so a 1,000-chapter book no longer starves the books uploaded after it. Within a book, jobs come out by
+# priority (messages.tts_job_priority), so a book's opening chapters and previews still go first. A cap on the chunks of
+# a book in flight (dispatched but not yet synthesized) keeps concurrent books making proportional progress.
+import json
+
+# Sequence numbers keep jobs of equal priority in FIFO order; a sub-queue's score is -priority * SEQUENCE_SPAN plus the
+# job's sequence number, which a Redis score (a double) holds exactly. Sequence numbers wrap every 2^40 jobs.
+SEQUENCE_SPAN = 2 ** 40
+
+# Queues a job on its book's sub-queue, a sorted set served lowest score first, and puts the book on the round-robin
+# ring if it was not on it.
+#
+# KEYS[1]: book's sub-queue, KEYS[2]: set of books on the ring, KEYS[3]: ring, KEYS[4]: sequence counter. ARGV: book,
+# job, priority (0 for none), sequence span.
+ENQUEUE_SCRIPT = """
+local sequence = redis.call('INCR', KEYS[4]) % tonumber(ARGV[4])
+redis.call('ZADD', KEYS[1], -tonumber(ARGV[3]) * tonumber(ARGV[4]) + sequence, ARGV[2])
+if redis.call('SADD', KEYS[2], ARGV[1]) == 1 then
+  redis.call('RPUSH', KEYS[3], ARGV[1])
+end
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# Takes up to a number of jobs round-robin over the books on the ring, the most urgent job of each book first, skipping
+# books at their in-flight cap, and adds the chunk of every job taken to its book's in-flight set. Books whose sub-queue
+# runs empty leave the ring.
+#
+# KEYS[1]: set of books on the ring, KEYS[2]: ring. ARGV: key prefix, maximum number of jobs, in-flight cap per book
+# (0 for no cap). Returns a flat list of book, job, book, job...
+DISPATCH_SCRIPT = """
+local prefix = ARGV[1]
+local wanted = tonumber(ARGV[2])
+local cap = tonumber(ARGV[3])
+local taken = {}
+local count = 0
+local progress = true
+while count < wanted and progress do
+  progress = false
+  local books = redis.call('LLEN', KEYS[2])
+  for _ = 1, books do
+    if count >= wanted then
+      break
+    end
+    local book = redis.call('RPOPLPUSH', KEYS[2], KEYS[2])
+    if not book then
+      break
+    end
+    local in_flight_key = prefix .. ':in_flight:' .. book
+    local queue_key = prefix .. ':queue:' .. book
+    if cap == 0 or redis.call('SCARD', in_flight_key) < cap then
+      local popped = redis.call('ZPOPMIN', queue_key)
+      if popped[1] then
+        local job = popped[1]
+        redis.call('SADD', in_flight_key, cjson.decode(job)['chunk'])
+        redis.call('EXPIRE', in_flight_key, 86400)
+        table.insert(taken, book)
+        table.insert(taken, job)
+        count = count + 1
+        progress = true
+      end
+      if redis.call('ZCARD', queue_key) == 0 then
+        redis.call('LREM', KEYS[2], 1, book)
+        redis.call('SREM', KEYS[1], book)
+      end
+    end
+  end
+end
+return taken
+"""
+
+
+def chunk_id(chapter_uuid, chunk_index):
+  """
+  :return: Member of a book's in-flight set for a chunk
+  """
+  return f"{chapter_uuid}:{chunk_index}"
+
+
+class FairScheduler:
+  """
+  Per-book sub-queues of TTS jobs in Redis. Producers enqueue jobs, a single dispatcher takes them fairly and
+  publishes them to the TTS queue, and the TTS workers release every job they finish.
+  """
+
+  def __init__(self, redis_client, max_in_flight_per_book=0, prefix='tts:fair'):
+    """
+    :param redis_client: Redis client
+    :param max_in_flight_per_book: Maximum number of jobs of one book dispatched but not yet released; 0 for no cap
+    :param prefix: Prefix of the scheduler's Redis keys
+    """
+    self.redis_client = redis_client
+    self.max_in_flight_per_book = max_in_flight_per_book
+    self.prefix = prefix
+    self.books_key = f"{prefix}:books"
+    self.ring_key = f"{prefix}:ring"
+    self.sequence_key = f"{prefix}:sequence"
+    self.enqueue_script = redis_client.register_script(ENQUEUE_SCRIPT)
+    self.dispatch_script = redis_client.register_script(DISPATCH_SCRIPT)
+
+  def queue_key(self, book_uuid):
+    return f"{self.prefix}:queue:{book_uuid}"
+
+  def in_flight_key(self, book_uuid):
+    return f"{self.prefix}:in_flight:{book_uuid}"
+
+  def enqueue(self, book_uuid, message, priority=None):
+    """
+    Queues a TTS job on its book's sub-queue, behind the book's jobs of the same or a higher priority.
+
+    :param book_uuid: UUID of the book
+    :param message: TTS job message
+    :param priority: Priority to publish the job with, or None
+    :return: Number of jobs of the book queued
+    """
+    job = json.dumps({
+      "message": message,
+      "priority": priority,
+      "chunk": chunk_id(message["chapter_uuid"], message["chunk_index"]),
+    })
+    return int(self.enqueue_script(
+      keys=[self.queue_key(book_uuid), self.books_key, self.ring_key, self.sequence_key],
+      args=[book_uuid, job, priority or 0, SEQUENCE_SPAN]
+    ))
+
+  def dispatch(self, max_jobs):
+    """
+    Takes up to max_jobs jobs, round-robin over the books, and counts their chunks as in flight. A job taken is out of
+    Redis, so it must be published right away.
+
+    :param max_jobs: Maximum number of jobs to take
+    :return: List of (book UUID, message, priority) tuples, in the order they should be published
+    """
+    if max_jobs <= 0:
+      return []
+    taken = self.dispatch_script(keys=[self.books_key, self.ring_key],
+                                 args=[self.prefix, max_jobs, self.max_in_flight_per_book])
+    jobs = []
+    for book_uuid, job in zip(taken[::2], taken[1::2]):
+      job = json.loads(job)
+      jobs.append((book_uuid, job["message"], job["priority"]))
+    return jobs
+
+  def release(self, book_uuid, chapter_uuid, chunk_index):
+    """
+    Counts a chunk of the book as done, which frees a place under its in-flight cap. Releasing a chunk again, e.g. on
+    a redelivery of its job, changes nothing. Never raises: a missed release only holds the book back until its
+    in-flight set expires.
+
+    :param book_uuid: UUID of the book
+    :param chapter_uuid: UUID of the chunk's chapter
+    :param chunk_index: Index of the chunk in its chapter
+    """
+    try:
+      self.redis_client.srem(self.in_flight_key(book_uuid), chunk_id(chapter_uuid, chunk_index))
+    except Exception as e:
+      print(f"Failed to release chunk {chunk_index} of chapter {chapter_uuid} of book {book_uuid}: {e}")
+
+  def backlog(self):
+    """
+    :return: Dict of book UUID -> {"queued": jobs waiting in its sub-queue, "in_flight": jobs dispatched and not yet
+             done}, for every book with queued jobs
+    """
+    books = sorted(self.redis_client.smembers(self.books_key))
+    pipeline = self.redis_client.pipeline()
+    for book_uuid in books:
+      pipeline.zcard(self.queue_key(book_uuid))
+      pipeline.scard(self.in_flight_key(book_uuid))
+    counts = pipeline.execute()
+    return {
+      book_uuid: {"queued": int(queued), "in_flight": int(in_flight)}
+      for book_uuid, queued, in_flight in zip(books, counts[::2], counts[1::2])
+    }
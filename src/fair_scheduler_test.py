@@ -0,0 +1,86 @@
+import json
+import unittest
+from unittest.mock import MagicMock
+
+from fair_scheduler import FairScheduler, ENQUEUE_SCRIPT, DISPATCH_SCRIPT, SEQUENCE_SPAN
+
+
+def make_scheduler(max_in_flight_per_book=2):
+    redis_client = MagicMock()
+    scripts = {script: MagicMock(name=name) for script, name in
+               ((ENQUEUE_SCRIPT, 'enqueue'), (DISPATCH_SCRIPT, 'dispatch'))}
+    redis_client.register_script.side_effect = scripts.get
+    scheduler = FairScheduler(redis_client, max_in_flight_per_book)
+    return scheduler, redis_client, scripts
+
+
+class TestFairScheduler(unittest.TestCase):
+
+    def test_enqueue_uses_the_book_sub_queue(self):
+        scheduler, _, scripts = make_scheduler()
+        scripts[ENQUEUE_SCRIPT].return_value = 3
+        message = {"book_uuid": "book-1", "chapter_uuid": "chapter-1", "chunk_index": 4}
+
+        self.assertEqual(scheduler.enqueue("book-1", message, priority=7), 3)
+
+        kwargs = scripts[ENQUEUE_SCRIPT].call_args.kwargs
+        self.assertEqual(kwargs["keys"],
+                         ["tts:fair:queue:book-1", "tts:fair:books", "tts:fair:ring", "tts:fair:sequence"])
+        book_uuid, job, priority, span = kwargs["args"]
+        self.assertEqual((book_uuid, priority, span), ("book-1", 7, SEQUENCE_SPAN))
+        self.assertEqual(json.loads(job), {"message": message, "priority": 7, "chunk": "chapter-1:4"})
+
+    def test_enqueue_without_priority(self):
+        scheduler, _, scripts = make_scheduler()
+        scheduler.enqueue("book-1", {"book_uuid": "book-1", "chapter_uuid": "chapter-1", "chunk_index": 4})
+        self.assertEqual(scripts[ENQUEUE_SCRIPT].call_args.kwargs["args"][2], 0)
+
+    def test_dispatch_returns_jobs_in_order(self):
+        scheduler, _, scripts = make_scheduler(max_in_flight_per_book=2)
+        jobs = [("book-1", {"chunk_index": 1}, 9), ("book-2", {"chunk_index": 1}, None), ("book-1", {"chunk_index": 2}, 9)]
+        taken = []
+        for book_uuid, message, priority in jobs:
+            taken += [book_uuid, json.dumps({"message": message, "priority": priority})]
+        scripts[DISPATCH_SCRIPT].return_value = taken
+
+        self.assertEqual(scheduler.dispatch(5), jobs)
+        scripts[DISPATCH_SCRIPT].assert_called_once_with(keys=["tts:fair:books", "tts:fair:ring"],
+                                                         args=["tts:fair", 5, 2])
+
+    def test_dispatch_nothing_wanted(self):
+        scheduler, _, scripts = make_scheduler()
+        self.assertEqual(scheduler.dispatch(0), [])
+        self.assertEqual(scheduler.dispatch(-3), [])
+        scripts[DISPATCH_SCRIPT].assert_not_called()
+
+    def test_release_is_idempotent_per_chunk(self):
+        scheduler, redis_client, _ = make_scheduler()
+        in_flight = {"chapter-1:1", "chapter-1:2"}
+        redis_client.srem.side_effect = lambda key, member: in_flight.discard(member)
+
+        # A redelivered chunk is released twice, and frees a single place.
+        scheduler.release("book-1", "chapter-1", 1)
+        scheduler.release("book-1", "chapter-1", 1)
+
+        self.assertEqual(in_flight, {"chapter-1:2"})
+        redis_client.srem.assert_called_with("tts:fair:in_flight:book-1", "chapter-1:1")
+
+    def test_release_never_raises(self):
+        scheduler, redis_client, _ = make_scheduler()
+        redis_client.srem.side_effect = ConnectionError("Redis is down")
+        scheduler.release("book-1", "chapter-1", 1)
+
+    def test_backlog(self):
+        scheduler, redis_client, _ = make_scheduler()
+        redis_client.smembers.return_value = {"book-2", "book-1"}
+        redis_client.pipeline.return_value.execute.return_value = [120, 2, 3, 0]
+
+        self.assertEqual(scheduler.backlog(), {
+            "book-1": {"queued": 120, "in_flight": 2},
+            "book-2": {"queued": 3, "in_flight": 0},
+        })
+        redis_client.smembers.assert_called_once_with("tts:fair:books")
+
+
+if __name__ == '__main__':
+    unittest.main()
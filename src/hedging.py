@@ -0,0 +1,213 @@
+# ---- Hedged requests: a duplicate of a call that runs slower than usual, the first answer wins. ----
+# A chapter is only stitched once its slowest chunk is done, so a single straggling API call holds the whole chapter
+# back. The hedger learns the latency distribution of the calls and, when a call runs past a high percentile of it,
+# sends the same call again. A budget keeps hedges to a small share of the calls, so hedging never multiplies the load
+# on an API that is slow for everyone.
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class LatencyTracker:
+  """Latencies of the most recent successful calls."""
+
+  def __init__(self, window=1000, min_samples=20):
+    """
+    :param window: Number of recent latencies kept
+    :param min_samples: Number of latencies needed before percentiles are reported
+    """
+    self.latencies = deque(maxlen=window)
+    self.min_samples = min_samples
+    self.lock = threading.Lock()
+
+  def record(self, seconds):
+    with self.lock:
+      self.latencies.append(seconds)
+
+  def percentile(self, percent):
+    """
+    :param percent: Percentile between 0 and 100
+    :return: Latency in seconds under which percent of the recent calls finished, or None while there are too few
+    """
+    with self.lock:
+      if len(self.latencies) < self.min_samples:
+        return None
+      ordered = sorted(self.latencies)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class HedgeBudget:
+  """
+  Caps hedges to a share of the calls: every call earns a fraction of a hedge, and every hedge spends a whole one.
+  """
+
+  def __init__(self, percent, burst=10):
+    """
+    :param percent: Maximum share of the calls, in percent, that may be hedged
+    :param burst: Maximum number of hedges saved up, which may be spent at once
+    """
+    self.earn_rate = percent / 100
+    self.burst = burst
+    self.balance = 0.0
+    self.lock = threading.Lock()
+
+  def earn(self):
+    with self.lock:
+      self.balance = min(self.burst, self.balance + self.earn_rate)
+
+  def spend(self):
+    """
+    :return: True if a hedge may be sent, which then counts against the budget
+    """
+    with self.lock:
+      if self.balance < 1:
+        return False
+      self.balance -= 1
+      return True
+
+  def refund(self):
+    """
+    Gives back a hedge spent on an attempt that was not sent after all.
+    """
+    with self.lock:
+      self.balance = min(self.burst, self.balance + 1)
+
+
+class Hedger:
+  """
+  Runs calls with hedging, blocking (call) or on an event loop (call_async). Both attempts of a hedged call are the
+  same call, so the callee must be safe to run twice.
+  """
+
+  def __init__(self, percentile=95, budget_percent=5, window=1000, min_samples=20, admit_hedge=None, max_workers=32):
+    """
+    :param percentile: A call still running after this percentile of the recent latencies is hedged
+    :param budget_percent: Maximum share of the calls, in percent, that may be hedged
+    :param window: Number of recent latencies the percentile is computed over
+    :param min_samples: Number of calls made before the first hedge
+    :param admit_hedge: Optional callable with the final say on each hedge, e.g. to respect a rate limit
+    :param max_workers: Threads running the attempts of blocking calls, including the losers still finishing
+    """
+    self.percentile = percentile
+    self.tracker = LatencyTracker(window, min_samples)
+    self.budget = HedgeBudget(budget_percent)
+    self.admit_hedge = admit_hedge
+    self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedger")
+    self.lock = threading.Lock()
+    self.calls = 0
+    self.hedges = 0
+    self.hedge_wins = 0
+
+  def hedge_delay(self):
+    """
+    Counts a new call and tells when it should be hedged.
+
+    :return: Seconds after which the call is hedged, or None while there are too few latencies to tell
+    """
+    self.budget.earn()
+    with self.lock:
+      self.calls += 1
+    return self.tracker.percentile(self.percentile)
+
+  def may_hedge(self):
+    # Reserve the hedge before asking admit_hedge, which may take a rate limit token of its own, and give it back if
+    # the hedge is refused: only hedges actually sent count against the budget.
+    if not self.budget.spend():
+      return False
+    if self.admit_hedge is not None and not self.admit_hedge():
+      self.budget.refund()
+      return False
+    with self.lock:
+      self.hedges += 1
+    return True
+
+  def record_winner(self, is_hedge):
+    if is_hedge:
+      with self.lock:
+        self.hedge_wins += 1
+
+  def timed(self, function, *args):
+    start = time.monotonic()
+    result = function(*args)
+    self.tracker.record(time.monotonic() - start)
+    return result
+
+  def call(self, function, *args):
+    """
+    Calls function(*args) on a worker thread and hedges it if it runs too long.
+
+    :return: Result of the first attempt that succeeds; if both fail, the first attempt's error is raised
+    """
+    delay = self.hedge_delay()
+    primary = self.executor.submit(self.timed, function, *args)
+    if delay is None:
+      return primary.result()
+
+    done, _ = wait([primary], timeout=delay)
+    if done or not self.may_hedge():
+      return primary.result()
+
+    print(f"Call running for over {delay:.2f}s (p{self.percentile:g}); sending a hedge")
+    attempts = [primary, self.executor.submit(self.timed, function, *args)]
+    pending = set(attempts)
+    while pending:
+      done, pending = wait(pending, return_when=FIRST_COMPLETED)
+      for attempt in done:
+        if attempt.exception() is None:
+          # The loser cannot be cancelled once running; it finishes on its thread and still records its latency.
+          self.record_winner(attempt is attempts[1])
+          return attempt.result()
+    return primary.result()
+
+  async def timed_async(self, function, *args):
+    start = time.monotonic()
+    result = await function(*args)
+    self.tracker.record(time.monotonic() - start)
+    return result
+
+  async def call_async(self, function, *args):
+    """
+    Same as call, for a coroutine function on the running event loop. The losing attempt is cancelled.
+    """
+    delay = self.hedge_delay()
+    started_at = time.monotonic()
+    primary = asyncio.ensure_future(self.timed_async(function, *args))
+    if delay is None:
+      return await primary
+
+    done, _ = await asyncio.wait([primary], timeout=delay)
+    if done or not await asyncio.to_thread(self.may_hedge):
+      return await primary
+
+    print(f"Call running for over {delay:.2f}s (p{self.percentile:g}); sending a hedge")
+    attempts = [primary, asyncio.ensure_future(self.timed_async(function, *args))]
+    pending = set(attempts)
+    try:
+      while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for attempt in done:
+          if attempt.exception() is None:
+            self.record_winner(attempt is attempts[1])
+            if primary in pending:
+              # The primary's latency is at least this long; recording it keeps the slow tail in the distribution.
+              self.tracker.record(time.monotonic() - started_at)
+            return attempt.result()
+      return primary.result()
+    finally:
+      for attempt in pending:
+        attempt.cancel()
+
+  def stats(self):
+    """
+    :return: Dict with the call and hedge counters and the current hedging threshold
+    """
+    with self.lock:
+      return {
+        "calls": self.calls,
+        "hedges": self.hedges,
+        "hedge_wins": self.hedge_wins,
+        "hedge_rate": self.hedges / self.calls if self.calls else 0.0,
+        "threshold_seconds": self.tracker.percentile(self.percentile),
+      }
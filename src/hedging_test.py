@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from hedging import Hedger, HedgeBudget, LatencyTracker
+
+
+def warmed_up_hedger(latency=0.01, **kwargs):
+    """A hedger whose recent calls all took latency seconds, so it hedges calls running past it."""
+    hedger = Hedger(min_samples=5, **kwargs)
+    for _ in range(5):
+        hedger.tracker.record(latency)
+    hedger.budget.balance = hedger.budget.burst
+    return hedger
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def test_percentile_needs_min_samples(self):
+        tracker = LatencyTracker(window=100, min_samples=3)
+        tracker.record(1.0)
+        tracker.record(2.0)
+        self.assertIsNone(tracker.percentile(95))
+        tracker.record(3.0)
+        self.assertEqual(tracker.percentile(95), 3.0)
+        self.assertEqual(tracker.percentile(0), 1.0)
+
+    def test_window_keeps_recent_latencies(self):
+        tracker = LatencyTracker(window=10, min_samples=1)
+        for seconds in range(100):
+            tracker.record(float(seconds))
+        self.assertEqual(tracker.percentile(0), 90.0)
+        self.assertEqual(tracker.percentile(50), 95.0)
+
+
+class TestHedgeBudget(unittest.TestCase):
+
+    def test_budget_caps_hedges_to_share_of_calls(self):
+        budget = HedgeBudget(percent=5, burst=10)
+        hedges = 0
+        for _ in range(1000):
+            budget.earn()
+            hedges += budget.spend()
+        self.assertEqual(hedges, 50)
+
+    def test_budget_saves_up_to_burst(self):
+        budget = HedgeBudget(percent=50, burst=2)
+        for _ in range(100):
+            budget.earn()
+        self.assertTrue(budget.spend())
+        self.assertTrue(budget.spend())
+        self.assertFalse(budget.spend())
+
+
+class TestHedger(unittest.TestCase):
+
+    def test_fast_call_is_not_hedged(self):
+        hedger = warmed_up_hedger(latency=1.0)
+        function = MagicMock(return_value='audio')
+        self.assertEqual(hedger.call(function, 'text'), 'audio')
+        function.assert_called_once_with('text')
+        self.assertEqual(hedger.stats()['hedges'], 0)
+
+    def test_no_hedge_before_min_samples(self):
+        hedger = Hedger(min_samples=5)
+        hedger.budget.balance = hedger.budget.burst
+        function = MagicMock(side_effect=lambda text: time.sleep(0.05) or 'audio')
+        self.assertEqual(hedger.call(function, 'text'), 'audio')
+        function.assert_called_once()
+
+    def test_straggler_is_hedged_and_hedge_wins(self):
+        hedger = warmed_up_hedger()
+        release_primary = threading.Event()
+        calls = []
+
+        def function(text):
+            calls.append(text)
+            if len(calls) == 1:
+                release_primary.wait(5)
+                return 'primary audio'
+            return 'hedge audio'
+
+        start = time.monotonic()
+        self.assertEqual(hedger.call(function, 'text'), 'hedge audio')
+        self.assertLess(time.monotonic() - start, 1)
+        release_primary.set()
+        stats = hedger.stats()
+        self.assertEqual((stats['calls'], stats['hedges'], stats['hedge_wins']), (1, 1, 1))
+
+    def test_failed_attempt_waits_for_the_other(self):
+        hedger = warmed_up_hedger()
+        calls = []
+
+        def function(text):
+            calls.append(text)
+            if len(calls) == 1:
+                time.sleep(0.1)
+                return 'primary audio'
+            raise RuntimeError('hedge failed')
+
+        self.assertEqual(hedger.call(function, 'text'), 'primary audio')
+        self.assertEqual(hedger.stats()['hedge_wins'], 0)
+
+    def test_both_attempts_fail(self):
+        hedger = warmed_up_hedger()
+
+        def function(text):
+            time.sleep(0.05)
+            raise RuntimeError('API down')
+
+        with self.assertRaisesRegex(RuntimeError, 'API down'):
+            hedger.call(function, 'text')
+
+    def test_hedge_respects_budget_and_admission(self):
+        hedger = warmed_up_hedger()
+        hedger.budget.balance = 0
+        function = MagicMock(side_effect=lambda text: time.sleep(0.05) or 'audio')
+        self.assertEqual(hedger.call(function, 'text'), 'audio')
+        self.assertEqual(function.call_count, 1)
+
+        hedger = warmed_up_hedger(admit_hedge=lambda: False)
+        function = MagicMock(side_effect=lambda text: time.sleep(0.05) or 'audio')
+        self.assertEqual(hedger.call(function, 'text'), 'audio')
+        self.assertEqual(function.call_count, 1)
+        self.assertEqual(hedger.stats()['hedges'], 0)
+
+    def test_refused_hedge_keeps_the_budget(self):
+        hedger = warmed_up_hedger(admit_hedge=lambda: False)
+        balance = hedger.budget.balance
+        self.assertFalse(hedger.may_hedge())
+        self.assertEqual(hedger.budget.balance, balance)
+
+    def test_empty_budget_skips_admission(self):
+        admit_hedge = MagicMock(return_value=True)
+        hedger = warmed_up_hedger(admit_hedge=admit_hedge)
+        hedger.budget.balance = 0.5
+        self.assertFalse(hedger.may_hedge())
+        admit_hedge.assert_not_called()
+        self.assertEqual(hedger.budget.balance, 0.5)
+
+    def test_call_async_cancels_the_loser(self):
+        hedger = warmed_up_hedger()
+        cancelled = []
+
+        async def function(text):
+            if not cancelled:
+                cancelled.append(False)
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled[0] = True
+                    raise
+                return 'primary audio'
+            return 'hedge audio'
+
+        async def run():
+            audio = await hedger.call_async(function, 'text')
+            await asyncio.sleep(0)
+            return audio
+
+        self.assertEqual(asyncio.run(run()), 'hedge audio')
+        self.assertEqual(cancelled, [True])
+        self.assertEqual(hedger.stats()['hedge_wins'], 1)
+        # The cancelled primary still counts in the distribution, as at least the time it ran.
+        self.assertEqual(len(hedger.tracker.latencies), 7)
+
+    def test_call_async_fast_call(self):
+        hedger = warmed_up_hedger(latency=1.0)
+
+        async def function(text):
+            return 'audio'
+
+        self.assertEqual(asyncio.run(hedger.call_async(function, 'text')), 'audio')
+        self.assertEqual(hedger.stats()['hedges'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
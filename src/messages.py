@@ -1,23 +1,43 @@
 # ---- Define all the messages that are passed between the services. ----
+import base64
+import zlib
+
 import redis_ops
 # ---- Inter-service messages ----
-def split_job(book_uuid):
-  return {
+def split_job(book_uuid, preview=False):
+  message = {
     "book_uuid": book_uuid
   }
+  # A listener is waiting for the opening of the book, see tts_job_priority.
+  if preview:
+    message["preview"] = True
+  return message
 
-def chunker_job(book_uuid, chapter_uuid):
-  return {
+def chunker_job(book_uuid, chapter_uuid, chapter_number=None, preview=False):
+  message = {
     "book_uuid": book_uuid,
     "chapter_uuid": chapter_uuid,
   }
+  # Position of the chapter in the book (from 1), which sets the priority of its TTS jobs.
+  if chapter_number is not None:
+    message["chapter_number"] = chapter_number
+  if preview:
+    message["preview"] = True
+  return message
 
-def tts_job(book_uuid, chapter_uuid, chunk_index):
-  return {
+def tts_job(book_uuid, chapter_uuid, chunk_index, chunk_text=None, compression='none', chunk_range=None):
+  message = {
     "book_uuid": book_uuid,
     "chapter_uuid": chapter_uuid,
     "chunk_index" : chunk_index
   }
+  # Small chunks travel inside the job instead of through GCS.
+  if chunk_text is not None:
+    message["payload"], message["payload_encoding"] = encode_payload(chunk_text, compression)
+  # Chunks stored in the chapter's chunk archive: [offset, length] of the chunk in the archive.
+  if chunk_range is not None:
+    message["chunk_range"] = list(chunk_range)
+  return message
 
 def audio_stitch_job(book_uuid, chapter_uuid):
   return {
@@ -28,10 +48,11 @@ def audio_stitch_job(book_uuid, chapter_uuid):
 
 
 # ---- Event tracker service notifications ----
-def add_book(book_uuid):
+def add_book(book_uuid, content_key=None):
   return {
     "operation" : redis_ops.ADD_BOOK,
-    "book_uuid" : book_uuid
+    "book_uuid" : book_uuid,
+    "content_key" : content_key
   }
 
 def add_chapter(book_uuid, chapter_uuid, chapter_title):
@@ -44,12 +65,20 @@ def add_chapter(book_uuid, chapter_uuid, chapter_title):
 
 def add_chunk(book_uuid, chapter_uuid, chunk_index):
   return {
-    "operation": redis_ops.REMOVE_CHAPTER,
+    "operation": redis_ops.ADD_CHUNK,
     "book_uuid": book_uuid,
     "chapter_uuid": chapter_uuid,
     "chunk_index": chunk_index
   }
 
+def add_chunks(book_uuid, chapter_uuid, chunk_indices):
+  return {
+    "operation": redis_ops.ADD_CHUNKS,
+    "book_uuid": book_uuid,
+    "chapter_uuid": chapter_uuid,
+    "chunk_indices": list(chunk_indices)
+  }
+
 def update_book_status(book_uuid, status):
   return {
     "operation" : redis_ops.UPDATE_BOOK_STATUS,
@@ -74,6 +103,13 @@ def update_chunk_status(book_uuid, chapter_uuid, chunk_index, status):
     "status" : status
   }
 
+def split_finished(book_uuid, total_chapters):
+  return {
+    "operation" : redis_ops.SPLIT_FINISHED,
+    "book_uuid" : book_uuid,
+    "total_chapters" : total_chapters
+  }
+
 def remove_chapter(book_uuid, chapter_uuid):
   return {
     "operation" : redis_ops.REMOVE_CHAPTER,
@@ -90,3 +126,85 @@ def remove_chunk(book_uuid, chapter_uuid, chunk_index):
   }
 
 
+
+# ---- TTS job priorities ----
+# The TTS queue is a priority queue, so the opening of a book is narrated before the backlog of earlier books and a
+# listener can start within seconds. Jobs published without a priority count as priority 0.
+
+# Highest priority of a TTS job. RabbitMQ keeps one internal queue per level, and recommends at most 10 levels.
+MAX_TTS_PRIORITY = 10
+
+# Chunks at the start of a chapter that get a higher priority than the rest of it, so its audio can start playing.
+EARLY_CHUNK_COUNT = 2
+
+def tts_queue_arguments(priority_scheduling):
+  """
+  Arguments the TTS queue is declared with. Every service must declare the queue with the same arguments, and an
+  existing queue must be deleted before they change.
+
+  :param priority_scheduling: True to declare a priority queue
+  :return: Queue arguments, or None for a plain FIFO queue
+  """
+  return {"x-max-priority": MAX_TTS_PRIORITY} if priority_scheduling else None
+
+def tts_job_priority(chapter_number, chunk_index, preview=False):
+  """
+  Priority of a TTS job: early chapters before later ones, and within a chapter its first chunks before the rest.
+  The first chapter of a preview outranks every other job.
+
+  Chapter 1 gets 9 for its early chunks and 8 for the rest, chapter 2 gets 7 and 6, and so on down to 2 and 1 from
+  chapter 5 on.
+
+  :param chapter_number: Position of the chapter in the book, from 1; None when unknown
+  :param chunk_index: Index of the chunk in the chapter, from 1
+  :param preview: True if a listener is waiting for the opening of the book
+  :return: Priority between 1 and MAX_TTS_PRIORITY, or None to publish without a priority
+  """
+  if chapter_number is None:
+    return None
+  if preview and chapter_number == 1:
+    return MAX_TTS_PRIORITY
+  priority = max(1, MAX_TTS_PRIORITY - 2 * chapter_number)
+  if chunk_index <= EARLY_CHUNK_COUNT:
+    priority += 1
+  return priority
+
+
+
+# ---- Inline payloads ----
+def encode_payload(text, compression='none'):
+  """
+  Encodes text to travel inside a JSON message. Compressed text is base64 encoded, and only used when it comes out
+  smaller than the text itself.
+
+  :param text: Text to encode
+  :param compression: 'zlib' or 'none'
+  :return: (payload, payload encoding) tuple
+  """
+  if compression not in ('zlib', 'none'):
+    raise ValueError(f"Unknown payload compression: {compression}")
+
+  if compression == 'zlib':
+    encoded = text.encode('utf-8')
+    compressed = base64.b64encode(zlib.compress(encoded)).decode('ascii')
+    if len(compressed) < len(encoded):
+      return compressed, 'zlib+base64'
+  return text, 'utf-8'
+
+def decode_payload(message):
+  """
+  Decodes the inline payload of a message.
+
+  :param message: Parsed message
+  :return: The text carried by the message, or None if it carries no payload
+  """
+  payload = message.get("payload")
+  if payload is None:
+    return None
+
+  encoding = message.get("payload_encoding", 'utf-8')
+  if encoding == 'utf-8':
+    return payload
+  if encoding == 'zlib+base64':
+    return zlib.decompress(base64.b64decode(payload)).decode('utf-8')
+  raise ValueError(f"Unknown payload encoding: {encoding}")
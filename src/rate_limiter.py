@@ -0,0 +1,160 @@
+# ---- Cluster-wide rate limiter for calls to an external API, shared by every replica through Redis. ----
+# A token bucket whose refill rate adapts to the API's answers: it grows additively while calls succeed and is cut
+# multiplicatively when the API throttles (AIMD), so the fleet settles just under its quota instead of bouncing off it.
+import asyncio
+import time
+
+# Reserves a token and returns how long the caller must wait before using it. Tokens may go negative: every caller
+# gets its own place in line with a single round trip, and nobody polls. Time comes from the Redis server, so the
+# clocks of the replicas never matter.
+#
+# KEYS[1]: bucket hash. ARGV: burst, initial rate (calls per second).
+ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local burst = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at', 'rate')
+local rate = tonumber(state[3]) or tonumber(ARGV[2])
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate) - 1
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now, 'rate', rate)
+redis.call('EXPIRE', KEYS[1], 3600)
+if tokens >= 0 then
+  return '0'
+end
+return tostring(-tokens / rate)
+"""
+
+# Takes a token only if one is available right away, and returns 1 if it did. When the bucket is empty nothing is
+# written, so an optional call that is turned down costs the other callers nothing.
+#
+# KEYS[1]: bucket hash. ARGV: burst, initial rate (calls per second).
+TRY_ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local burst = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at', 'rate')
+local rate = tonumber(state[3]) or tonumber(ARGV[2])
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+if tokens < 1 then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'updated_at', now, 'rate', rate)
+redis.call('EXPIRE', KEYS[1], 3600)
+return 1
+"""
+
+# Adapts the rate to the outcome of a call and returns the new rate. A throttled call cuts the rate at most once per
+# cooldown, so a burst of throttled calls from many replicas counts as a single overload.
+#
+# KEYS[1]: bucket hash. ARGV: outcome ('success' or 'throttle'), initial rate, minimum rate, maximum rate, additive
+# increase (calls per second gained per second of successful calls), multiplicative decrease, cooldown in seconds.
+ADJUST_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'rate', 'decreased_at')
+local rate = tonumber(state[1]) or tonumber(ARGV[2])
+if ARGV[1] == 'throttle' then
+  local decreased_at = tonumber(state[2]) or 0
+  if now - decreased_at >= tonumber(ARGV[7]) then
+    rate = math.max(tonumber(ARGV[3]), rate * tonumber(ARGV[6]))
+    redis.call('HSET', KEYS[1], 'rate', rate, 'decreased_at', now)
+  end
+else
+  rate = math.min(tonumber(ARGV[4]), rate + tonumber(ARGV[5]) / rate)
+  redis.call('HSET', KEYS[1], 'rate', rate)
+end
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(rate)
+"""
+
+
+class RateLimiter:
+  """
+  Adaptive token bucket shared by every process that uses the same Redis key. The limiter fails open: when Redis is
+  unreachable, calls go through unpaced rather than stopping the service.
+  """
+
+  def __init__(self, redis_client, key, initial_rate, min_rate, max_rate, burst, additive_increase=0.5,
+               multiplicative_decrease=0.5, decrease_cooldown=2.0):
+    """
+    :param redis_client: Redis client
+    :param key: Redis key of the bucket; limiters sharing it share the rate
+    :param initial_rate: Calls per second before any call was made
+    :param min_rate: Lower bound of the rate in calls per second
+    :param max_rate: Upper bound of the rate in calls per second, e.g. the API quota
+    :param burst: Number of calls allowed at once after an idle period
+    :param additive_increase: Calls per second the rate gains per second of successful calls
+    :param multiplicative_decrease: Factor applied to the rate when a call is throttled
+    :param decrease_cooldown: Minimum number of seconds between two decreases
+    """
+    self.key = key
+    self.initial_rate = initial_rate
+    self.min_rate = min_rate
+    self.max_rate = max_rate
+    self.burst = burst
+    self.additive_increase = additive_increase
+    self.multiplicative_decrease = multiplicative_decrease
+    self.decrease_cooldown = decrease_cooldown
+    self.rate = initial_rate
+    self.acquire_script = redis_client.register_script(ACQUIRE_SCRIPT)
+    self.try_acquire_script = redis_client.register_script(TRY_ACQUIRE_SCRIPT)
+    self.adjust_script = redis_client.register_script(ADJUST_SCRIPT)
+
+  def reserve(self):
+    """
+    Reserves the right to make one call.
+
+    :return: Seconds to wait before making the call
+    """
+    try:
+      return float(self.acquire_script(keys=[self.key], args=[self.burst, self.initial_rate]))
+    except Exception as e:
+      print(f"Rate limiter unavailable, not pacing the call: {e}")
+      return 0.0
+
+  def try_acquire(self):
+    """
+    Takes the right to make one call only if it is available at once, for calls that may be skipped. Unlike reserve,
+    a refusal leaves the bucket untouched.
+
+    :return: True if the call may be made now
+    """
+    try:
+      return int(self.try_acquire_script(keys=[self.key], args=[self.burst, self.initial_rate])) == 1
+    except Exception as e:
+      print(f"Rate limiter unavailable, not pacing the call: {e}")
+      return True
+
+  def acquire(self):
+    """Blocks until one call may be made."""
+    wait = self.reserve()
+    if wait > 0:
+      time.sleep(wait)
+
+  async def acquire_async(self):
+    """Waits, without blocking the event loop, until one call may be made."""
+    wait = await asyncio.to_thread(self.reserve)
+    if wait > 0:
+      await asyncio.sleep(wait)
+
+  def record_success(self):
+    """Reports a successful call, which raises the rate additively."""
+    self.adjust('success')
+
+  def record_throttle(self):
+    """Reports a throttled call, which cuts the rate multiplicatively."""
+    self.adjust('throttle')
+    print(f"API call throttled; rate limited to {self.rate:.2f} calls/s")
+
+  def adjust(self, outcome):
+    try:
+      self.rate = float(self.adjust_script(keys=[self.key], args=[
+        outcome, self.initial_rate, self.min_rate, self.max_rate, self.additive_increase,
+        self.multiplicative_decrease, self.decrease_cooldown
+      ]))
+    except Exception as e:
+      print(f"Rate limiter unavailable, rate not adjusted: {e}")
@@ -0,0 +1,77 @@
+import asyncio
+import unittest
+from unittest.mock import patch, MagicMock
+
+from rate_limiter import RateLimiter, ACQUIRE_SCRIPT, ADJUST_SCRIPT, TRY_ACQUIRE_SCRIPT
+
+
+def make_limiter():
+    redis_client = MagicMock()
+    scripts = {ACQUIRE_SCRIPT: MagicMock(name='acquire'), ADJUST_SCRIPT: MagicMock(name='adjust'),
+               TRY_ACQUIRE_SCRIPT: MagicMock(name='try_acquire')}
+    redis_client.register_script.side_effect = scripts.get
+    limiter = RateLimiter(redis_client, 'tts:rate_limiter', initial_rate=5, min_rate=0.5, max_rate=16, burst=5)
+    return limiter, scripts[ACQUIRE_SCRIPT], scripts[ADJUST_SCRIPT]
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_reserve_runs_the_acquire_script(self):
+        limiter, acquire_script, _ = make_limiter()
+        acquire_script.return_value = '0.25'
+        self.assertEqual(limiter.reserve(), 0.25)
+        acquire_script.assert_called_once_with(keys=['tts:rate_limiter'], args=[5, 5])
+
+    def test_try_acquire_runs_its_own_script(self):
+        limiter, acquire_script, _ = make_limiter()
+        try_acquire_script = limiter.try_acquire_script
+        try_acquire_script.return_value = 1
+        self.assertTrue(limiter.try_acquire())
+        try_acquire_script.return_value = 0
+        self.assertFalse(limiter.try_acquire())
+        try_acquire_script.assert_called_with(keys=['tts:rate_limiter'], args=[5, 5])
+        acquire_script.assert_not_called()
+
+    @patch('rate_limiter.time.sleep')
+    def test_acquire_waits_for_its_reservation(self, mock_sleep):
+        limiter, acquire_script, _ = make_limiter()
+        acquire_script.return_value = '0'
+        limiter.acquire()
+        mock_sleep.assert_not_called()
+
+        acquire_script.return_value = '1.5'
+        limiter.acquire()
+        mock_sleep.assert_called_once_with(1.5)
+
+    @patch('rate_limiter.asyncio.sleep')
+    def test_acquire_async_waits_for_its_reservation(self, mock_sleep):
+        limiter, acquire_script, _ = make_limiter()
+        acquire_script.return_value = '0.5'
+        asyncio.run(limiter.acquire_async())
+        mock_sleep.assert_awaited_once_with(0.5)
+
+    @patch('rate_limiter.time.sleep')
+    def test_limiter_fails_open(self, mock_sleep):
+        limiter, acquire_script, adjust_script = make_limiter()
+        acquire_script.side_effect = ConnectionError("Redis is down")
+        adjust_script.side_effect = ConnectionError("Redis is down")
+        limiter.acquire()
+        limiter.record_throttle()
+        mock_sleep.assert_not_called()
+        self.assertEqual(limiter.rate, 5)
+
+    def test_outcomes_adjust_the_shared_rate(self):
+        limiter, _, adjust_script = make_limiter()
+        adjust_script.return_value = '2.5'
+        limiter.record_throttle()
+        self.assertEqual(adjust_script.call_args.kwargs['args'][0], 'throttle')
+        self.assertEqual(limiter.rate, 2.5)
+
+        adjust_script.return_value = '2.7'
+        limiter.record_success()
+        self.assertEqual(adjust_script.call_args.kwargs,
+                         {'keys': ['tts:rate_limiter'], 'args': ['success', 5, 0.5, 16, 0.5, 0.5, 2.0]})
+        self.assertEqual(limiter.rate, 2.7)
+
+if __name__ == '__main__':
+    unittest.main()
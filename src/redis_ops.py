@@ -17,3 +17,6 @@ UPDATE_BOOK_STATUS = 'update_book_status'
 UPDATE_CHAPTER_STATUS = 'update_chapter_status'
 UPDATE_CHUNK_STATUS = 'update_chunk_status'
 
+# Progress operations
+SPLIT_FINISHED = 'split_finished'
+
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import uuid
@@ -9,7 +10,8 @@ from flask import Flask, jsonify, request, send_file
 
 from constants import (GCS_BUCKET_NAME, MAX_FILE_SIZE, RABBITMQ_HOST,
                        SPLITTER_QUEUE_NAME, UPLOAD_FOLDER, EVENT_TRACKER_QUEUE_NAME, RABBITMQ_PASSWORD, RABBITMQ_USER,
-                       REDIS_HOST, REDIS_PORT)
+                       REDIS_HOST, REDIS_PORT, TTS_SYNTHESIS_CONFIG, TTS_FAIR_SHARE)
+from fair_scheduler import FairScheduler
 from messages import split_job, add_book
 from utils import upload_to_gcs, download_file_from_gcs
 
@@ -20,6 +22,9 @@ app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 # ---- Initialize Redis Client -----
 redis_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
 
+# ---- Per-book sub-queues of TTS jobs, read for the backlog metrics ----
+fair_scheduler = FairScheduler(redis_client)
+
 
 # ---- Initialize RabbitMQ client for job creation ----
 connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST, credentials=pika.PlainCredentials(username=RABBITMQ_USER, password=RABBITMQ_PASSWORD), heartbeat=3600))
@@ -59,6 +64,21 @@ def upload():
   if file.content_type != "application/epub+zip":
     return jsonify({"error": "File is not an EPUB"}), 400
 
+  # A book that has already been narrated with the same voice is served from its existing audio.
+  content_key = book_content_key(file)
+  narrated_book_uuid = find_narrated_book(content_key)
+  if narrated_book_uuid:
+    return (
+      jsonify(
+        {
+          "message": "Book already narrated, reusing the existing audio",
+          "job_id": narrated_book_uuid,
+          "deduplicated": True,
+        }
+      ),
+      200,
+    )
+
   is_valid, message = validate_epub(file)
 
   if is_valid:
@@ -72,10 +92,12 @@ def upload():
       upload_to_gcs(file, GCS_BUCKET_NAME, gcs_path)
 
       # Notify event tracker service about the new book.
-      notify_new_book(book_uuid)
+      notify_new_book(book_uuid, content_key)
 
-      # Publish a message to the splitter queue for the splitter to start processing the book.
-      enqueue_splitter_job(book_uuid)
+      # Publish a message to the splitter queue for the splitter to start processing the book. A preview upload has
+      # its first chapter narrated ahead of every other book.
+      preview = request.form.get("preview", "false").lower() == "true"
+      enqueue_splitter_job(book_uuid, preview)
 
       # Return response to client.
       return (
@@ -124,6 +146,21 @@ def get_job_status(book_uuid):
   except Exception as e:
     return jsonify({"error": f"Failed to fetch status: {e}"}), 500
 
+# Endpoint to fetch the per-book backlog of the fair-share TTS scheduler
+@app.route("/metrics/tts_backlog", methods=["GET"])
+def get_tts_backlog():
+  if not TTS_FAIR_SHARE:
+    return jsonify({"error": "Fair-share TTS scheduling is disabled"}), 404
+  try:
+    backlog = fair_scheduler.backlog()
+    return jsonify({
+      "books": backlog,
+      "queued": sum(counts["queued"] for counts in backlog.values()),
+      "in_flight": sum(counts["in_flight"] for counts in backlog.values())
+    }), 200
+  except Exception as e:
+    return jsonify({"error": f"Failed to fetch the TTS backlog: {e}"}), 500
+
 # Endpoint to list chapters for a job
 @app.route("/chapters/<book_uuid>", methods=["GET"])
 def list_chapters(book_uuid):
@@ -204,7 +241,7 @@ def validate_epub(file):
   if file_size > MAX_FILE_SIZE:
     return (
       False,
-      f"File size exceeds 10 MB (actual size: {file_size / (1024 * 1024):.2f} MB)",
+      f"File size exceeds {MAX_FILE_SIZE / (1024 * 1024):.0f} MB (actual size: {file_size / (1024 * 1024):.2f} MB)",
     )
 
   # Save the file temporarily
@@ -219,18 +256,51 @@ def validate_epub(file):
   os.remove(temp_path)
 
   if checker.valid:
-    return True, "Valid EPUB file under 10 MB"
+    return True, f"Valid EPUB file under {MAX_FILE_SIZE / (1024 * 1024):.0f} MB"
   else:
     return False, f"Invalid EPUB file: {checker.messages}"
 
 
-def enqueue_splitter_job(book_uuid):
+def book_content_key(file):
+  """
+  Computes the content address of an upload: the SHA-256 of the EPUB bytes together with the engine, voice and audio
+  encoding it will be narrated with (TTS_SYNTHESIS_CONFIG).
+  :param file: Uploaded file
+  :return: Hex digest identifying the narration of this EPUB
+  """
+  digest = hashlib.sha256()
+  file.seek(0)
+  for block in iter(lambda: file.read(1024 * 1024), b""):
+    digest.update(block)
+  file.seek(0)  # Reset file pointer
+  digest.update("".join(f"|{setting}" for setting in TTS_SYNTHESIS_CONFIG).encode("utf-8"))
+  return digest.hexdigest()
+
+
+def find_narrated_book(content_key):
+  """
+  Looks up a completed book with the given content key.
+  :param content_key: Content key of the upload
+  :return: UUID of the completed book, or None if the upload has to be narrated
+  """
+  try:
+    book_uuid = redis_client.get(f"epub:{content_key}")
+    if book_uuid and redis_client.get(f"status:book:{book_uuid}") == "completed":
+      return book_uuid
+  except Exception as e:
+    # The index only saves work; never fail an upload because it is unavailable.
+    print(f"Failed to look up content key {content_key}: {e}")
+  return None
+
+
+def enqueue_splitter_job(book_uuid, preview=False):
   """
   Publishes a new message to the RabbitMQ splitter queue.
   :param book_uuid: Unique identifier for the book.
+  :param preview: True if a listener is waiting for the opening of the book.
   """
   try:
-    message = split_job(book_uuid)
+    message = split_job(book_uuid, preview)
     # Publish the message to the RabbitMQ queue
     channel.basic_publish(
       exchange="",
@@ -240,9 +310,9 @@ def enqueue_splitter_job(book_uuid):
   except Exception as e:
     raise RuntimeError(f"Failed to enqueue job in splitter queue: {e}")
 
-def notify_new_book(book_uuid):
+def notify_new_book(book_uuid, content_key=None):
   try:
-    message = add_book(book_uuid)
+    message = add_book(book_uuid, content_key)
     # Publish the message to the RabbitMQ queue
     channel.basic_publish(
       exchange="",
@@ -2,9 +2,10 @@ import unittest
 from unittest.mock import patch, MagicMock
 import tempfile
 import os
+from io import BytesIO
 from flask import Flask
 from werkzeug.datastructures import FileStorage  # Import FileStorage for simulating file uploads
-from rest_server import app  # Adjust the import path
+from rest_server import app, book_content_key, find_narrated_book  # Adjust the import path
 
 MAX_FILE_SIZE = 10 * 1024 * 1024 
 
@@ -49,6 +50,84 @@ class TestEventTracker(unittest.TestCase):
         # Clean up the temporary file
         os.remove(temp_file_path)
 
+    @patch('rest_server.redis_client')
+    @patch('rest_server.upload_to_gcs')
+    @patch('rest_server.validate_epub')
+    @patch('rest_server.enqueue_splitter_job')
+    @patch('rest_server.notify_new_book')
+    def test_upload_narrated_epub_is_reused(self, mock_notify_new_book, mock_enqueue_splitter_job, mock_validate_epub,
+                                            mock_upload_to_gcs, mock_redis):
+        # The content key points at a completed book.
+        mock_redis.get.side_effect = lambda key: "narrated-book" if key.startswith("epub:") else "completed"
+
+        file_storage = FileStorage(stream=BytesIO(b'epub bytes'), filename='test.epub', content_type='application/epub+zip')
+        response = self.app.post('/upload', data={'file': file_storage})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["job_id"], "narrated-book")
+        self.assertTrue(response.json["deduplicated"])
+        mock_validate_epub.assert_not_called()
+        mock_upload_to_gcs.assert_not_called()
+        mock_notify_new_book.assert_not_called()
+        mock_enqueue_splitter_job.assert_not_called()
+
+    @patch('rest_server.redis_client')
+    @patch('rest_server.upload_to_gcs')
+    @patch('rest_server.validate_epub')
+    @patch('rest_server.enqueue_splitter_job')
+    @patch('rest_server.notify_new_book')
+    def test_upload_new_epub_records_content_key(self, mock_notify_new_book, mock_enqueue_splitter_job,
+                                                 mock_validate_epub, mock_upload_to_gcs, mock_redis):
+        mock_redis.get.return_value = None
+        mock_validate_epub.return_value = (True, "Valid EPUB file under 10 MB")
+
+        file_storage = FileStorage(stream=BytesIO(b'epub bytes'), filename='test.epub', content_type='application/epub+zip')
+        response = self.app.post('/upload', data={'file': file_storage})
+
+        self.assertEqual(response.status_code, 200)
+        book_uuid, content_key = mock_notify_new_book.call_args.args
+        self.assertEqual(content_key, book_content_key(BytesIO(b'epub bytes')))
+        mock_enqueue_splitter_job.assert_called_once_with(book_uuid, False)
+
+    @patch('rest_server.redis_client')
+    def test_find_narrated_book_requires_completed_book(self, mock_redis):
+        mock_redis.get.side_effect = lambda key: "book-in-progress" if key.startswith("epub:") else "in_progress"
+        self.assertIsNone(find_narrated_book("key"))
+
+        mock_redis.get.side_effect = Exception("Redis is down")
+        self.assertIsNone(find_narrated_book("key"))
+
+    @patch('rest_server.TTS_FAIR_SHARE', True)
+    @patch('rest_server.fair_scheduler')
+    def test_get_tts_backlog(self, mock_scheduler):
+        mock_scheduler.backlog.return_value = {"book-1": {"queued": 120, "in_flight": 32},
+                                               "book-2": {"queued": 3, "in_flight": 2}}
+        response = self.app.get('/metrics/tts_backlog')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["queued"], 123)
+        self.assertEqual(response.get_json()["in_flight"], 34)
+        self.assertEqual(response.get_json()["books"]["book-1"]["queued"], 120)
+
+    def test_get_tts_backlog_disabled(self):
+        self.assertEqual(self.app.get('/metrics/tts_backlog').status_code, 404)
+
+    def test_book_content_key(self):
+        # Identical bytes share a key, and the file is rewound for the upload.
+        file = BytesIO(b'epub bytes')
+        self.assertEqual(book_content_key(file), book_content_key(BytesIO(b'epub bytes')))
+        self.assertEqual(file.tell(), 0)
+        self.assertNotEqual(book_content_key(file), book_content_key(BytesIO(b'other epub bytes')))
+
+    def test_book_content_key_follows_synthesis_config(self):
+        # A book narrated by another engine or voice is never handed back for a real narration.
+        with patch('rest_server.TTS_SYNTHESIS_CONFIG', ('google', 'en-US', 'FEMALE', 'MP3')):
+            google_key = book_content_key(BytesIO(b'epub bytes'))
+        with patch('rest_server.TTS_SYNTHESIS_CONFIG', ('local', 'en-US', 'FEMALE', 'MP3')):
+            local_key = book_content_key(BytesIO(b'epub bytes'))
+        with patch('rest_server.TTS_SYNTHESIS_CONFIG', ('google', 'en-US', 'MALE', 'MP3')):
+            male_key = book_content_key(BytesIO(b'epub bytes'))
+        self.assertEqual(len({google_key, local_key, male_key}), 3)
+
     @patch('rest_server.upload_to_gcs')  # Adjust the import path
     @patch('rest_server.validate_epub')
     def test_upload_invalid_epub(self, mock_validate_epub, mock_upload_to_gcs):
@@ -0,0 +1,120 @@
+"""
+Simulates time-to-first-chapter of a newly uploaded book that arrives behind a backlog of earlier books, with the TTS
+queue as a plain FIFO queue and as a priority queue using messages.tts_job_priority.
+
+The simulation is a discrete-event model of the TTS fleet: every worker takes one job at a time (prefetch 1) and
+synthesizes a chunk in a random time around --synthesis-ms. The earlier books are queued when the new book arrives,
+every chapter in full, so the new book would otherwise wait for the whole backlog.
+
+Usage: python scheduling_benchmark.py [--backlog-books 20] [--chapters 20] [--chunks 12] [--workers 8]
+"""
+import argparse
+import heapq
+import random
+from collections import deque
+
+from messages import tts_job_priority
+
+
+def book_jobs(book, chapters, chunks, preview=False):
+  """
+  :return: List of (book, chapter number, chunk index, preview) jobs in publishing order
+  """
+  return [(book, chapter, chunk, preview) for chapter in range(1, chapters + 1) for chunk in range(1, chunks + 1)]
+
+
+class FifoQueue:
+
+  def __init__(self):
+    self.jobs = deque()
+
+  def put(self, job):
+    self.jobs.append(job)
+
+  def get(self):
+    return self.jobs.popleft()
+
+  def __len__(self):
+    return len(self.jobs)
+
+
+class PriorityQueue:
+  """Highest priority first, FIFO within a priority, like a RabbitMQ queue with x-max-priority."""
+
+  def __init__(self):
+    self.jobs = []
+    self.sequence = 0
+
+  def put(self, job):
+    _, chapter, chunk, preview = job
+    heapq.heappush(self.jobs, (-tts_job_priority(chapter, chunk, preview), self.sequence, job))
+    self.sequence += 1
+
+  def get(self):
+    return heapq.heappop(self.jobs)[2]
+
+  def __len__(self):
+    return len(self.jobs)
+
+
+def simulate(queue, backlog, new_book, workers, synthesis_seconds, seed):
+  """
+  Runs the fleet until every job is done.
+
+  :return: Dict of the new book's time to first chunk, time to first chapter and time to last chunk, and the time
+           the whole backlog took
+  """
+  rng = random.Random(seed)
+  for job in backlog + new_book:
+    queue.put(job)
+
+  new_book_id = new_book[0][0]
+  first_chapter_left = sum(1 for job in new_book if job[1] == 1)
+  results = {}
+  free_at = [(0.0, worker) for worker in range(workers)]
+  now = 0.0
+  while queue:
+    now, worker = heapq.heappop(free_at)
+    book, chapter, chunk, _ = queue.get()
+    # Synthesis times vary around their mean, with an occasional straggler.
+    duration = synthesis_seconds * rng.uniform(0.5, 1.5) * (4 if rng.random() < 0.02 else 1)
+    done_at = now + duration
+    heapq.heappush(free_at, (done_at, worker))
+
+    if book == new_book_id:
+      results.setdefault("first_chunk", done_at)
+      results["last_chunk"] = max(results.get("last_chunk", 0.0), done_at)
+      if chapter == 1:
+        first_chapter_left -= 1
+        if first_chapter_left == 0:
+          results["first_chapter"] = done_at
+    else:
+      results["backlog"] = max(results.get("backlog", 0.0), done_at)
+  return results
+
+
+def run_benchmark(backlog_books, chapters, chunks, workers, synthesis_ms, seed):
+  synthesis_seconds = synthesis_ms / 1000
+  backlog = [job for book in range(backlog_books) for job in book_jobs(f"book-{book}", chapters, chunks)]
+  print(f"{backlog_books} books of {chapters} chapters x {chunks} chunks queued ({len(backlog)} jobs), "
+        f"{workers} workers, {synthesis_ms} ms per chunk")
+  print(f"{'queue':>18} {'first chunk s':>14} {'first chapter s':>16} {'whole book s':>13} {'backlog s':>10}")
+
+  for name, queue, preview in (("fifo", FifoQueue(), False), ("priority", PriorityQueue(), False),
+                               ("priority+preview", PriorityQueue(), True)):
+    new_book = book_jobs("new-book", chapters, chunks, preview)
+    results = simulate(queue, backlog, new_book, workers, synthesis_seconds, seed)
+    print(f"{name:>18} {results['first_chunk']:>14.1f} {results['first_chapter']:>16.1f} "
+          f"{results['last_chunk']:>13.1f} {results['backlog']:>10.1f}")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--backlog-books', type=int, default=20)
+  parser.add_argument('--chapters', type=int, default=20)
+  parser.add_argument('--chunks', type=int, default=12)
+  parser.add_argument('--workers', type=int, default=8)
+  parser.add_argument('--synthesis-ms', type=int, default=1500)
+  parser.add_argument('--seed', type=int, default=5253)
+  args = parser.parse_args()
+  run_benchmark(args.backlog_books, args.chapters, args.chunks, args.workers, args.synthesis_ms, args.seed)
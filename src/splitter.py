@@ -1,24 +1,58 @@
-import html
 import json
 import os
+import posixpath
 import re
-import tempfile
 import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import unquote
 
 import pika
-from bs4 import BeautifulSoup
+import redis
 from ebooklib import ITEM_DOCUMENT, epub
+from lxml import etree
 
 from constants import (CHUNKER_QUEUE_NAME, DOWNLOAD_FOLDER,
                        RABBITMQ_HOST, SPLITTER_QUEUE_NAME, GCS_BUCKET_NAME, EVENT_TRACKER_QUEUE_NAME, RABBITMQ_PASSWORD,
-                       RABBITMQ_USER)
-from messages import add_chapter, update_book_status, chunker_job
+                       RABBITMQ_USER, SPLITTER_EXTRACTION_MODE, SPLITTER_WORKERS,
+                       SPLITTER_EXTRACTION_ENGINE, SPLITTER_UPLOAD_CONCURRENCY, REDIS_HOST, REDIS_PORT,
+                       SPLITTER_DISPATCH_ORDER, SPLITTER_PIPELINE_MODE, TTS_QUEUE_NAME, CHUNK_PACKING,
+                       INLINE_PAYLOAD_MAX_BYTES, INLINE_PAYLOAD_COMPRESSION, CHUNK_STORAGE, TTS_PRIORITY_SCHEDULING,
+                       TTS_FAIR_SHARE)
+from chunking import chunk_blob_name, chunk_index_blob_name, chunk_pack_blob_name, is_inline_chunk, iter_text_chunks, \
+  pack_chunks
+from fair_scheduler import FairScheduler
+from messages import add_chapter, update_book_status, chunker_job, update_chapter_status, add_chunks, tts_job, \
+  tts_job_priority, tts_queue_arguments, split_finished
+from text_extraction import extract_text, is_metadata
 from utils import download_file_from_gcs, upload_to_gcs
 
 # ---- Initialize RabbitMQ client to pick split jobs ----
 connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST, credentials=pika.PlainCredentials(username=RABBITMQ_USER, password=RABBITMQ_PASSWORD), heartbeat=3600))
 channel = connection.channel()
 
+# ---- Initialize Redis client to track the chapters whose jobs are already queued ----
+redis_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+# ---- Per-book sub-queues of TTS jobs, with fair-share scheduling ----
+fair_scheduler = FairScheduler(redis_client) if TTS_FAIR_SHARE else None
+
+# ---- EPUB container layout ----
+CONTAINER_PATH = "META-INF/container.xml"
+CONTAINER_NS = "urn:oasis:names:tc:opendocument:xmlns:container"
+OPF_NS = "http://www.idpf.org/2007/opf"
+XHTML_MEDIA_TYPES = {"application/xhtml+xml", "text/html"}
+
+# Never resolve entities or fetch DTDs from uploaded books.
+OPF_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+
+class ChapterUploadError(RuntimeError):
+  """
+  Raised when some chapters of a book could not be uploaded; retrying the split job uploads them again.
+  """
 
 
 # ---- Callback function to process messages ----
@@ -56,116 +90,390 @@ def process_split_job(ch, method, properties, body):
     print(f"File downloaded successfully for Job UUID: {book_uuid}")
 
     # Split the book into chapters and upload them to GCS
-    split_book_into_chapters(local_file_path, GCS_BUCKET_NAME, book_uuid)
+    split_book_into_chapters(local_file_path, GCS_BUCKET_NAME, book_uuid, job.get('preview', False))
 
     # Acknowledge the message after successful processing
     ch.basic_ack(delivery_tag=method.delivery_tag)
+  except ChapterUploadError as e:
+    print(f"Error processing job: {e}")
+    # Requeue the message: chapter UUIDs are deterministic, so the retry skips the chapters already queued and only
+    # redoes the failed ones.
+    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
   except Exception as e:
     print(f"Error processing job: {e}")
-    # Reject the message and requeue it
+    # The book cannot be split, so report it as failed instead of leaving it in progress forever.
+    try:
+      book_uuid = json.loads(body).get('book_uuid')
+      if book_uuid:
+        notify_event_tracker(update_book_status(book_uuid, "failed"))
+    except Exception as notify_error:
+      print(f"Error reporting the failed split job: {notify_error}")
+    # Reject the message without requeueing it
     ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
 
 # ---- Book Splitting Logic ----
-def split_book_into_chapters(epub_file, bucket_name, book_uuid):
+def split_book_into_chapters(epub_file, bucket_name, book_uuid, preview=False):
   """
   Splits an EPUB file into individual chapters and uploads them to GCS.
+  Documents are consumed lazily, so each chapter is published as soon as it has been extracted and uploaded.
+  In the 'fused' pipeline mode the chapters are chunked here and their chunks are uploaded and queued for TTS directly.
 
   :param epub_file: Path to the EPUB file
   :param bucket_name: Name of the GCS bucket
   :param book_uuid: UUID of the job in process
+  :param preview: True if a listener is waiting for the opening of the book
   """
   try:
+    if SPLITTER_PIPELINE_MODE not in ("chunker", "fused"):
+      raise ValueError(f"Unknown splitter pipeline mode: {SPLITTER_PIPELINE_MODE}")
+
     # Notify the event tracker that the status of the book is now 'in_progress'
     notify_event_tracker(update_book_status(book_uuid, "in_progress"))
 
-    book = epub.read_epub(epub_file)
     chapter_count = 0
+    failed_chapters = []
+
+    # Uploads run concurrently from memory; the event tracker and chunker only hear about a chapter once its upload
+    # succeeded, and always in dispatch order.
+    with ThreadPoolExecutor(max_workers=SPLITTER_UPLOAD_CONCURRENCY) as upload_pool:
+      pending_uploads = deque()
+
+      # Chapters are numbered in document order, before the dispatch order may change it: the number sets the
+      # priority of the chapter's TTS jobs.
+      numbered_chapters = (
+        chapter + (chapter_number,)
+        for chapter_number, chapter in enumerate(iter_book_chapters(epub_file, book_uuid), start=1)
+      )
+      for chapter_uuid, chapter_title, chapter_text, chapter_number in dispatch_order(numbered_chapters):
+        chapter_count += 1
 
-    for item in book.get_items():
-      if item.get_type() == ITEM_DOCUMENT:
-        soup = BeautifulSoup(item.get_body_content(), 'html.parser')
-
-        # Remove script and style tags
-        for tag in soup(['script', 'style', 'span', 'div']):
-          tag.decompose()
-
-        # Preserve paragraph breaks and handle drop caps
-        paragraphs = []
-        for paragraph in soup.find_all('p'):
-          # Handle dropcap specifically
-          dropcap_span = paragraph.find('span', class_='dropcap')
-          if dropcap_span:
-            dropcap = dropcap_span.get_text(strip=True)
-            dropcap_span.extract()  # Remove dropcap to avoid duplication
-            paragraph_text = f"{dropcap}{paragraph.get_text(strip=True)}"
-            # Combine dropcap with the rest of the paragraph text
-            paragraph_text = dropcap + paragraph.get_text(strip=True)
-          else:
-            paragraph_text = paragraph.get_text(strip=True)
-
-          paragraphs.append(paragraph_text)
-
-        # Join paragraphs with double newlines
-        chapter_text = "\n\n".join(paragraphs)
-
-        # Merge hyphenated words across lines
-        chapter_text = re.sub(r'-\n', '', chapter_text)
-
-        # Decode HTML entities and clean up text
-        chapter_text = html.unescape(chapter_text).replace('\xa0', ' ')
-
-        # Skip empty chapters
-        if not chapter_text:
+        # A redelivered split job must not register, chunk and synthesize the same chapter twice.
+        if is_known_chapter(chapter_uuid):
+          print(f"Chapter {chapter_title} (uuid: {chapter_uuid}) is already registered, skipping.")
           continue
 
-        # chapter_title = f"Chapter_{chapter_count:02}"
-        raw_title = item.get_name() or f"Chapter_{chapter_count + 1:02}"
-        leaf_title = os.path.basename(raw_title)  # Get the file name only
-        chapter_title, _ = os.path.splitext(leaf_title)  # Strip extensions like .html
-        chapter_title = re.sub(r'[^\w\s-]', '_', chapter_title)  # Replace special characters
+        if SPLITTER_PIPELINE_MODE == "fused":
+          upload = upload_pool.submit(upload_chapter_chunks, chapter_text, bucket_name, book_uuid, chapter_uuid)
+        else:
+          # Destination path in GCS
+          destination_blob_name = f"{book_uuid}/chapters/{chapter_uuid}.txt"
+          upload = upload_pool.submit(upload_chapter, chapter_text, bucket_name, destination_blob_name)
+        pending_uploads.append((upload, chapter_uuid, chapter_title, chapter_number))
 
-        if is_metadata(chapter_title, chapter_text):
-          print(f"Skipping metadata chapter: {chapter_title}")
-          continue
+        # Bound the number of chapters held in memory while their uploads are in flight.
+        if len(pending_uploads) >= SPLITTER_UPLOAD_CONCURRENCY:
+          publish_uploaded_chapter(book_uuid, *pending_uploads.popleft(), failed_chapters, preview)
 
-        chapter_count += 1
-        chapter_uuid = str(uuid.uuid4())
-        # Destination path in GCS
-        destination_blob_name = f"{book_uuid}/chapters/{chapter_uuid}.txt"
-
-        # Create a temporary file for the chapter
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as temp_file:
-          temp_file.write(chapter_text.encode('utf-8'))
-          temp_file.flush()  # Ensure all data is written to the file
-          temp_file_path = temp_file.name
-
-        # Upload the chapter text to GCS
-        try:
-          # Open the temporary file as a binary file
-          with open(temp_file_path, 'rb') as file_obj:
-            upload_to_gcs(file_obj, bucket_name, destination_blob_name)
-        except Exception as e:
-          print(f"Error uploading chapter {chapter_title} (uuid: {chapter_uuid}) to GCS:\nError:\n{e}")
-        finally:
-          os.remove(temp_file_path)  # Clean up temporary file
-
-        # Notify the event tracker about the chapter we just uploaded to GCS
-        notify_event_tracker(add_chapter(book_uuid, chapter_uuid, chapter_title))
-
-        # Add a new job into the chunker queue.
-        enqueue_chunker_job(book_uuid, chapter_uuid)
+      while pending_uploads:
+        publish_uploaded_chapter(book_uuid, *pending_uploads.popleft(), failed_chapters, preview)
 
     if chapter_count == 0:
       print("No chapters found in the EPUB file.")
     else:
       print(f"Book split into {chapter_count} chapters and uploaded to GCS.")
 
+    if failed_chapters:
+      raise ChapterUploadError(f"Failed to upload {len(failed_chapters)} of {chapter_count} chapters: {failed_chapters}")
+
+    if chapter_count:
+      # Every chapter is registered now, so the event tracker may complete the book once they are all narrated.
+      notify_event_tracker(split_finished(book_uuid, chapter_count))
+
   except Exception as e:
     print(f"Error splitting book into chapters: {e}")
     raise
 
 # ---------------------------------------------------------------------------------------------------------------------
 
+def iter_book_chapters(epub_file, book_uuid):
+  """
+  Extracts the chapters of a book, skipping empty documents and metadata.
+
+  :param epub_file: Path to the EPUB file
+  :param book_uuid: UUID of the book in process
+  :return: Generator of (chapter UUID, chapter title, chapter text) tuples in document order
+  """
+  chapter_count = 0
+
+  for position, (name, chapter_text) in enumerate(iter_chapter_texts(iter_book_documents(epub_file))):
+    # Skip empty chapters
+    if not chapter_text:
+      continue
+
+    # chapter_title = f"Chapter_{chapter_count:02}"
+    raw_title = name or f"Chapter_{chapter_count + 1:02}"
+    leaf_title = os.path.basename(raw_title)  # Get the file name only
+    chapter_title, _ = os.path.splitext(leaf_title)  # Strip extensions like .html
+    chapter_title = re.sub(r'[^\w\s-]', '_', chapter_title)  # Replace special characters
+
+    if is_metadata(chapter_title, chapter_text):
+      print(f"Skipping metadata chapter: {chapter_title}")
+      continue
+
+    chapter_count += 1
+    yield make_chapter_uuid(book_uuid, position, name), chapter_title, chapter_text
+
+
+def dispatch_order(chapters):
+  """
+  Orders chapters for dispatch according to SPLITTER_DISPATCH_ORDER.
+
+  'document' keeps the lazy document order. 'largest_first' waits for the whole book, measures every chapter and
+  dispatches the largest ones first, so a long chapter near the end of the book no longer starts last and
+  determines when the whole book completes.
+
+  :param chapters: Iterable of (chapter UUID, chapter title, chapter text, chapter number) tuples in document order
+  :return: Iterable of the same tuples in dispatch order
+  """
+  if SPLITTER_DISPATCH_ORDER == "document":
+    return chapters
+  if SPLITTER_DISPATCH_ORDER == "largest_first":
+    sized = [(len(chapter[2].encode('utf-8')), chapter) for chapter in chapters]
+    # sorted() is stable, so chapters of equal size keep their document order.
+    sized = sorted(sized, key=lambda entry: entry[0], reverse=True)
+    print(f"Dispatching {len(sized)} chapters largest first: {[size for size, _ in sized]} bytes")
+    return [chapter for _, chapter in sized]
+  raise ValueError(f"Unknown splitter dispatch order: {SPLITTER_DISPATCH_ORDER}")
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def make_chapter_uuid(book_uuid, position, name):
+  """
+  Derives a stable chapter UUID from the book and the document's position and href, so a retried split job
+  produces the same chapter IDs as the original attempt.
+
+  :param book_uuid: UUID of the book
+  :param position: Position of the document in the book
+  :param name: Name (href) of the document
+  :return: Chapter UUID as a string
+  """
+  return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{book_uuid}/chapters/{position}/{name}"))
+
+
+def chunker_queued_key(chapter_uuid):
+  return f"chapter:{chapter_uuid}:chunker_queued"
+
+
+def is_known_chapter(chapter_uuid):
+  """
+  Checks whether a previous run has already queued the chapter's chunker job (or, in the 'fused' pipeline mode, its
+  TTS jobs). A chapter the event tracker registered but whose jobs were never queued is not known, so it is redone.
+
+  :param chapter_uuid: UUID of the chapter
+  :return: True if the chapter is already known, False otherwise
+  """
+  return redis_client.exists(chunker_queued_key(chapter_uuid)) > 0
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def upload_chapter(chapter_text, bucket_name, destination_blob_name):
+  """
+  Uploads the chapter text to GCS straight from memory.
+
+  :param chapter_text: Text of the chapter
+  :param bucket_name: Name of the GCS bucket
+  :param destination_blob_name: Path in the bucket where the chapter will be saved
+  """
+  with BytesIO(chapter_text.encode('utf-8')) as file_like:
+    upload_to_gcs(file_like, bucket_name, destination_blob_name)
+
+
+def upload_chapter_chunks(chapter_text, bucket_name, book_uuid, chapter_uuid):
+  """
+  Chunks the chapter text and uploads every chunk to GCS straight from memory, where the TTS service expects them:
+  one object per chunk, or a single archive plus its offset index in the 'packed' chunk storage. Chunks small enough
+  to travel inside their TTS job are not uploaded.
+
+  :param chapter_text: Text of the chapter
+  :param bucket_name: Name of the GCS bucket
+  :param book_uuid: UUID of the book in process
+  :param chapter_uuid: UUID of the chapter
+  :return: List with, for every chunk in order, a (chunk text, chunk range) pair: the text if it travels inline (else
+           None) and its [offset, length] in the chapter's archive in the 'packed' storage (else None)
+  """
+  chunks = iter_text_chunks(chapter_text, packing=CHUNK_PACKING)
+
+  if CHUNK_STORAGE == 'packed':
+    chunks = list(chunks)
+    archive, index, ranges = pack_chunks(chunks, INLINE_PAYLOAD_MAX_BYTES)
+    with BytesIO(archive) as file_like:
+      upload_to_gcs(file_like, bucket_name, chunk_pack_blob_name(book_uuid, chapter_uuid))
+    # The index is written last, so it only ever describes a complete archive.
+    with BytesIO(index) as file_like:
+      upload_to_gcs(file_like, bucket_name, chunk_index_blob_name(book_uuid, chapter_uuid))
+    return [(chunk if chunk_range is None else None, chunk_range) for chunk, chunk_range in zip(chunks, ranges)]
+
+  chunk_jobs = []
+  for index, chunk in enumerate(chunks, start=1):
+    if is_inline_chunk(chunk, INLINE_PAYLOAD_MAX_BYTES):
+      chunk_jobs.append((chunk, None))
+      continue
+    with BytesIO(chunk.encode('utf-8')) as file_like:
+      upload_to_gcs(file_like, bucket_name, chunk_blob_name(book_uuid, chapter_uuid, index))
+    chunk_jobs.append((None, None))
+  return chunk_jobs
+
+
+def publish_uploaded_chapter(book_uuid, upload, chapter_uuid, chapter_title, chapter_number, failed_chapters,
+                             preview=False):
+  """
+  Waits for a chapter upload and, only if it succeeded, registers the chapter and queues its chunker job
+  (or, in the 'fused' pipeline mode, its TTS jobs).
+
+  :param book_uuid: UUID of the book in process
+  :param upload: Future of the chapter upload (resolving to the chunks of the chapter in the 'fused' pipeline mode)
+  :param chapter_uuid: UUID of the chapter
+  :param chapter_title: Title of the chapter
+  :param chapter_number: Position of the chapter in the book, from 1
+  :param failed_chapters: List collecting the titles of chapters whose upload failed
+  :param preview: True if a listener is waiting for the opening of the book
+  """
+  try:
+    chunk_jobs = upload.result()
+  except Exception as e:
+    print(f"Error uploading chapter {chapter_title} (uuid: {chapter_uuid}) to GCS:\nError:\n{e}")
+    failed_chapters.append(chapter_title)
+    return
+
+  # Notify the event tracker about the chapter we just uploaded to GCS
+  notify_event_tracker(add_chapter(book_uuid, chapter_uuid, chapter_title))
+
+  if SPLITTER_PIPELINE_MODE == "fused":
+    publish_chapter_chunks(book_uuid, chapter_uuid, chunk_jobs, chapter_number, preview)
+  else:
+    # Add a new job into the chunker queue.
+    enqueue_chunker_job(book_uuid, chapter_uuid, chapter_number, preview)
+
+  # Only now can a retried split job skip the chapter.
+  redis_client.set(chunker_queued_key(chapter_uuid), 1)
+
+
+def publish_chapter_chunks(book_uuid, chapter_uuid, chunk_jobs, chapter_number=None, preview=False):
+  """
+  Sends the event tracker the same messages the chunker would for a chunked chapter and queues its TTS jobs.
+
+  :param book_uuid: UUID of the book in process
+  :param chapter_uuid: UUID of the chapter
+  :param chunk_jobs: For every chunk in order, its (chunk text, chunk range) pair as returned by upload_chapter_chunks
+  :param chapter_number: Position of the chapter in the book, which sets the priority of its TTS jobs
+  :param preview: True if a listener is waiting for the opening of the book
+  """
+  chunk_count = len(chunk_jobs)
+  notify_event_tracker(update_chapter_status(book_uuid, chapter_uuid, 'in_progress'))
+
+  # Register every chunk with one message before the first TTS job is queued.
+  if chunk_count:
+    notify_event_tracker(add_chunks(book_uuid, chapter_uuid, range(1, chunk_count + 1)))
+
+  for index, (chunk_text, chunk_range) in enumerate(chunk_jobs, start=1):
+    # Add a job for the TTS to process the given chunk.
+    priority = tts_job_priority(chapter_number, index, preview) if TTS_PRIORITY_SCHEDULING else None
+    enqueue_tts_job(book_uuid, chapter_uuid, index, chunk_text, chunk_range, priority=priority)
+
+  print(f"Chapter {chapter_uuid} has been split into {chunk_count} chunks and queued for TTS.")
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def iter_book_documents(epub_file):
+  """
+  Yields the (name, body content) pairs of the book's documents using the configured extraction mode.
+
+  :param epub_file: Path to the EPUB file
+  :return: Generator of (document name, HTML body content) tuples
+  """
+  if SPLITTER_EXTRACTION_MODE == "streaming":
+    return stream_spine_documents(epub_file)
+  if SPLITTER_EXTRACTION_MODE == "ebooklib":
+    return read_book_documents(epub_file)
+  raise ValueError(f"Unknown splitter extraction mode: {SPLITTER_EXTRACTION_MODE}")
+
+
+def read_book_documents(epub_file):
+  """
+  Loads the whole EPUB with ebooklib and yields every document item in manifest order.
+
+  :param epub_file: Path to the EPUB file
+  """
+  book = epub.read_epub(epub_file)
+  for item in book.get_items():
+    if item.get_type() == ITEM_DOCUMENT:
+      yield item.get_name(), item.get_body_content()
+
+
+def stream_spine_documents(epub_file):
+  """
+  Walks the OPF spine and reads one XHTML member from the archive at a time, so memory stays
+  flat regardless of the size of the book.
+
+  :param epub_file: Path to the EPUB file
+  """
+  with zipfile.ZipFile(epub_file) as archive:
+    container = etree.fromstring(archive.read(CONTAINER_PATH), OPF_PARSER)
+    rootfile = container.find(f".//{{{CONTAINER_NS}}}rootfile")
+    if rootfile is None:
+      raise ValueError(f"No rootfile declared in {CONTAINER_PATH}")
+
+    opf_path = rootfile.get("full-path")
+    opf_dir = posixpath.dirname(opf_path)
+    package = etree.fromstring(archive.read(opf_path), OPF_PARSER)
+
+    manifest = {item.get("id"): item for item in package.iterfind(f"{{{OPF_NS}}}manifest/{{{OPF_NS}}}item")}
+
+    for itemref in package.iterfind(f"{{{OPF_NS}}}spine/{{{OPF_NS}}}itemref"):
+      item = manifest.get(itemref.get("idref"))
+      if item is None or item.get("media-type") not in XHTML_MEDIA_TYPES:
+        continue
+      # The navigation document is not a chapter (ebooklib reports it as ITEM_NAVIGATION).
+      if "nav" in (item.get("properties") or "").split():
+        continue
+
+      href = unquote(item.get("href"))
+      member = posixpath.normpath(posixpath.join(opf_dir, href))
+      document = epub.EpubHtml(file_name=href, content=archive.read(member))
+      yield href, document.get_body_content()
+
+
+def iter_chapter_texts(documents, workers=None):
+  """
+  Converts documents to chapter text, fanning the work out to a process pool when more than one worker is configured.
+  Results are yielded in document order as soon as every earlier document has been converted, and only a bounded
+  window of documents is in flight at any time.
+
+  :param documents: Iterable of (document name, HTML body content) tuples
+  :param workers: Number of worker processes (defaults to SPLITTER_WORKERS)
+  :return: Generator of (document name, chapter text) tuples
+  """
+  workers = SPLITTER_WORKERS if workers is None else workers
+  if workers <= 1:
+    for name, body_content in documents:
+      yield name, html_to_text(body_content)
+    return
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    pending = deque()
+    for name, body_content in documents:
+      pending.append((name, pool.submit(html_to_text, body_content)))
+      # Keep every worker busy without reading the whole book ahead of the publisher.
+      if len(pending) >= 2 * workers:
+        done_name, future = pending.popleft()
+        yield done_name, future.result()
+
+    while pending:
+      done_name, future = pending.popleft()
+      yield done_name, future.result()
+
+
+def html_to_text(body_content):
+  """
+  Converts the HTML body of a document into plain chapter text with the configured extraction engine.
+
+  :param body_content: HTML content of the document body
+  :return: Chapter text with paragraphs separated by blank lines
+  """
+  return extract_text(body_content, SPLITTER_EXTRACTION_ENGINE)
+
+# ---------------------------------------------------------------------------------------------------------------------
+
 def notify_event_tracker(message):
   try:
     # Publish the message to the RabbitMQ queue
@@ -179,9 +487,9 @@ def notify_event_tracker(message):
 
 # ---------------------------------------------------------------------------------------------------------------------
 
-def enqueue_chunker_job(book_uuid, chapter_title):
+def enqueue_chunker_job(book_uuid, chapter_title, chapter_number=None, preview=False):
   try:
-    message = chunker_job(book_uuid, chapter_title)
+    message = chunker_job(book_uuid, chapter_title, chapter_number, preview)
     # Publish the message to the RabbitMQ queue
     channel.basic_publish(
       exchange="",
@@ -192,59 +500,32 @@ def enqueue_chunker_job(book_uuid, chapter_title):
     raise RuntimeError(f"Failed to enqueue job in chunker queue: {e}")
 
 
-# ---------------------------------------------------------------------------------------------------------------------
+def enqueue_tts_job(book_uuid, chapter_uuid, chunk_index, chunk_text=None, chunk_range=None, priority=None):
+  try:
+    message = tts_job(book_uuid, chapter_uuid, chunk_index, chunk_text, INLINE_PAYLOAD_COMPRESSION, chunk_range)
+    if fair_scheduler is not None:
+      # Queue the job on the book's sub-queue; the TTS dispatcher moves it to the TTS queue when the book's turn comes.
+      fair_scheduler.enqueue(book_uuid, message, priority)
+      return
+
+    # Publish the message to the RabbitMQ queue
+    channel.basic_publish(
+      exchange="",
+      routing_key=TTS_QUEUE_NAME,
+      body=json.dumps(message),
+      properties=pika.BasicProperties(priority=priority)
+    )
+  except Exception as e:
+    raise RuntimeError(f"Failed to enqueue job in TTS queue: {e}")
+
 
-def is_metadata(chapter_title, chapter_text):
-  """
-  Determines whether a chapter is metadata or actual content.
-
-  :param chapter_title: The title of the chapter
-  :param chapter_text: The full text of the chapter
-  :return: True if the chapter is metadata, False otherwise
-  """
-  # Normalize title and text for comparison
-  title_lower = chapter_title.lower() if chapter_title else ""
-  text_lower = chapter_text.lower()
-
-  # Comprehensive list of metadata keywords
-  METADATA_KEYWORDS = [
-    "table of contents", "toc", "index", "contents", "navigation",
-    "list of figures", "list of tables", "catalog", "foreword", "preface",
-    "acknowledgments", "introduction", "prologue", "epilogue", "afterword",
-    "notes", "appendix", "dedication", "about the author", "about this book",
-    "introduction to the author", "copyright", "all rights reserved",
-    "terms of use", "disclaimer", "license", "publishing", "publisher",
-    "isbn", "edition", "version", "revision history", "errata", "change log",
-    "references", "bibliography", "works cited", "citations", "further reading",
-    "footnotes", "endnotes", "praise for", "reviews", "excerpt", "sample chapter",
-    "advance praise", "preview", "teaser", "coming next", "blank page", "front matter",
-    "back matter", "half title", "title page", "colophon", "cover", "spine",
-    "glossary", "abbreviations", "acronyms", "key terms", "index of terms",
-    "dedication", "in memoriam", "by the same author", "also by", "chapter",
-    "part", "section", "contents of chapter", "overview of chapter"
-  ]
-
-  # Check if title matches any metadata keywords
-  if any(keyword in title_lower for keyword in METADATA_KEYWORDS):
-    return True
-
-
-  # Check for high non-alphanumeric character ratio (common in metadata)
-  non_alnum_ratio = sum(1 for char in text_lower if not char.isalnum()) / max(len(text_lower), 1)
-  if non_alnum_ratio > 0.3:  # Adjust threshold based on content
-    return True
-
-  # Check for excessive hyperlinks (common in tables of contents)
-  if text_lower.count("http") > 5 or text_lower.count("www.") > 5:
-    return True
-
-  # If none of the conditions are met, it's likely content
-  return False
+# ---------------------------------------------------------------------------------------------------------------------
 
 def start_service():
   # ---- Queue to hold split jobs ----
   channel.queue_declare(queue = SPLITTER_QUEUE_NAME)
   channel.queue_declare(queue = CHUNKER_QUEUE_NAME)
+  channel.queue_declare(queue = TTS_QUEUE_NAME, arguments = tts_queue_arguments(TTS_PRIORITY_SCHEDULING))
 
   # ---- Start consuming messages from the queue ----
   print(f"Listening for messages on queue '{SPLITTER_QUEUE_NAME}'...")
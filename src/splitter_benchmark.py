@@ -0,0 +1,104 @@
+"""
+Simulates the chunker -> TTS -> stitcher pipeline for one book to compare chapter dispatch orders.
+
+The splitter decides the order in which chapters reach the chunker queue; every later stage is FIFO. This simulation
+replays a book through the three stages with the configured number of replicas and reports when the last chapter
+is stitched (the book's completion time) for document order and largest-first order.
+
+Usage: python splitter_benchmark.py [--chapters 40] [--chunkers 3] [--stitchers 5] [--tts-workers 10 25 50]
+"""
+import argparse
+import heapq
+import math
+import random
+
+CHUNK_BYTES = 5000
+DOWNLOAD_SECONDS = 0.2          # Chunker: download of one chapter
+UPLOAD_SECONDS = 0.15           # Chunker: upload of one chunk
+TTS_BASE_SECONDS = 0.5          # TTS: request overhead per chunk
+TTS_BYTES_PER_SECOND = 2500     # TTS: synthesis throughput
+STITCH_SECONDS_PER_CHUNK = 0.3  # Stitcher: decode and re-encode one chunk
+
+
+def synthetic_chapter_sizes(chapters, seed=5253):
+  """
+  Chapter sizes in bytes: mostly mid-sized chapters with a few long ones, one of them near the end of the book.
+  """
+  rng = random.Random(seed)
+  sizes = [int(rng.lognormvariate(math.log(20000), 0.6)) for _ in range(chapters)]
+  sizes[-3] = 48 * CHUNK_BYTES
+  return sizes
+
+
+def chunk_sizes(chapter_size):
+  full, rest = divmod(chapter_size, CHUNK_BYTES)
+  return [CHUNK_BYTES] * full + ([rest] if rest else [])
+
+
+def run_servers(arrivals, servers):
+  """
+  Runs FIFO jobs over identical servers.
+
+  :param arrivals: List of (arrival time, duration, key) in queue order
+  :param servers: Number of servers
+  :return: Dict of key -> (start time, finish time)
+  """
+  free_at = [0.0] * servers
+  schedule = {}
+  for arrival, duration, key in sorted(arrivals, key=lambda job: job[0]):
+    start = max(arrival, heapq.heappop(free_at))
+    heapq.heappush(free_at, start + duration)
+    schedule[key] = (start, start + duration)
+  return schedule
+
+
+def simulate_book(chapter_sizes, chunkers, tts_workers, stitchers):
+  """
+  Returns the completion time of a book whose chapters are dispatched in the given order.
+
+  :param chapter_sizes: Chapter sizes in bytes, in dispatch order
+  """
+  chunked = run_servers(
+    [(0.0, DOWNLOAD_SECONDS + UPLOAD_SECONDS * len(chunk_sizes(size)), chapter)
+     for chapter, size in enumerate(chapter_sizes)],
+    chunkers
+  )
+
+  tts_jobs = []
+  for chapter, size in enumerate(chapter_sizes):
+    chunker_start, _ = chunked[chapter]
+    for index, chunk_size in enumerate(chunk_sizes(size), start=1):
+      released = chunker_start + DOWNLOAD_SECONDS + UPLOAD_SECONDS * index
+      tts_jobs.append((released, TTS_BASE_SECONDS + chunk_size / TTS_BYTES_PER_SECOND, (chapter, index)))
+  synthesized = run_servers(tts_jobs, tts_workers)
+
+  stitch_jobs = []
+  for chapter, size in enumerate(chapter_sizes):
+    chunks = chunk_sizes(size)
+    ready = max(synthesized[(chapter, index)][1] for index in range(1, len(chunks) + 1))
+    stitch_jobs.append((ready, STITCH_SECONDS_PER_CHUNK * len(chunks), chapter))
+  stitched = run_servers(stitch_jobs, stitchers)
+
+  return max(finish for _, finish in stitched.values())
+
+
+def run_benchmark(chapters, chunkers, stitchers, tts_worker_counts):
+  sizes = synthetic_chapter_sizes(chapters)
+  largest_first = sorted(sizes, reverse=True)
+  print(f"Book: {chapters} chapters, {sum(sizes) / 1000:.0f} kB, largest chapter {max(sizes) / 1000:.0f} kB "
+        f"at position {sizes.index(max(sizes)) + 1}")
+  print(f"{'tts workers':>12} {'document (s)':>14} {'largest first (s)':>18} {'improvement':>12}")
+  for tts_workers in tts_worker_counts:
+    document = simulate_book(sizes, chunkers, tts_workers, stitchers)
+    reordered = simulate_book(largest_first, chunkers, tts_workers, stitchers)
+    print(f"{tts_workers:>12} {document:>14.1f} {reordered:>18.1f} {100 * (document - reordered) / document:>11.1f}%")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--chapters', type=int, default=40)
+  parser.add_argument('--chunkers', type=int, default=3)
+  parser.add_argument('--stitchers', type=int, default=5)
+  parser.add_argument('--tts-workers', type=int, nargs='+', default=[10, 25, 50, 100])
+  args = parser.parse_args()
+  run_benchmark(args.chapters, args.chunkers, args.stitchers, args.tts_workers)
@@ -11,7 +11,15 @@ from splitter import (
     is_metadata,
     process_split_job,
     notify_event_tracker,
-    enqueue_chunker_job
+    enqueue_chunker_job,
+    enqueue_tts_job,
+    stream_spine_documents,
+    read_book_documents,
+    iter_chapter_texts,
+    html_to_text,
+    make_chapter_uuid,
+    dispatch_order,
+    ChapterUploadError
 )
 
 class TestSplitter(unittest.TestCase):
@@ -53,10 +61,12 @@ class TestSplitter(unittest.TestCase):
             epub.write_epub(tmp_file.name, book, {})
             return tmp_file.name
 
+    @patch('splitter.redis_client')
     @patch('splitter.upload_to_gcs')
     @patch('splitter.notify_event_tracker')
     @patch('splitter.enqueue_chunker_job')
-    def test_split_book_into_chapters(self, mock_enqueue, mock_notify, mock_upload):
+    def test_split_book_into_chapters(self, mock_enqueue, mock_notify, mock_upload, mock_redis):
+        mock_redis.exists.return_value = 0
         epub_file = self.create_dummy_epub()
         bucket_name = 'test-bucket'
         book_uuid = 'test-uuid'
@@ -67,8 +77,10 @@ class TestSplitter(unittest.TestCase):
             # Check if upload_to_gcs was called twice (for two valid chapters)
             self.assertEqual(mock_upload.call_count, 2)
 
-            # Check if notify_event_tracker was called for each chapter
-            self.assertEqual(mock_notify.call_count, 3)
+            # Check if notify_event_tracker was called for the book, each chapter and the end of the split
+            self.assertEqual(mock_notify.call_count, 4)
+            self.assertEqual(mock_notify.call_args.args[0],
+                             {"operation": "split_finished", "book_uuid": book_uuid, "total_chapters": 2})
 
             # Check if enqueue_chunker_job was called for each chapter
             self.assertEqual(mock_enqueue.call_count, 2)
@@ -77,6 +89,202 @@ class TestSplitter(unittest.TestCase):
             # Clean up the temporary EPUB file
             os.unlink(epub_file)
 
+    @patch('splitter.SPLITTER_EXTRACTION_MODE', 'streaming')
+    @patch('splitter.redis_client')
+    @patch('splitter.upload_to_gcs')
+    @patch('splitter.notify_event_tracker')
+    @patch('splitter.enqueue_chunker_job')
+    def test_split_book_into_chapters_streaming(self, mock_enqueue, mock_notify, mock_upload, mock_redis):
+        mock_redis.exists.return_value = 0
+        epub_file = self.create_dummy_epub()
+
+        try:
+            split_book_into_chapters(epub_file, 'test-bucket', 'test-uuid')
+
+            self.assertEqual(mock_upload.call_count, 2)
+            self.assertEqual(mock_notify.call_count, 4)
+            self.assertEqual(mock_enqueue.call_count, 2)
+        finally:
+            os.unlink(epub_file)
+
+    @patch('splitter.SPLITTER_PIPELINE_MODE', 'fused')
+    @patch('splitter.redis_client')
+    @patch('splitter.upload_to_gcs')
+    @patch('splitter.notify_event_tracker')
+    @patch('splitter.enqueue_chunker_job')
+    @patch('splitter.enqueue_tts_job')
+    def test_split_book_into_chapters_fused(self, mock_tts, mock_enqueue, mock_notify, mock_upload, mock_redis):
+        mock_redis.exists.return_value = 0
+        epub_file = self.create_dummy_epub()
+
+        try:
+            split_book_into_chapters(epub_file, 'test-bucket', 'test-uuid')
+
+            # Each chapter fits in one chunk, which goes straight to the chunk path the TTS service reads.
+            chapter_uuid = make_chapter_uuid('test-uuid', 0, 'chap_01.xhtml')
+            uploaded = [c.args[2] for c in mock_upload.call_args_list]
+            self.assertEqual(len(uploaded), 2)
+            self.assertIn(f"test-uuid/chunks/{chapter_uuid}/chunk_1.txt", uploaded)
+            self.assertFalse(any('/chapters/' in blob for blob in uploaded))
+
+            # The event tracker hears what the splitter and chunker would have sent.
+            operations = [c.args[0]["operation"] for c in mock_notify.call_args_list]
+            self.assertEqual(operations, ['update_book_status'] + ['add_chapter', 'update_chapter_status', 'add_chunks'] * 2
+                             + ['split_finished'])
+
+            mock_enqueue.assert_not_called()
+            mock_tts.assert_any_call('test-uuid', chapter_uuid, 1, None, None, priority=None)
+            self.assertEqual(mock_tts.call_count, 2)
+        finally:
+            os.unlink(epub_file)
+
+    @patch('splitter.redis_client')
+    @patch('splitter.upload_to_gcs')
+    @patch('splitter.notify_event_tracker')
+    @patch('splitter.enqueue_chunker_job')
+    def test_split_book_into_chapters_upload_failure(self, mock_enqueue, mock_notify, mock_upload, mock_redis):
+        mock_redis.exists.return_value = 0
+        epub_file = self.create_dummy_epub()
+
+        def fail_chapter_2(file_like, bucket_name, destination_blob_name):
+            if b'chapter 2' in file_like.read():
+                raise RuntimeError("Error uploading to GCS: boom")
+
+        mock_upload.side_effect = fail_chapter_2
+
+        try:
+            with self.assertRaises(ChapterUploadError):
+                split_book_into_chapters(epub_file, 'test-bucket', 'test-uuid')
+
+            # Only the chapter that reached GCS is registered and sent to the chunker.
+            self.assertEqual(mock_upload.call_count, 2)
+            self.assertEqual(mock_notify.call_count, 2)
+            self.assertEqual(mock_enqueue.call_count, 1)
+        finally:
+            os.unlink(epub_file)
+
+    @patch('splitter.redis_client')
+    @patch('splitter.upload_to_gcs')
+    @patch('splitter.notify_event_tracker')
+    @patch('splitter.enqueue_chunker_job')
+    def test_split_book_into_chapters_retry_is_idempotent(self, mock_enqueue, mock_notify, mock_upload, mock_redis):
+        epub_file = self.create_dummy_epub()
+        keys = set()
+        mock_redis.exists.side_effect = lambda key: int(key in keys)
+        mock_redis.set.side_effect = lambda key, value: keys.add(key)
+
+        try:
+            split_book_into_chapters(epub_file, 'test-bucket', 'test-uuid')
+            first_run = [c.args[0] for c in mock_enqueue.call_args_list]
+            self.assertEqual(len(first_run), 2)
+
+            # Every chunker job is queued; a redelivered split job is a no-op.
+            mock_upload.reset_mock()
+            mock_enqueue.reset_mock()
+            split_book_into_chapters(epub_file, 'test-bucket', 'test-uuid')
+
+            mock_upload.assert_not_called()
+            mock_enqueue.assert_not_called()
+        finally:
+            os.unlink(epub_file)
+
+    @patch('splitter.redis_client')
+    @patch('splitter.upload_to_gcs')
+    @patch('splitter.notify_event_tracker')
+    @patch('splitter.enqueue_chunker_job')
+    def test_split_book_into_chapters_retry_queues_unchunked_chapter(self, mock_enqueue, mock_notify, mock_upload,
+                                                                      mock_redis):
+        epub_file = self.create_dummy_epub()
+        keys = set()
+        mock_redis.exists.side_effect = lambda key: int(key in keys)
+        mock_redis.set.side_effect = lambda key, value: keys.add(key)
+
+        def crash_on_chapter_2(book_uuid, chapter_uuid, chapter_number=None, preview=False):
+            if chapter_number == 2:
+                raise RuntimeError("Failed to enqueue job in chunker queue: connection lost")
+
+        mock_enqueue.side_effect = crash_on_chapter_2
+
+        try:
+            # Chapter 2 is registered with the event tracker, but its chunker job is never queued.
+            with self.assertRaises(RuntimeError):
+                split_book_into_chapters(epub_file, 'test-bucket', 'test-uuid')
+            self.assertEqual(mock_enqueue.call_count, 2)
+
+            mock_enqueue.reset_mock()
+            mock_enqueue.side_effect = None
+            split_book_into_chapters(epub_file, 'test-bucket', 'test-uuid')
+
+            # The retry skips chapter 1 and queues chapter 2 after all.
+            mock_enqueue.assert_called_once()
+            self.assertEqual(mock_enqueue.call_args.args[2], 2)
+        finally:
+            os.unlink(epub_file)
+
+    @patch('splitter.SPLITTER_DISPATCH_ORDER', 'largest_first')
+    @patch('splitter.redis_client')
+    @patch('splitter.upload_to_gcs')
+    @patch('splitter.notify_event_tracker')
+    @patch('splitter.enqueue_chunker_job')
+    def test_split_book_into_chapters_numbers_chapters(self, mock_enqueue, mock_notify, mock_upload, mock_redis):
+        mock_redis.exists.return_value = 0
+        epub_file = self.create_dummy_epub()
+
+        try:
+            split_book_into_chapters(epub_file, 'test-bucket', 'test-uuid', preview=True)
+
+            # Chapters keep their document number whatever the dispatch order, which sets their TTS priority.
+            first_chapter = make_chapter_uuid('test-uuid', 0, 'chap_01.xhtml')
+            numbers = {c.args[1]: c.args[2] for c in mock_enqueue.call_args_list}
+            self.assertEqual(sorted(numbers.values()), [1, 2])
+            self.assertEqual(numbers[first_chapter], 1)
+            self.assertTrue(all(c.args[3] for c in mock_enqueue.call_args_list))
+        finally:
+            os.unlink(epub_file)
+
+    def test_dispatch_order_document(self):
+        chapters = [("a", "A", "short", 1), ("b", "B", "the longest chapter", 2), ("c", "C", "longer", 3)]
+        self.assertEqual(list(dispatch_order(iter(chapters))), chapters)
+
+    @patch('splitter.SPLITTER_DISPATCH_ORDER', 'largest_first')
+    def test_dispatch_order_largest_first(self):
+        chapters = [("a", "A", "short", 1), ("b", "B", "the longest chapter", 2), ("c", "C", "longer", 3),
+                    ("d", "D", "tiny!", 4)]
+        ordered = [(chapter_uuid, chapter_number) for chapter_uuid, _, _, chapter_number in dispatch_order(iter(chapters))]
+        # Equal sizes keep their document order, and every chapter keeps its document number.
+        self.assertEqual(ordered, [("b", 2), ("c", 3), ("a", 1), ("d", 4)])
+
+    def test_make_chapter_uuid_is_deterministic(self):
+        chapter_uuid = make_chapter_uuid('book-uuid', 3, 'chap_03.xhtml')
+        self.assertEqual(chapter_uuid, make_chapter_uuid('book-uuid', 3, 'chap_03.xhtml'))
+        self.assertNotEqual(chapter_uuid, make_chapter_uuid('other-book-uuid', 3, 'chap_03.xhtml'))
+        self.assertNotEqual(chapter_uuid, make_chapter_uuid('book-uuid', 4, 'chap_03.xhtml'))
+
+    def test_stream_spine_documents(self):
+        epub_file = self.create_dummy_epub()
+
+        try:
+            documents = list(stream_spine_documents(epub_file))
+
+            # The nav document is skipped and the rest follow the spine order.
+            self.assertEqual([name for name, _ in documents], ['chap_01.xhtml', 'toc.xhtml', 'chap_02.xhtml'])
+
+            # Body content matches what ebooklib extracts for the same documents.
+            loaded = dict(read_book_documents(epub_file))
+            for name, body_content in documents:
+                self.assertEqual(body_content, loaded[name])
+        finally:
+            os.unlink(epub_file)
+
+    def test_iter_chapter_texts_process_pool_preserves_order(self):
+        documents = [(f"chap_{i:02}.xhtml", f"<p>Paragraph {i}.</p>".encode('utf-8')) for i in range(12)]
+
+        serial = list(iter_chapter_texts(documents, workers=1))
+        parallel = list(iter_chapter_texts(iter(documents), workers=3))
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(serial[3], ("chap_03.xhtml", html_to_text(documents[3][1])))
+
     def test_is_metadata(self):
         # Test cases that should be identified as metadata
         self.assertTrue(is_metadata("Table of Contents", "Chapter 1\nChapter 2"))
@@ -93,6 +301,14 @@ class TestSplitter(unittest.TestCase):
         notify_event_tracker(message)
         mock_channel.basic_publish.assert_called_once()
 
+    @patch('splitter.fair_scheduler')
+    @patch('splitter.channel')
+    def test_enqueue_tts_job_fair_share(self, mock_channel, mock_scheduler):
+        enqueue_tts_job("test-book-uuid", "test-chapter-uuid", 2, priority=None)
+        mock_scheduler.enqueue.assert_called_once()
+        self.assertEqual(mock_scheduler.enqueue.call_args.args[0], "test-book-uuid")
+        mock_channel.basic_publish.assert_not_called()
+
     @patch('splitter.channel')
     def test_enqueue_chunker_job(self, mock_channel):
         enqueue_chunker_job("test-book-uuid", "test-chapter-title")
@@ -112,5 +328,38 @@ class TestSplitter(unittest.TestCase):
         mock_split.assert_called_once()
         ch.basic_ack.assert_called_once()
 
+    @patch('splitter.notify_event_tracker')
+    @patch('splitter.split_book_into_chapters')
+    @patch('splitter.download_file_from_gcs')
+    def test_process_split_job_requeues_failed_chapters(self, mock_download, mock_split, mock_notify):
+        mock_split.side_effect = ChapterUploadError("Failed to upload 1 of 2 chapters: ['chap_02']")
+        ch = MagicMock()
+        method = MagicMock()
+        body = json.dumps({"book_uuid": "test-uuid"})
+
+        process_split_job(ch, method, MagicMock(), body)
+
+        # The chapters that failed are retried with the job instead of being dropped.
+        ch.basic_nack.assert_called_once_with(delivery_tag=method.delivery_tag, requeue=True)
+        ch.basic_ack.assert_not_called()
+        mock_notify.assert_not_called()
+
+    @patch('splitter.notify_event_tracker')
+    @patch('splitter.split_book_into_chapters')
+    @patch('splitter.download_file_from_gcs')
+    def test_process_split_job_marks_book_failed(self, mock_download, mock_split, mock_notify):
+        mock_split.side_effect = ValueError("Unknown splitter pipeline mode: bogus")
+        ch = MagicMock()
+        method = MagicMock()
+        body = json.dumps({"book_uuid": "test-uuid"})
+
+        process_split_job(ch, method, MagicMock(), body)
+
+        ch.basic_nack.assert_called_once_with(delivery_tag=method.delivery_tag, requeue=False)
+        mock_notify.assert_called_once()
+        message = mock_notify.call_args.args[0]
+        self.assertEqual(message["book_uuid"], "test-uuid")
+        self.assertEqual(message["status"], "failed")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,216 @@
+# ---- Engines that turn the HTML body of an EPUB document into plain chapter text, and chapter classification. ----
+import html
+import re
+from io import BytesIO
+
+from bs4 import BeautifulSoup
+from lxml import etree
+
+# Tags whose whole subtree is dropped from the chapter text.
+SKIPPED_TAGS = {'script', 'style', 'span', 'div'}
+
+# Comprehensive list of metadata keywords
+METADATA_KEYWORDS = [
+  "table of contents", "toc", "index", "contents", "navigation",
+  "list of figures", "list of tables", "catalog", "foreword", "preface",
+  "acknowledgments", "introduction", "prologue", "epilogue", "afterword",
+  "notes", "appendix", "dedication", "about the author", "about this book",
+  "introduction to the author", "copyright", "all rights reserved",
+  "terms of use", "disclaimer", "license", "publishing", "publisher",
+  "isbn", "edition", "version", "revision history", "errata", "change log",
+  "references", "bibliography", "works cited", "citations", "further reading",
+  "footnotes", "endnotes", "praise for", "reviews", "excerpt", "sample chapter",
+  "advance praise", "preview", "teaser", "coming next", "blank page", "front matter",
+  "back matter", "half title", "title page", "colophon", "cover", "spine",
+  "glossary", "abbreviations", "acronyms", "key terms", "index of terms",
+  "dedication", "in memoriam", "by the same author", "also by", "chapter",
+  "part", "section", "contents of chapter", "overview of chapter"
+]
+
+# One alternation scans the title once instead of one substring search per keyword.
+METADATA_TITLE_PATTERN = re.compile('|'.join(re.escape(keyword) for keyword in METADATA_KEYWORDS))
+
+# Byte tables for counting ASCII characters with bytes.translate, which runs in C.
+ASCII_BYTES = bytes(range(128))
+ASCII_ALNUM_BYTES = bytes(code for code in range(128) if chr(code).isalnum())
+ASCII_ALNUM_AND_NON_ASCII_BYTES = ASCII_ALNUM_BYTES + bytes(range(128, 256))
+
+
+def finish_text(paragraphs):
+  """
+  Joins paragraph texts into the final chapter text.
+
+  :param paragraphs: List of paragraph texts in document order
+  :return: Chapter text with paragraphs separated by blank lines
+  """
+  # Join paragraphs with double newlines
+  chapter_text = "\n\n".join(paragraphs)
+
+  # Merge hyphenated words across lines
+  chapter_text = re.sub(r'-\n', '', chapter_text)
+
+  # Decode HTML entities and clean up text
+  return html.unescape(chapter_text).replace('\xa0', ' ')
+
+
+def bs4_to_text(body_content):
+  """
+  Reference engine built on BeautifulSoup's pure-Python 'html.parser' backend.
+
+  :param body_content: HTML content of the document body
+  :return: Chapter text
+  """
+  soup = BeautifulSoup(body_content, 'html.parser')
+
+  # Remove script and style tags
+  for tag in soup(list(SKIPPED_TAGS)):
+    tag.decompose()
+
+  # Preserve paragraph breaks and handle drop caps
+  paragraphs = []
+  for paragraph in soup.find_all('p'):
+    # Handle dropcap specifically
+    dropcap_span = paragraph.find('span', class_='dropcap')
+    if dropcap_span:
+      dropcap = dropcap_span.get_text(strip=True)
+      dropcap_span.extract()  # Remove dropcap to avoid duplication
+      # Combine dropcap with the rest of the paragraph text
+      paragraph_text = dropcap + paragraph.get_text(strip=True)
+    else:
+      paragraph_text = paragraph.get_text(strip=True)
+
+    paragraphs.append(paragraph_text)
+
+  return finish_text(paragraphs)
+
+
+def lxml_to_text(body_content):
+  """
+  Single-pass engine built on lxml's iterparse. It produces the same text as bs4_to_text: skipped subtrees are
+  dropped, every <p> contributes its stripped strings joined without separators, and paragraphs are reported in
+  the order they open. Bodies that are not well-formed XML fall back to the reference engine.
+
+  :param body_content: HTML content of the document body (as serialized by ebooklib)
+  :return: Chapter text
+  """
+  if isinstance(body_content, str):
+    body_content = body_content.encode('utf-8')
+
+  document = BytesIO(b'<body>' + body_content + b'</body>')
+  events = etree.iterparse(document, events=('start', 'end'), recover=True, resolve_entities=False)
+
+  paragraphs = []
+  paragraph_slots = {}
+  strings = {}
+  skip_depth = 0
+
+  try:
+    for event, element in events:
+      tag = element.tag
+      if isinstance(tag, str) and tag[0] == '{':
+        tag = tag.rpartition('}')[2]
+
+      if event == 'start':
+        if tag in SKIPPED_TAGS:
+          skip_depth += 1
+        elif tag == 'p' and not skip_depth:
+          # Reserve the slot now so nested paragraphs keep their opening order.
+          paragraph_slots[element] = len(paragraphs)
+          paragraphs.append('')
+        continue
+
+      if tag in SKIPPED_TAGS:
+        skip_depth -= 1
+        continue
+      if skip_depth:
+        continue
+
+      collected = []
+      text = element.text and element.text.strip()
+      if text:
+        collected.append(text)
+      for child in element:
+        collected.extend(strings.pop(child, ()))
+        tail = child.tail and child.tail.strip()
+        if tail:
+          collected.append(tail)
+      strings[element] = collected
+
+      slot = paragraph_slots.pop(element, None)
+      if slot is not None:
+        paragraphs[slot] = ''.join(collected)
+  except etree.XMLSyntaxError:
+    return bs4_to_text(body_content)
+
+  # Undeclared prefixes such as epub:type are harmless; anything else means the tree may differ from html.parser's.
+  if any(error.domain != etree.ErrorDomains.NAMESPACE for error in events.error_log):
+    return bs4_to_text(body_content)
+
+  return finish_text(paragraphs)
+
+
+def count_non_alnum(text):
+  """
+  Counts the characters of text for which str.isalnum() is False.
+
+  ASCII characters are counted at C speed by deleting the alphanumeric bytes with bytes.translate. Only the
+  non-ASCII characters (which UTF-8 encodes with bytes >= 0x80 only) are classified one by one.
+
+  :param text: Text to scan
+  :return: Number of non-alphanumeric characters
+  """
+  if text.isascii():
+    return len(text.encode('ascii').translate(None, ASCII_ALNUM_BYTES))
+
+  encoded = text.encode('utf-8', 'surrogatepass')
+  ascii_count = len(encoded.translate(None, ASCII_ALNUM_AND_NON_ASCII_BYTES))
+  non_ascii = encoded.translate(None, ASCII_BYTES).decode('utf-8', 'surrogatepass')
+  return ascii_count + len(non_ascii) - sum(map(str.isalnum, non_ascii))
+
+
+def is_metadata(chapter_title, chapter_text):
+  """
+  Determines whether a chapter is metadata or actual content.
+
+  :param chapter_title: The title of the chapter
+  :param chapter_text: The full text of the chapter
+  :return: True if the chapter is metadata, False otherwise
+  """
+  # Check if title matches any metadata keywords
+  if chapter_title and METADATA_TITLE_PATTERN.search(chapter_title.lower()):
+    return True
+
+  text_lower = chapter_text.lower()
+
+  # Check for high non-alphanumeric character ratio (common in metadata)
+  non_alnum_ratio = count_non_alnum(text_lower) / max(len(text_lower), 1)
+  if non_alnum_ratio > 0.3:  # Adjust threshold based on content
+    return True
+
+  # Check for excessive hyperlinks (common in tables of contents)
+  if text_lower.count("http") > 5 or text_lower.count("www.") > 5:
+    return True
+
+  # If none of the conditions are met, it's likely content
+  return False
+
+
+EXTRACTION_ENGINES = {
+  'bs4': bs4_to_text,
+  'lxml': lxml_to_text,
+}
+
+
+def extract_text(body_content, engine='bs4'):
+  """
+  Converts the HTML body of a document into plain chapter text with the requested engine.
+
+  :param body_content: HTML content of the document body
+  :param engine: Name of the extraction engine ('bs4' or 'lxml')
+  :return: Chapter text
+  """
+  try:
+    to_text = EXTRACTION_ENGINES[engine]
+  except KeyError:
+    raise ValueError(f"Unknown text extraction engine: {engine}")
+  return to_text(body_content)
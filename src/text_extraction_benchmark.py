@@ -0,0 +1,134 @@
+"""
+Benchmarks the text extraction engines over synthetic EPUBs and checks that they produce the same text, then
+micro-benchmarks the metadata classifier against the keyword-by-keyword implementation it replaced.
+
+Usage: python text_extraction_benchmark.py [--chapters 200] [--paragraphs 60] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from ebooklib import ITEM_DOCUMENT, epub
+
+from text_extraction import EXTRACTION_ENGINES, METADATA_KEYWORDS, is_metadata
+
+WORDS = ("the quick brown fox jumps over the lazy dog while narrators read every single chapter aloud "
+         "café naïve co-operate").split()
+
+
+def synthetic_paragraph(rng):
+  words = [rng.choice(WORDS) for _ in range(rng.randint(20, 80))]
+  # Sprinkle in the inline markup real books carry.
+  for _ in range(rng.randint(0, 4)):
+    index = rng.randrange(len(words))
+    tag = rng.choice(['em', 'strong', 'a', 'span'])
+    words[index] = f'<{tag}>{words[index]}</{tag}>'
+  return f"<p>{' '.join(words)}.</p>"
+
+
+def build_synthetic_epub(path, chapters, paragraphs, seed=5253):
+  """
+  Writes a synthetic EPUB with the given number of chapters and paragraphs per chapter.
+
+  :param path: Destination path of the EPUB file
+  :param chapters: Number of chapter documents
+  :param paragraphs: Number of paragraphs in each chapter
+  :param seed: Seed for the random text generator
+  """
+  rng = random.Random(seed)
+  book = epub.EpubBook()
+  book.set_identifier(f'synthetic-{chapters}-{paragraphs}')
+  book.set_title('Synthetic Book')
+  book.set_language('en')
+
+  items = []
+  for number in range(1, chapters + 1):
+    item = epub.EpubHtml(title=f'Story {number}', file_name=f'story_{number:04}.xhtml', lang='en')
+    body = ''.join(synthetic_paragraph(rng) for _ in range(paragraphs))
+    item.content = f'<html><body><h1>Story {number}</h1><section epub:type="bodymatter">{body}</section></body></html>'
+    book.add_item(item)
+    items.append(item)
+
+  book.spine = ['nav'] + items
+  book.add_item(epub.EpubNcx())
+  book.add_item(epub.EpubNav())
+  epub.write_epub(path, book, {})
+
+
+def legacy_is_metadata(chapter_title, chapter_text):
+  title_lower = chapter_title.lower() if chapter_title else ""
+  text_lower = chapter_text.lower()
+  if any(keyword in title_lower for keyword in METADATA_KEYWORDS):
+    return True
+  non_alnum_ratio = sum(1 for char in text_lower if not char.isalnum()) / max(len(text_lower), 1)
+  if non_alnum_ratio > 0.3:
+    return True
+  if text_lower.count("http") > 5 or text_lower.count("www.") > 5:
+    return True
+  return False
+
+
+def run_metadata_benchmark(texts, repeat):
+  """
+  Times the compiled metadata classifier against the legacy one on content chapters (the slow path, since content
+  titles never short-circuit on a keyword).
+  """
+  titles = [f"story_{number:04}" for number in range(len(texts))]
+  total_chars = sum(len(text) for text in texts)
+  print(f"is_metadata over {len(texts)} chapters, {total_chars / 1e6:.2f}M characters")
+
+  timings = {}
+  decisions = {}
+  for label, classify in (('legacy', legacy_is_metadata), ('compiled', is_metadata)):
+    best = float('inf')
+    for _ in range(repeat):
+      start = time.perf_counter()
+      decisions[label] = [classify(title, text) for title, text in zip(titles, texts)]
+      best = min(best, time.perf_counter() - start)
+    timings[label] = best
+
+  mismatches = sum(1 for legacy, compiled in zip(decisions['legacy'], decisions['compiled']) if legacy != compiled)
+  for label, seconds in timings.items():
+    print(f"  {label:>8}: {seconds * 1000:.1f} ms ({timings['legacy'] / seconds:.2f}x vs legacy)")
+  print(f"  {mismatches} mismatching decisions")
+
+
+def run_benchmark(chapters, paragraphs, repeat):
+  with tempfile.TemporaryDirectory() as temp_dir:
+    epub_path = os.path.join(temp_dir, 'synthetic.epub')
+    build_synthetic_epub(epub_path, chapters, paragraphs)
+    book = epub.read_epub(epub_path)
+    bodies = [item.get_body_content() for item in book.get_items() if item.get_type() == ITEM_DOCUMENT]
+
+  total_bytes = sum(len(body) for body in bodies)
+  print(f"Synthetic book: {len(bodies)} documents, {total_bytes / (1024 * 1024):.2f} MB of body content")
+
+  outputs = {}
+  timings = {}
+  for engine, to_text in EXTRACTION_ENGINES.items():
+    best = float('inf')
+    for _ in range(repeat):
+      start = time.perf_counter()
+      outputs[engine] = [to_text(body) for body in bodies]
+      best = min(best, time.perf_counter() - start)
+    timings[engine] = best
+
+  reference = outputs['bs4']
+  for engine, texts in outputs.items():
+    mismatches = sum(1 for expected, actual in zip(reference, texts) if expected != actual)
+    speedup = timings['bs4'] / timings[engine]
+    print(f"  {engine:>5}: {timings[engine]:.3f}s ({total_bytes / timings[engine] / (1024 * 1024):.1f} MB/s, "
+          f"{speedup:.2f}x vs bs4), {mismatches} mismatching documents")
+
+  run_metadata_benchmark(reference, repeat)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--chapters', type=int, default=200)
+  parser.add_argument('--paragraphs', type=int, default=60)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+  run_benchmark(args.chapters, args.paragraphs, args.repeat)
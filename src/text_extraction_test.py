@@ -0,0 +1,147 @@
+import random
+import unittest
+
+from ebooklib import epub
+
+from text_extraction import (
+    bs4_to_text,
+    lxml_to_text,
+    extract_text,
+    is_metadata,
+    count_non_alnum,
+    EXTRACTION_ENGINES,
+    METADATA_KEYWORDS
+)
+
+# Documents exercising the quirks of today's extraction: skipped subtrees, tails after skipped tags, inline markup,
+# entities, comments, empty and nested paragraphs, hyphenation and namespaced attributes.
+PARITY_CORPUS = [
+    '<p>This is the content of chapter 1.</p>',
+    '<h1>Title</h1><p>First paragraph.</p><p>Second paragraph.</p>',
+    '<p>Hello <b>wor</b>ld and <i>more</i> text.</p>',
+    '<p><span class="dropcap">T</span>he dropcap paragraph.</p>',
+    '<div><p>Paragraph hidden inside a div.</p></div><p>Visible paragraph.</p>',
+    '<p>Before <span>skipped</span> after the span.</p>',
+    '<p>Script <script>var x = 1 &lt; 2;</script>tail kept.</p><style>p { color: red; }</style>',
+    '<p>Entities &amp;amp; &amp;nbsp; &#160; &lt;tag&gt; &quot;quoted&quot;</p>',
+    '<p>Line with hyphen-</p><p>\nated word.</p>',
+    '<p>Comment <!-- not text --> tail.</p>',
+    '<p></p><p>   </p><p>After empties.</p>',
+    '<section epub:type="chapter"><p epub:type="z3998:verse">Namespaced attribute.</p></section>',
+    '<p>Unicode: café, über, 日本語, emoji \U0001F600.</p>',
+    '<blockquote><p>Quoted <em>paragraph</em>.</p></blockquote><ul><li>List item</li></ul>',
+    '<p>Break<br/>line and <img src="a.png" alt="image"/> image.</p>',
+    '<table><tr><td><p>Cell paragraph.</p></td></tr></table>',
+    'Loose text <p>then a paragraph.</p> trailing text',
+]
+
+INLINE_TAGS = ['b', 'i', 'em', 'strong', 'a', 'span', 'small', 'sup']
+BLOCK_TAGS = ['p', 'p', 'p', 'div', 'blockquote', 'h2', 'section']
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'hyphen-', '&amp;amp;', 'café', 'end.', ' ', '\n']
+
+
+def legacy_is_metadata(chapter_title, chapter_text):
+    """The keyword-by-keyword, character-by-character classifier the compiled one replaces."""
+    title_lower = chapter_title.lower() if chapter_title else ""
+    text_lower = chapter_text.lower()
+    if any(keyword in title_lower for keyword in METADATA_KEYWORDS):
+        return True
+    non_alnum_ratio = sum(1 for char in text_lower if not char.isalnum()) / max(len(text_lower), 1)
+    if non_alnum_ratio > 0.3:
+        return True
+    if text_lower.count("http") > 5 or text_lower.count("www.") > 5:
+        return True
+    return False
+
+
+METADATA_TITLES = [
+    '', None, 'chap_01', 'Chapter 1', 'TOC', 'Table of Contents', 'copyright', 'Index_of_Terms', 'story_0042',
+    'The Adventure Begins', 'Epilogue', 'spine_item', 'bodymatter', 'Über die Fahrt', 'partition', 'ISBN_978',
+    'dedication', 'Afterword - Notes', 'x', 'Kapitel_Ⅳ', 'İstanbul',
+]
+
+METADATA_TEXTS = [
+    '', 'It was a dark and stormy night; the rain fell in torrents.',
+    'Chapter 1\nChapter 2\nChapter 3', '... --- *** ... --- ***', '1. 2. 3. 4. 5. 6. 7. 8.',
+    ' '.join(['http://example.com'] * 6), ' '.join(['www.example.com'] * 6), ' '.join(['www.example.com'] * 5),
+    'under_scores_are_not_alphanumeric_at_all', 'Ünïcödé téxt wïth äccents and 日本語の文章。',
+    'Numbers ½ ² Ⅳ ٣ count as alphanumeric', 'İİİİİİİİİİ lowercase changes the length',
+    '\n\n'.join(['A plain paragraph of narrative text.'] * 20),
+]
+
+
+def body_of(markup):
+    """Serializes markup the same way the splitter receives it from ebooklib."""
+    document = epub.EpubHtml(file_name='chapter.xhtml', content=f'<html><body>{markup}</body></html>')
+    return document.get_body_content()
+
+
+def random_markup(rng, depth=0):
+    """Builds a random, well-formed HTML fragment."""
+    parts = []
+    for _ in range(rng.randint(1, 5)):
+        choice = rng.random()
+        if choice < 0.5 or depth > 3:
+            parts.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 6))))
+        else:
+            tag = rng.choice(INLINE_TAGS if choice < 0.75 else BLOCK_TAGS)
+            parts.append(f'<{tag}>{random_markup(rng, depth + 1)}</{tag}>')
+    return ''.join(parts)
+
+
+class TestTextExtraction(unittest.TestCase):
+
+    def test_bs4_to_text_matches_known_output(self):
+        self.assertEqual(bs4_to_text(body_of(PARITY_CORPUS[1])), "First paragraph.\n\nSecond paragraph.")
+        self.assertEqual(bs4_to_text(body_of(PARITY_CORPUS[2])), "Helloworld andmoretext.")
+        self.assertEqual(bs4_to_text(body_of(PARITY_CORPUS[4])), "Visible paragraph.")
+        self.assertEqual(bs4_to_text(body_of(PARITY_CORPUS[5])), "Beforeafter the span.")
+
+    def test_lxml_parity_on_corpus(self):
+        for markup in PARITY_CORPUS:
+            with self.subTest(markup=markup):
+                body_content = body_of(markup)
+                self.assertEqual(lxml_to_text(body_content), bs4_to_text(body_content))
+
+    def test_lxml_parity_on_random_documents(self):
+        rng = random.Random(5253)
+        for _ in range(300):
+            body_content = body_of(random_markup(rng))
+            self.assertEqual(lxml_to_text(body_content), bs4_to_text(body_content))
+
+    def test_lxml_parity_on_raw_markup(self):
+        # Hand-written fragments may not be well-formed XML; the lxml engine must still agree.
+        for markup in ['<p>Unclosed <b>bold</p><p>Next</p>', '<p>Entity &nbsp; here</p>', '<p>Plain</p>']:
+            with self.subTest(markup=markup):
+                self.assertEqual(lxml_to_text(markup), bs4_to_text(markup))
+
+    def test_is_metadata_decision_parity(self):
+        for title in METADATA_TITLES:
+            for text in METADATA_TEXTS:
+                with self.subTest(title=title, text=text[:30]):
+                    self.assertEqual(is_metadata(title, text), legacy_is_metadata(title, text))
+
+    def test_is_metadata_parity_on_random_text(self):
+        rng = random.Random(5253)
+        alphabet = 'abcXYZ019 _-.,;:!?\n\t\xa0éßİ½日本'
+        for _ in range(500):
+            text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 200)))
+            title = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+            self.assertEqual(is_metadata(title, text), legacy_is_metadata(title, text))
+
+    def test_count_non_alnum_matches_isalnum(self):
+        for text in METADATA_TEXTS + ['\ud800 lone surrogate', 'ascii only, with punctuation!', '\U0001F600 emoji']:
+            with self.subTest(text=text[:30]):
+                self.assertEqual(count_non_alnum(text), sum(1 for char in text if not char.isalnum()))
+
+    def test_extract_text_dispatches_to_engine(self):
+        body_content = body_of(PARITY_CORPUS[0])
+        for engine in EXTRACTION_ENGINES:
+            self.assertEqual(extract_text(body_content, engine), "This is the content of chapter 1.")
+
+    def test_extract_text_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            extract_text(b'<p>text</p>', 'regex')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,21 +1,158 @@
+import asyncio
+import functools
 import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import NamedTemporaryFile
 
 import pika
-from google.cloud import texttospeech
+import redis
+from google.api_core.exceptions import ResourceExhausted, TooManyRequests
 
 from constants import GCS_BUCKET_NAME, RABBITMQ_HOST, TTS_QUEUE_NAME, EVENT_TRACKER_QUEUE_NAME, RABBITMQ_PASSWORD, \
-  RABBITMQ_USER
-from messages import update_chunk_status, remove_chunk
+  RABBITMQ_USER, TTS_LANGUAGE_CODE, TTS_VOICE_GENDER, TTS_CACHE_MEMORY_BYTES, TTS_CACHE_PERSISTENT, \
+  TTS_WORKER_MODE, TTS_CONCURRENCY, REDIS_HOST, REDIS_PORT, TTS_RATE_LIMIT, TTS_RATE_LIMIT_INITIAL_RATE, \
+  TTS_RATE_LIMIT_MIN_RATE, TTS_RATE_LIMIT_MAX_RATE, TTS_RATE_LIMIT_BURST, TTS_BACKEND, TTS_LOCAL_LATENCY_MS, \
+  TTS_LOCAL_CHARACTERS_PER_SECOND, TTS_IN_MEMORY_MAX_BYTES, TTS_HEDGING, \
+  TTS_HEDGE_PERCENTILE, TTS_HEDGE_BUDGET_PERCENT, TTS_HEDGE_MIN_SAMPLES, TTS_PRIORITY_SCHEDULING, TTS_FAIR_SHARE, \
+  TTS_SKIP_EXISTING_AUDIO, TTS_AUDIO_ENCODING
+from chunking import chunk_pack_blob_name
+from fair_scheduler import FairScheduler
+from hedging import Hedger
+from messages import update_chunk_status, remove_chunk, decode_payload, tts_queue_arguments
+from rate_limiter import RateLimiter
 from redis_ops import UPDATE_CHUNK_STATUS, REMOVE_CHUNK
-from utils import download_file_from_gcs, upload_to_gcs
+from tts_backends import GoogleTTSBackend, LocalTTSBackend
+from tts_cache import GCSCacheLayer, SynthesisCache, synthesis_cache_key
+from utils import download_file_from_gcs, download_range_from_gcs, gcs_blob_exists, upload_bytes_to_gcs, upload_to_gcs
 
 # ---- Initialize RabbitMQ client to pick split jobs ----
 connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST, credentials=pika.PlainCredentials(username=RABBITMQ_USER, password=RABBITMQ_PASSWORD), heartbeat=3600))
 channel = connection.channel()
 
-# ---- Instantiate a client for the Text-to-Speech API ----
-client = texttospeech.TextToSpeechClient()
+def create_backend(name):
+  """
+  Creates the Text-to-Speech engine the service narrates with.
+
+  :param name: 'google' for Google Cloud Text-to-Speech, 'local' for the offline engine. Both produce
+               TTS_AUDIO_ENCODING, the encoding chunks are stored and stitched in.
+  """
+  if name == 'google':
+    return GoogleTTSBackend(TTS_LANGUAGE_CODE, TTS_VOICE_GENDER, TTS_AUDIO_ENCODING)
+  if name == 'local':
+    return LocalTTSBackend(TTS_LOCAL_LATENCY_MS / 1000, TTS_LOCAL_CHARACTERS_PER_SECOND, TTS_AUDIO_ENCODING.lower())
+  raise ValueError(f"Unknown TTS backend: {name}")
+
+# ---- Text-to-Speech engine ----
+backend = create_backend(TTS_BACKEND)
+
+# ---- Cache of synthesized audio, so identical chunks are only synthesized once ----
+synthesis_cache = SynthesisCache(
+  TTS_CACHE_MEMORY_BYTES,
+  GCSCacheLayer(GCS_BUCKET_NAME) if TTS_CACHE_PERSISTENT else None
+)
+
+def chunk_cache_key(text_input:str):
+  """
+  :return: Key of the chunk's audio in the synthesis cache, for the current engine and voice
+  """
+  return synthesis_cache_key(text_input, *backend.cache_key_parts())
+
+def log_cache_stats():
+  stats = synthesis_cache.stats()
+  print(f"TTS cache: {stats['hit_rate']:.1%} hit rate over {stats['lookups']} lookups "
+        f"({stats['memory_hits']} memory, {stats['persistent_hits']} persistent, {stats['misses']} misses)")
+
+# ---- Initialize Redis client, shared by the rate limiter and the fair-share scheduler ----
+redis_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+
+# ---- Pacing of the Text-to-Speech API calls, shared by every TTS pod ----
+rate_limiter = RateLimiter(
+  redis_client,
+  key="tts:rate_limiter",
+  initial_rate=TTS_RATE_LIMIT_INITIAL_RATE,
+  min_rate=TTS_RATE_LIMIT_MIN_RATE,
+  max_rate=TTS_RATE_LIMIT_MAX_RATE,
+  burst=TTS_RATE_LIMIT_BURST
+) if TTS_RATE_LIMIT else None
+
+# Errors the API answers with when we exceed its quota.
+THROTTLING_ERRORS = (ResourceExhausted, TooManyRequests)
+
+def hedge_admitted():
+  """
+  A hedge is only sent if the rate limiter has a token for it at once: when the bucket is empty the API is at its
+  quota, and a duplicate call would only add to the load. A refused hedge takes no token, so it never delays the
+  other calls.
+  """
+  return rate_limiter is None or rate_limiter.try_acquire()
+
+# ---- Hedging of straggling Text-to-Speech API calls ----
+hedger = Hedger(
+  percentile=TTS_HEDGE_PERCENTILE,
+  budget_percent=TTS_HEDGE_BUDGET_PERCENT,
+  min_samples=TTS_HEDGE_MIN_SAMPLES,
+  admit_hedge=hedge_admitted
+) if TTS_HEDGING else None
+
+# ---- Per-book sub-queues the TTS dispatcher feeds this queue from, with fair-share scheduling ----
+fair_scheduler = FairScheduler(redis_client) if TTS_FAIR_SHARE else None
+
+def log_hedge_stats():
+  if hedger is not None:
+    stats = hedger.stats()
+    print(f"TTS hedging: {stats['hedges']} hedges over {stats['calls']} calls ({stats['hedge_rate']:.1%}), "
+          f"{stats['hedge_wins']} won by the hedge")
+
+def call_backend(text_input:str):
+  """
+  Makes one call to the backend and reports its outcome to the rate limiter.
+
+  :return: Audio of the text
+  """
+  if rate_limiter is None:
+    return backend.synthesize(text_input)
+
+  try:
+    audio_content = backend.synthesize(text_input)
+  except THROTTLING_ERRORS:
+    rate_limiter.record_throttle()
+    raise
+  rate_limiter.record_success()
+  return audio_content
+
+def synthesize_speech(text_input:str):
+  """
+  Converts text to speech with the backend, paced by the rate limiter, and hedged if the call straggles.
+
+  :return: Audio of the text
+  """
+  if rate_limiter is not None:
+    rate_limiter.acquire()
+
+  if hedger is None:
+    return call_backend(text_input)
+  audio_content = hedger.call(call_backend, text_input)
+  log_hedge_stats()
+  return audio_content
+
+def synthesize_chunk(text_input:str):
+  """
+  Converts text to speech. Identical text with an identical voice and audio configuration is served from the cache
+  without an API call.
+
+  :return: Audio of the text
+  """
+  cache_key = chunk_cache_key(text_input)
+  audio_content = synthesis_cache.get(cache_key)
+
+  if audio_content is None:
+    # Call the Text-to-Speech engine
+    audio_content = synthesize_speech(text_input)
+    synthesis_cache.put(cache_key, audio_content)
+
+  log_cache_stats()
+  return audio_content
 
 # Function to convert text to speech and save as MP3
 def text_to_speech(input_file_path:str, output_file_path:str):
@@ -23,32 +160,11 @@ def text_to_speech(input_file_path:str, output_file_path:str):
   with open(input_file_path, "r") as file:
     text_input = file.read()
 
-  # Set up the text input to the API
-  synthesis_input = texttospeech.SynthesisInput(text=text_input)
-
-  # Configure the voice settings
-  voice = texttospeech.VoiceSelectionParams(
-    language_code="en-US",  # You can change this to any language you prefer
-    ssml_gender=texttospeech.SsmlVoiceGender.FEMALE,  # You can choose between MALE, FEMALE, or NEUTRAL
-  )
-
-  # Configure the audio output settings
-  audio_config = texttospeech.AudioConfig(
-    audio_encoding=texttospeech.AudioEncoding.MP3
-  )
-
-  # Call the Google Text-to-Speech API
-  response = client.synthesize_speech(
-    request={
-      "input": synthesis_input,
-      "voice": voice,
-      "audio_config": audio_config,
-    }
-  )
+  audio_content = synthesize_chunk(text_input)
 
   # Save the audio content to a file
   with open(output_file_path, "wb") as out:
-    out.write(response.audio_content)
+    out.write(audio_content)
 
   print(f"Audio content written to file {output_file_path}")
 
@@ -66,37 +182,139 @@ def notify_event_tracker(operation, message):
   )
   print(f"Notified event tracker: {operation} with message: {message}")
 
-def process_job(book_uuid:str, chapter_uuid:str, chunk_index:int):
-  """Downloads a chunk, converts it into audio and pushes the audio to GCS."""
+def chunk_blob_names(book_uuid:str, chapter_uuid:str, chunk_index:int):
+  """
+  :return: (path of the chunk's text, path of the chunk's audio) in GCS
+  """
+  return (f"{book_uuid}/chunks/{chapter_uuid}/chunk_{chunk_index}.txt",
+          f"{book_uuid}/chunks/{chapter_uuid}/audio/chunk_{chunk_index}.mp3")
+
+def chunk_audio_exists(book_uuid:str, chapter_uuid:str, chunk_index:int):
+  """
+  Checks whether the chunk's audio is already in GCS. An upload only creates the blob once it is complete, so an
+  existing blob is a finished chunk. A failed lookup counts as missing audio: the chunk is synthesized again.
+  """
+  _, audio_blob_name = chunk_blob_names(book_uuid, chapter_uuid, chunk_index)
+  try:
+    return gcs_blob_exists(GCS_BUCKET_NAME, audio_blob_name)
+  except Exception as e:
+    print(f"Could not check for the audio of chunk {chunk_index} of chapter {chapter_uuid}: {e}")
+    return False
+
+def should_skip_if_done(redelivered:bool):
+  """
+  :param redelivered: Whether the broker delivered the message before
+  :return: Whether the job should first check for the chunk's audio, per TTS_SKIP_EXISTING_AUDIO
+  """
+  if TTS_SKIP_EXISTING_AUDIO == 'always':
+    return True
+  return TTS_SKIP_EXISTING_AUDIO == 'redelivered' and bool(redelivered)
+
+def read_chunk_text(book_uuid:str, chapter_uuid:str, chunk_index:int, chunk_range:list=None):
+  """
+  Reads the text of a chunk straight into memory, unless it is larger than TTS_IN_MEMORY_MAX_BYTES.
+
+  :param chunk_range: [offset, length] of the chunk in the chapter's chunk archive, or None for a chunk blob
+  :return: Text of the chunk, or None for a chunk too large to be held in memory
+  """
+  if chunk_range is not None:
+    offset, length = chunk_range
+    if length > TTS_IN_MEMORY_MAX_BYTES:
+      return None
+    return download_range_from_gcs(
+      GCS_BUCKET_NAME, chunk_pack_blob_name(book_uuid, chapter_uuid), offset, length
+    ).decode('utf-8')
+
+  # Read at most one byte past the limit, so an oversized chunk is detected within the same single request.
+  source_blob_name, _ = chunk_blob_names(book_uuid, chapter_uuid, chunk_index)
+  chunk_bytes = download_range_from_gcs(GCS_BUCKET_NAME, source_blob_name, 0, TTS_IN_MEMORY_MAX_BYTES + 1)
+  if len(chunk_bytes) > TTS_IN_MEMORY_MAX_BYTES:
+    return None
+  return chunk_bytes.decode('utf-8')
+
+def synthesize_chunk_via_files(book_uuid:str, chapter_uuid:str, chunk_index:int, chunk_range:list=None):
+  """
+  Fallback for chunks larger than TTS_IN_MEMORY_MAX_BYTES: the text and the audio go through temporary files.
+  """
+  source_blob_name, destination_blob_name = chunk_blob_names(book_uuid, chapter_uuid, chunk_index)
+  if chunk_range is not None:
+    offset, length = chunk_range
+    source_blob_name = chunk_pack_blob_name(book_uuid, chapter_uuid)
+    byte_range = {"start": offset, "end": offset + length - 1}
+  else:
+    byte_range = {}
+
+  # Use NamedTemporaryFile for automatic cleanup after processing
+  with NamedTemporaryFile(delete=True) as temp_input, NamedTemporaryFile(delete=True) as temp_output:
+    download_file_from_gcs(GCS_BUCKET_NAME, source_blob_name, temp_input.name, **byte_range)
+
+    # Convert the text to audio.
+    text_to_speech(temp_input.name, temp_output.name)
+
+    with open(temp_output.name, 'rb') as output_audio_file:
+      upload_to_gcs(output_audio_file, GCS_BUCKET_NAME, destination_blob_name)
+
+def process_job(book_uuid:str, chapter_uuid:str, chunk_index:int, chunk_text:str=None, chunk_range:list=None,
+                skip_if_done:bool=False):
+  """
+  Downloads a chunk, converts it into audio and pushes the audio to GCS, all in memory.
+  Chunks whose text travelled inside the job (chunk_text) are not downloaded; chunks stored in the chapter's chunk
+  archive (chunk_range, their [offset, length] in it) are fetched with a ranged read. Only chunks larger than
+  TTS_IN_MEMORY_MAX_BYTES go through temporary files.
+
+  :param skip_if_done: Check for the chunk's audio first, and if it is already in GCS only report the chunk as done
+  """
+  if skip_if_done and chunk_audio_exists(book_uuid, chapter_uuid, chunk_index):
+    # An earlier delivery synthesized the chunk but may have died before reporting it: report it again. If it did
+    # report it, the event tracker ignores the second report (the chunk is no longer in the chapter's set) and the
+    # fair-share release is a no-op, since both are keyed by the chunk.
+    print(f"Skipping TTS job, audio already in GCS: UUID={book_uuid}, Chapter={chapter_uuid}, Chunk={chunk_index}")
+    notify_event_tracker(REMOVE_CHUNK, remove_chunk(book_uuid, chapter_uuid, chunk_index))
+    if fair_scheduler is not None:
+      fair_scheduler.release(book_uuid, chapter_uuid, chunk_index)
+    return
+
   # Notify the event tracker service that the chunk is in progress.
   notify_event_tracker(UPDATE_CHUNK_STATUS, update_chunk_status(book_uuid, chapter_uuid, chunk_index, 'in_progress'))
 
   print(f"Processing TTS job: UUID={book_uuid}, Chapter={chapter_uuid}, Chunk={chunk_index}")
 
-  # Define the address parameters for the chunk.
-  source_blob_name = f"{book_uuid}/chunks/{chapter_uuid}/chunk_{chunk_index}.txt"  # e.g., chapter_001.txt
+  if chunk_text is None:
+    chunk_text = read_chunk_text(book_uuid, chapter_uuid, chunk_index, chunk_range)
 
-  # Use NamedTemporaryFile for automatic cleanup after processing
-  with NamedTemporaryFile(delete=True) as temp_input:
-    temp_input_path = temp_input.name
-    download_file_from_gcs(GCS_BUCKET_NAME, source_blob_name, temp_input_path)
+  if chunk_text is None:
+    synthesize_chunk_via_files(book_uuid, chapter_uuid, chunk_index, chunk_range)
+  else:
+    # Convert the text to audio, and hand the API's buffer to the uploader as is.
+    audio_content = synthesize_chunk(chunk_text)
+    _, destination_blob_name = chunk_blob_names(book_uuid, chapter_uuid, chunk_index)
+    upload_bytes_to_gcs(audio_content, GCS_BUCKET_NAME, destination_blob_name, content_type="audio/mpeg")
 
-    with NamedTemporaryFile(delete=True) as temp_output:
-      temp_output_path = temp_output.name
+  # Notify the event tracker to remove a chunk from the list of chunks for its associated chapter.
+  notify_event_tracker(REMOVE_CHUNK, remove_chunk(book_uuid, chapter_uuid, chunk_index))
 
-      # Convert the text to audio.
-      text_to_speech(temp_input_path, temp_output_path)
+  # Free the book's place under its in-flight cap, so the dispatcher sends its next chunk.
+  if fair_scheduler is not None:
+    fair_scheduler.release(book_uuid, chapter_uuid, chunk_index)
 
-      # Upload the audio to GCS
-      destination_blob_name = f"{book_uuid}/chunks/{chapter_uuid}/audio/chunk_{chunk_index}.mp3"
+  print(f"Finished processing TTS job: UUID={book_uuid}, Chapter={chapter_uuid}, Chunk={chunk_index}")
 
-      with open(temp_output_path, 'rb') as output_audio_file:
-        upload_to_gcs(output_audio_file, GCS_BUCKET_NAME, destination_blob_name)
+def parse_job(body):
+  """
+  Parses a TTS job message.
 
-      # Notify the event tracker to remove a chunk from the list of chunks for its associated chapter.
-      notify_event_tracker(REMOVE_CHUNK, remove_chunk(book_uuid, chapter_uuid, chunk_index))
+  :param body: Body of the RabbitMQ message
+  :return: Arguments of process_job (and process_job_async) for the job
+  """
+  job = json.loads(body)  # Parse the job as JSON
+  book_uuid = job.get("book_uuid")
+  chapter_uuid = job.get("chapter_uuid")
+  chunk_index = job.get("chunk_index")
 
-      print(f"Finished processing TTS job: UUID={book_uuid}, Chapter={chapter_uuid}, Chunk={chunk_index}")
+  if not book_uuid or not chapter_uuid or not chunk_index:
+    raise ValueError("Invalid job message: missing 'book_uuid' or 'chapter_uuid' or 'chunk_index.")
+
+  return book_uuid, chapter_uuid, chunk_index, decode_payload(job), job.get("chunk_range")
 
 def callback(ch, method, properties, body):
   """
@@ -104,16 +322,8 @@ def callback(ch, method, properties, body):
   Parses the job and processes it.
   """
   try:
-    job = json.loads(body)  # Parse the job as JSON
-    book_uuid = job.get("book_uuid")
-    chapter_uuid = job.get("chapter_uuid")
-    chunk_index = job.get("chunk_index")
-
-    if not book_uuid or not chapter_uuid or not chunk_index:
-      raise ValueError("Invalid job message: missing 'book_uuid' or 'chapter_uuid' or 'chunk_index.")
-
     # Process the job
-    process_job(book_uuid, chapter_uuid, chunk_index)
+    process_job(*parse_job(body), skip_if_done=should_skip_if_done(method.redelivered))
 
     # Acknowledge the message after successful processing
     ch.basic_ack(delivery_tag=method.delivery_tag)
@@ -123,16 +333,158 @@ def callback(ch, method, properties, body):
     ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
 
 
-def start_service():
-  # Set prefetch count to 1
-  channel.basic_qos(prefetch_count=1)
+# ---------------------------------------------------------------------------------------------------------------------
+# ---- Async worker mode ----
+# The pika connection stays on the main thread, while the chunks run as coroutines on an event loop in a second
+# thread: up to TTS_CONCURRENCY of them at once, all waiting on the network together. Everything that touches the
+# channel (publishes, acks, nacks) is handed back to the connection thread, in order. A chunk is only acknowledged
+# once its audio is uploaded, so the broker redelivers every unfinished chunk of a pod that dies.
+
+def on_connection_thread(function, *args, **kwargs):
+  """
+  Queues a channel operation on the connection's thread without waiting for it. Operations run in the order they
+  were queued, so a chunk's last notification always goes out before its ack.
+  """
+  connection.add_callback_threadsafe(functools.partial(function, *args, **kwargs))
+
+async def call_backend_async(text_input:str):
+  """
+  Same as call_backend, on the event loop.
+  """
+  if rate_limiter is None:
+    return await backend.synthesize_async(text_input)
+
+  try:
+    audio_content = await backend.synthesize_async(text_input)
+  except THROTTLING_ERRORS:
+    await asyncio.to_thread(rate_limiter.record_throttle)
+    raise
+  await asyncio.to_thread(rate_limiter.record_success)
+  return audio_content
+
+async def synthesize_speech_async(text_input:str):
+  """
+  Same as synthesize_speech, on the event loop.
+  """
+  if rate_limiter is not None:
+    await rate_limiter.acquire_async()
+
+  if hedger is None:
+    return await call_backend_async(text_input)
+  audio_content = await hedger.call_async(call_backend_async, text_input)
+  log_hedge_stats()
+  return audio_content
+
+async def synthesize_async(text_input:str):
+  """
+  Converts text to speech on the event loop, through the synthesis cache.
+
+  :param text_input: Text of the chunk
+  :return: MP3 audio of the chunk
+  """
+  cache_key = chunk_cache_key(text_input)
+  audio_content = await asyncio.to_thread(synthesis_cache.get, cache_key)
+
+  if audio_content is None:
+    audio_content = await synthesize_speech_async(text_input)
+    await asyncio.to_thread(synthesis_cache.put, cache_key, audio_content)
+
+  log_cache_stats()
+  return audio_content
+
+async def process_job_async(book_uuid:str, chapter_uuid:str, chunk_index:int, chunk_text:str=None,
+                            chunk_range:list=None, skip_if_done:bool=False):
+  """
+  Same job as process_job, run on the worker loop. The blocking GCS calls run on the loop's thread pool.
+  """
+  if skip_if_done and await asyncio.to_thread(chunk_audio_exists, book_uuid, chapter_uuid, chunk_index):
+    print(f"Skipping TTS job, audio already in GCS: UUID={book_uuid}, Chapter={chapter_uuid}, Chunk={chunk_index}")
+    on_connection_thread(notify_event_tracker, REMOVE_CHUNK, remove_chunk(book_uuid, chapter_uuid, chunk_index))
+    if fair_scheduler is not None:
+      await asyncio.to_thread(fair_scheduler.release, book_uuid, chapter_uuid, chunk_index)
+    return
+
+  on_connection_thread(notify_event_tracker, UPDATE_CHUNK_STATUS,
+                       update_chunk_status(book_uuid, chapter_uuid, chunk_index, 'in_progress'))
+
+  print(f"Processing TTS job: UUID={book_uuid}, Chapter={chapter_uuid}, Chunk={chunk_index}")
+
+  if chunk_text is None:
+    chunk_text = await asyncio.to_thread(read_chunk_text, book_uuid, chapter_uuid, chunk_index, chunk_range)
+
+  if chunk_text is None:
+    await asyncio.to_thread(synthesize_chunk_via_files, book_uuid, chapter_uuid, chunk_index, chunk_range)
+  else:
+    audio_content = await synthesize_async(chunk_text)
+    _, destination_blob_name = chunk_blob_names(book_uuid, chapter_uuid, chunk_index)
+    await asyncio.to_thread(
+      upload_bytes_to_gcs, audio_content, GCS_BUCKET_NAME, destination_blob_name, content_type="audio/mpeg"
+    )
+
+  on_connection_thread(notify_event_tracker, REMOVE_CHUNK, remove_chunk(book_uuid, chapter_uuid, chunk_index))
+  if fair_scheduler is not None:
+    await asyncio.to_thread(fair_scheduler.release, book_uuid, chapter_uuid, chunk_index)
+
+  print(f"Finished processing TTS job: UUID={book_uuid}, Chapter={chapter_uuid}, Chunk={chunk_index}")
+
+def settle_job(ch, delivery_tag, future):
+  """
+  Runs when a chunk's coroutine finishes: acknowledges it, or requeues it if it failed.
+  """
+  error = future.exception()
+  if error is None:
+    on_connection_thread(ch.basic_ack, delivery_tag=delivery_tag)
+  else:
+    print(f"Error processing job: {error}")
+    on_connection_thread(ch.basic_nack, delivery_tag=delivery_tag, requeue=True)
+
+def dispatch_job_async(loop, ch, method, properties, body):
+  """
+  Consumer callback of the async mode: starts the chunk on the worker loop and returns at once.
+  """
+  try:
+    job_args = parse_job(body)
+  except Exception as e:
+    print(f"Error processing job: {e}")
+    ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+    return
+
+  future = asyncio.run_coroutine_threadsafe(
+    process_job_async(*job_args, skip_if_done=should_skip_if_done(method.redelivered)), loop
+  )
+  future.add_done_callback(functools.partial(settle_job, ch, method.delivery_tag))
 
+def start_worker_loop():
+  """
+  Starts the event loop running the chunks of the async mode in a background thread.
+
+  :return: The running loop
+  """
+  loop = asyncio.new_event_loop()
+  # One thread per in-flight chunk for its blocking GCS calls
+  loop.set_default_executor(ThreadPoolExecutor(max_workers=TTS_CONCURRENCY))
+  threading.Thread(target=loop.run_forever, name="tts-worker-loop", daemon=True).start()
+  return loop
+
+# ---------------------------------------------------------------------------------------------------------------------
+
+def start_service():
   # ---- Queue to hold TTS jobs ----
-  channel.queue_declare(queue=TTS_QUEUE_NAME)
+  # With priority scheduling the broker delivers the highest-priority job first, FIFO within a priority. Only jobs
+  # still in the queue are reordered, so the prefetch counts below also bound how long an urgent job can wait.
+  channel.queue_declare(queue=TTS_QUEUE_NAME, arguments=tts_queue_arguments(TTS_PRIORITY_SCHEDULING))
   channel.queue_declare(queue=EVENT_TRACKER_QUEUE_NAME)
 
   # Set up RabbitMQ consumer
-  channel.basic_consume(queue=TTS_QUEUE_NAME, on_message_callback=callback)
+  if TTS_WORKER_MODE == 'async':
+    # Let the broker deliver as many chunks as the pod keeps in flight
+    channel.basic_qos(prefetch_count=TTS_CONCURRENCY)
+    loop = start_worker_loop()
+    channel.basic_consume(queue=TTS_QUEUE_NAME, on_message_callback=functools.partial(dispatch_job_async, loop))
+  else:
+    # Set prefetch count to 1
+    channel.basic_qos(prefetch_count=1)
+    channel.basic_consume(queue=TTS_QUEUE_NAME, on_message_callback=callback)
   print("Waiting for TTS jobs.")
 
   # ---- Keep the program running ----
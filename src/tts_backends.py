@@ -0,0 +1,143 @@
+# ---- Text-to-Speech engines the TTS service can narrate with. ----
+# Every backend turns chunk text into audio bytes, blocking (synthesize) or on an event loop (synthesize_async), and
+# describes its voice and audio configuration (cache_key_parts) so the synthesis cache never mixes up their audio.
+import asyncio
+import hashlib
+import io
+import math
+import struct
+import time
+import wave
+
+from google.cloud import texttospeech
+
+
+class GoogleTTSBackend:
+  """
+  Google Cloud Text-to-Speech. The API clients are created at first use, so importing the TTS service needs neither
+  network nor credentials.
+  """
+  name = 'google'
+
+  def __init__(self, language_code, voice_gender, audio_encoding='MP3'):
+    """
+    :param language_code: Language of the voice, e.g. 'en-US'
+    :param voice_gender: 'MALE', 'FEMALE' or 'NEUTRAL'
+    :param audio_encoding: Name of a texttospeech.AudioEncoding, e.g. 'MP3'
+    """
+    self.language_code = language_code
+    self.voice_gender = voice_gender
+    self.audio_encoding = audio_encoding
+    self.client = None
+    self.async_client = None
+
+  def voice(self):
+    return texttospeech.VoiceSelectionParams(
+      language_code=self.language_code,
+      ssml_gender=texttospeech.SsmlVoiceGender[self.voice_gender],
+    )
+
+  def audio_config(self):
+    return texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding[self.audio_encoding])
+
+  def build_request(self, text):
+    return {
+      "input": texttospeech.SynthesisInput(text=text),
+      "voice": self.voice(),
+      "audio_config": self.audio_config(),
+    }
+
+  def cache_key_parts(self):
+    return (
+      self.name,
+      texttospeech.VoiceSelectionParams.to_json(self.voice()),
+      texttospeech.AudioConfig.to_json(self.audio_config()),
+    )
+
+  def synthesize(self, text):
+    if self.client is None:
+      self.client = texttospeech.TextToSpeechClient()
+    return self.client.synthesize_speech(request=self.build_request(text)).audio_content
+
+  async def synthesize_async(self, text):
+    # The async client binds to the event loop it is created on, so it is created on the worker loop.
+    if self.async_client is None:
+      self.async_client = texttospeech.TextToSpeechAsyncClient()
+    response = await self.async_client.synthesize_speech(request=self.build_request(text))
+    return response.audio_content
+
+
+# ---- Local offline engine ----
+
+# Speaking rate of the synthetic narration, which sets the duration of the audio.
+CHARACTERS_PER_SECOND_OF_SPEECH = 15
+
+# One MPEG-1 Layer III frame: 128 kbit/s, 44.1 kHz, mono, no CRC. A frame whose side information is all zeros
+# decodes to 1152 samples of silence, so valid MP3 needs no encoder.
+MP3_FRAME_HEADER = b'\xff\xfb\x90\xc0'
+MP3_FRAME_BYTES = 144 * 128000 // 44100
+MP3_FRAME_SECONDS = 1152 / 44100
+MP3_SILENT_FRAME = MP3_FRAME_HEADER + b'\x00' * (MP3_FRAME_BYTES - len(MP3_FRAME_HEADER))
+
+WAV_SAMPLE_RATE = 16000
+
+
+class LocalTTSBackend:
+  """
+  Offline engine for load tests, benchmarks and CI: deterministic audio whose duration follows the text length,
+  produced after a synthetic delay of latency plus text length over throughput.
+  """
+  name = 'local'
+  audio_formats = ('mp3', 'wav')
+
+  def __init__(self, latency_seconds=0.2, characters_per_second=20000, audio_format='mp3'):
+    """
+    :param latency_seconds: Fixed delay of every synthesis
+    :param characters_per_second: Synthesis throughput; 0 adds no delay per character
+    :param audio_format: 'mp3' (silent MP3 frames) or 'wav' (16-bit mono PCM tone derived from the text). The TTS
+                         service stores and stitches chunks as MP3, so 'wav' is only for in-process use such as
+                         benchmarks.
+    """
+    if audio_format not in self.audio_formats:
+      raise ValueError(f"Unknown local TTS audio format: {audio_format}")
+    self.latency_seconds = latency_seconds
+    self.characters_per_second = characters_per_second
+    self.audio_format = audio_format
+
+  def cache_key_parts(self):
+    return (self.name, self.audio_format)
+
+  def delay(self, text):
+    per_character = len(text) / self.characters_per_second if self.characters_per_second else 0.0
+    return self.latency_seconds + per_character
+
+  def render(self, text):
+    """
+    :return: Audio of the text, the same bytes for the same text
+    """
+    seconds = len(text) / CHARACTERS_PER_SECOND_OF_SPEECH
+    if self.audio_format == 'mp3':
+      return MP3_SILENT_FRAME * max(1, math.ceil(seconds / MP3_FRAME_SECONDS))
+
+    # A quiet tone whose pitch comes from the text, so different chunks sound (and hash) different.
+    frequency = 200 + int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:2], 'big') % 400
+    sample_count = max(1, int(seconds * WAV_SAMPLE_RATE))
+    samples = struct.pack(
+      f'<{sample_count}h',
+      *(int(3000 * math.sin(2 * math.pi * frequency * n / WAV_SAMPLE_RATE)) for n in range(sample_count))
+    )
+    with io.BytesIO() as buffer:
+      with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(WAV_SAMPLE_RATE)
+        wav_file.writeframes(samples)
+      return buffer.getvalue()
+
+  def synthesize(self, text):
+    time.sleep(self.delay(text))
+    return self.render(text)
+
+  async def synthesize_async(self, text):
+    await asyncio.sleep(self.delay(text))
+    return self.render(text)
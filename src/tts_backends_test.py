@@ -0,0 +1,76 @@
+import asyncio
+import io
+import time
+import unittest
+import wave
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from tts_backends import (
+    GoogleTTSBackend,
+    LocalTTSBackend,
+    MP3_FRAME_BYTES,
+    MP3_FRAME_HEADER
+)
+
+
+class TestGoogleTTSBackend(unittest.TestCase):
+
+    @patch('tts_backends.texttospeech.TextToSpeechClient')
+    def test_client_is_created_at_first_use(self, mock_client_class):
+        backend = GoogleTTSBackend('en-US', 'FEMALE')
+        mock_client_class.assert_not_called()
+
+        mock_client_class.return_value.synthesize_speech.return_value = MagicMock(audio_content=b'audio')
+        self.assertEqual(backend.synthesize('Some text.'), b'audio')
+        self.assertEqual(backend.synthesize('More text.'), b'audio')
+
+        mock_client_class.assert_called_once()
+        request = mock_client_class.return_value.synthesize_speech.call_args.kwargs['request']
+        self.assertEqual(request['input'].text, 'More text.')
+        self.assertEqual(request['voice'].language_code, 'en-US')
+
+    @patch('tts_backends.texttospeech.TextToSpeechAsyncClient')
+    def test_synthesize_async(self, mock_client_class):
+        mock_client_class.return_value.synthesize_speech = AsyncMock(return_value=MagicMock(audio_content=b'audio'))
+        self.assertEqual(asyncio.run(GoogleTTSBackend('en-US', 'MALE').synthesize_async('Some text.')), b'audio')
+
+    def test_cache_key_parts_follow_the_voice(self):
+        female = GoogleTTSBackend('en-US', 'FEMALE').cache_key_parts()
+        self.assertEqual(female, GoogleTTSBackend('en-US', 'FEMALE').cache_key_parts())
+        self.assertNotEqual(female, GoogleTTSBackend('en-US', 'MALE').cache_key_parts())
+        self.assertNotEqual(female, GoogleTTSBackend('en-GB', 'FEMALE').cache_key_parts())
+
+
+class TestLocalTTSBackend(unittest.TestCase):
+
+    def test_mp3_audio_is_deterministic_frames(self):
+        backend = LocalTTSBackend(latency_seconds=0, characters_per_second=0)
+        audio = backend.synthesize('word ' * 300)
+        self.assertEqual(audio, backend.synthesize('word ' * 300))
+        self.assertEqual(len(audio) % MP3_FRAME_BYTES, 0)
+        self.assertTrue(all(audio[offset:offset + 4] == MP3_FRAME_HEADER
+                            for offset in range(0, len(audio), MP3_FRAME_BYTES)))
+        # 1500 characters read at 15 per second: 100 seconds of audio.
+        self.assertEqual(len(audio) // MP3_FRAME_BYTES, 3829)
+
+    def test_wav_audio(self):
+        backend = LocalTTSBackend(latency_seconds=0, characters_per_second=0, audio_format='wav')
+        audio = backend.synthesize('Thirty characters of text....')
+        with wave.open(io.BytesIO(audio)) as wav_file:
+            self.assertEqual((wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate()), (1, 2, 16000))
+        self.assertEqual(audio, backend.synthesize('Thirty characters of text....'))
+        self.assertNotEqual(audio, backend.synthesize('Thirty characters of text!!!!'))
+
+    def test_synthetic_delay(self):
+        backend = LocalTTSBackend(latency_seconds=0.05, characters_per_second=1000)
+        self.assertAlmostEqual(backend.delay('x' * 100), 0.15)
+        start = time.perf_counter()
+        asyncio.run(backend.synthesize_async('x' * 100))
+        self.assertGreaterEqual(time.perf_counter() - start, 0.15)
+
+    def test_unknown_audio_format(self):
+        with self.assertRaises(ValueError):
+            LocalTTSBackend(audio_format='flac')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+"""
+Measures the chunks/sec of one TTS pod in the blocking worker mode and in the async worker mode, by driving the TTS
+service's own code: tts.callback one job at a time for the blocking mode, and tts.start_worker_loop,
+tts.dispatch_job_async and tts.settle_job for the async mode, with its TTS_CONCURRENCY threads for the GCS calls and
+every publish and ack handed back through the connection's add_callback_threadsafe.
+
+Only what lies outside the pod is replaced:
+- GCS by a local fake server that answers the chunk download and the audio upload after --gcs-ms,
+- the Text-to-Speech API by the offline engine of tts_backends, which answers after --synthesis-ms without holding a
+  thread, like the async API client,
+- the RabbitMQ connection by a stub whose threadsafe callbacks run on the main thread, which plays pika's connection
+  thread. It delivers jobs like the broker after basic_qos: at most the prefetch count unacknowledged at once.
+
+Usage: python tts_benchmark.py [--chunks 200] [--concurrency 1 4 16 64] [--synthesis-ms 300] [--gcs-ms 40]
+"""
+import argparse
+import asyncio
+import contextlib
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from types import SimpleNamespace
+
+import pika
+from google.cloud import storage
+
+from messages import tts_job
+from tts_backends import LocalTTSBackend
+
+CHUNK_TEXT = b"word " * 1000
+
+
+class StubChannel:
+  """Counts what the worker publishes to the event tracker and how its jobs are settled."""
+
+  def __init__(self):
+    self.published = 0
+    self.acked = 0
+    self.nacked = 0
+
+  def basic_publish(self, exchange, routing_key, body, properties=None):
+    self.published += 1
+
+  def basic_ack(self, delivery_tag):
+    self.acked += 1
+
+  def basic_nack(self, delivery_tag, requeue=True):
+    self.nacked += 1
+
+
+class StubConnection:
+  """Stands in for pika.BlockingConnection: threadsafe callbacks wait in a queue for the connection thread."""
+
+  def __init__(self, *args, **kwargs):
+    self.callbacks = queue.Queue()
+    self.stub_channel = StubChannel()
+
+  def channel(self):
+    return self.stub_channel
+
+  def add_callback_threadsafe(self, callback):
+    self.callbacks.put(callback)
+
+
+def import_tts_service():
+  """
+  Imports the TTS service on the stub connection, with the offline engine and without the Redis-backed features.
+  The GCS calls go to the fake server, so the storage client created at import needs no credentials.
+  """
+  os.environ.update(TTS_BACKEND='local', TTS_RATE_LIMIT='false', TTS_HEDGING='false', TTS_FAIR_SHARE='false',
+                    TTS_CACHE_PERSISTENT='false')
+  pika.BlockingConnection = StubConnection
+  storage.Client = storage.Client.create_anonymous_client
+  import tts
+  return tts
+
+
+def start_fake_server(latencies):
+  """
+  Starts a minimal HTTP/1.1 keep-alive server on a background thread. A download answers with the chunk text
+  followed by the requested path, so that no two chunks share their audio in the synthesis cache.
+
+  :param latencies: Dict of the first path segment -> seconds to wait before answering
+  :return: Port the server listens on
+  """
+  ready = threading.Event()
+  port = []
+
+  async def handle(reader, writer):
+    try:
+      while True:
+        request_line = await reader.readline()
+        if not request_line:
+          break
+        path = request_line.split()[1]
+        content_length = 0
+        while True:
+          header = await reader.readline()
+          if header in (b"\r\n", b""):
+            break
+          name, _, value = header.decode().partition(":")
+          if name.lower() == "content-length":
+            content_length = int(value)
+        if content_length:
+          await reader.readexactly(content_length)
+
+        operation = path.decode().split("/")[1]
+        await asyncio.sleep(latencies[operation])
+        body = CHUNK_TEXT + path if operation == "download" else b""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      writer.close()
+
+  async def serve():
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port.append(server.sockets[0].getsockname()[1])
+    ready.set()
+    async with server:
+      await server.serve_forever()
+
+  threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+  ready.wait()
+  return port[0]
+
+
+def install_fake_gcs(tts, port):
+  """
+  Points the GCS calls of the TTS service at the fake server, with one keep-alive connection per thread like the
+  storage client's pooled sessions.
+  """
+  local = threading.local()
+
+  def request(method, path, body=None):
+    if not hasattr(local, "connection"):
+      local.connection = http.client.HTTPConnection("127.0.0.1", port)
+    local.connection.request(method, path, body=body)
+    return local.connection.getresponse().read()
+
+  def download_range_from_gcs(bucket_name, source_blob_name, start, length):
+    return request("GET", f"/download/{source_blob_name}")[:length]
+
+  def upload_bytes_to_gcs(data, bucket_name, destination_blob_name, content_type="application/octet-stream"):
+    request("PUT", f"/upload/{destination_blob_name}", data)
+
+  tts.download_range_from_gcs = download_range_from_gcs
+  tts.upload_bytes_to_gcs = upload_bytes_to_gcs
+
+
+def make_jobs(chunks):
+  """
+  :return: Bodies of the TTS jobs of a fresh book, one chapter of the given number of chunks
+  """
+  book_uuid, chapter_uuid = uuid.uuid4().hex, uuid.uuid4().hex
+  return [json.dumps(tts_job(book_uuid, chapter_uuid, index)) for index in range(1, chunks + 1)]
+
+
+def delivery(delivery_tag):
+  return SimpleNamespace(delivery_tag=delivery_tag, redelivered=False)
+
+
+def run_blocking_worker(tts, jobs):
+  """Today's worker: tts.callback on one job at a time, the broker delivering the next one after the ack."""
+  for delivery_tag, body in enumerate(jobs, start=1):
+    tts.callback(tts.channel, delivery(delivery_tag), None, body)
+
+
+def run_async_worker(tts, jobs, concurrency):
+  """
+  The async worker with TTS_CONCURRENCY set to concurrency: the prefetch count and the size of the worker loop's
+  thread pool.
+  """
+  tts.TTS_CONCURRENCY = concurrency
+  loop = tts.start_worker_loop()
+  channel = tts.channel
+  pending = deque(enumerate(jobs, start=1))
+  in_flight = 0
+  settled = 0
+
+  while settled < len(jobs):
+    # Deliver up to the prefetch count, like the broker after basic_qos(prefetch_count=TTS_CONCURRENCY).
+    while pending and in_flight < concurrency:
+      delivery_tag, body = pending.popleft()
+      tts.dispatch_job_async(loop, channel, delivery(delivery_tag), None, body)
+      in_flight += 1
+
+    # Run what the worker handed to the connection thread, in order: notifications, then the job's ack or nack.
+    settled_before = channel.acked + channel.nacked
+    tts.connection.callbacks.get()()
+    if channel.acked + channel.nacked > settled_before:
+      in_flight -= 1
+      settled += 1
+
+  loop.call_soon_threadsafe(loop.stop)
+
+
+def timed_run(run, tts, jobs, *args):
+  """
+  :return: Chunks per second of the run. Fails if a job was not acknowledged.
+  """
+  channel = tts.channel
+  acked_before = channel.acked
+  start = time.perf_counter()
+  # The service logs every chunk; keep the table readable.
+  with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+    run(tts, jobs, *args)
+  elapsed = time.perf_counter() - start
+  if channel.nacked or channel.acked - acked_before != len(jobs):
+    raise RuntimeError(f"{len(jobs)} jobs run but {channel.acked - acked_before} acknowledged, "
+                       f"{channel.nacked} requeued")
+  return len(jobs) / elapsed
+
+
+def run_benchmark(chunks, concurrencies, synthesis_ms, gcs_ms):
+  tts = import_tts_service()
+  tts.backend = LocalTTSBackend(latency_seconds=synthesis_ms / 1000, characters_per_second=0)
+  install_fake_gcs(tts, start_fake_server({"download": gcs_ms / 1000, "upload": gcs_ms / 1000}))
+
+  print(f"{chunks} chunks per run; synthesis {synthesis_ms} ms, GCS download and upload {gcs_ms} ms each")
+  print(f"{'mode':>10} {'in flight':>10} {'seconds':>9} {'chunks/s':>10} {'speedup':>8}")
+
+  # The blocking worker is slow by design; time a slice of the run and extrapolate.
+  blocking_rate = timed_run(run_blocking_worker, tts, make_jobs(max(1, min(chunks, 20))))
+  print(f"{'blocking':>10} {1:>10} {chunks / blocking_rate:>9.2f} {blocking_rate:>10.1f} {1:>7.1f}x")
+
+  for concurrency in concurrencies:
+    rate = timed_run(run_async_worker, tts, make_jobs(chunks), concurrency)
+    print(f"{'async':>10} {concurrency:>10} {chunks / rate:>9.2f} {rate:>10.1f} {rate / blocking_rate:>7.1f}x")
+
+  published_per_chunk = tts.channel.published / tts.channel.acked
+  print(f"{published_per_chunk:.0f} event tracker notifications and 1 ack per chunk, all on the connection thread")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--chunks', type=int, default=200)
+  parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+  parser.add_argument('--synthesis-ms', type=int, default=300)
+  parser.add_argument('--gcs-ms', type=int, default=40)
+  args = parser.parse_args()
+  run_benchmark(args.chunks, args.concurrency, args.synthesis_ms, args.gcs_ms)
@@ -0,0 +1,181 @@
+# ---- Content-addressed cache of text-to-speech results. ----
+# Synthesized audio is keyed by a hash of the normalized chunk text and the voice and audio configuration, so the same
+# text narrated the same way is only ever sent to the Text-to-Speech API once.
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from io import BytesIO
+
+from utils import download_bytes_from_gcs, upload_to_gcs
+
+# Bump to invalidate every cached entry, e.g. when the normalization changes.
+CACHE_KEY_VERSION = 'v1'
+
+# Runs of spaces and tabs; line breaks are kept, since they shape the pauses of the narration.
+HORIZONTAL_WHITESPACE_PATTERN = re.compile(r'[^\S\n]+')
+
+
+def normalize_text(text):
+  """
+  Normalizes chunk text for the cache key only: texts that differ in Unicode composition or in runs of spaces read
+  the same aloud.
+
+  :param text: Chunk text
+  :return: Normalized text
+  """
+  text = unicodedata.normalize('NFC', text)
+  return HORIZONTAL_WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def synthesis_cache_key(text, *config_parts):
+  """
+  Builds the cache key of a synthesis request.
+
+  :param text: Chunk text
+  :param config_parts: Serialized voice and audio configuration of the request
+  :return: Hex digest identifying the synthesized audio
+  """
+  digest = hashlib.sha256()
+  for part in (CACHE_KEY_VERSION, normalize_text(text)) + config_parts:
+    encoded = part.encode('utf-8')
+    # Length-prefix every part, so no two different requests hash the same bytes.
+    digest.update(len(encoded).to_bytes(8, 'big'))
+    digest.update(encoded)
+  return digest.hexdigest()
+
+
+class MemoryCacheLayer:
+  """In-process LRU cache bounded by the total size of the audio it holds."""
+
+  def __init__(self, max_bytes):
+    """
+    :param max_bytes: Maximum total size of the cached audio; entries larger than this are never cached
+    """
+    self.max_bytes = max_bytes
+    self.size = 0
+    self.entries = OrderedDict()
+
+  def get(self, key):
+    audio = self.entries.get(key)
+    if audio is not None:
+      self.entries.move_to_end(key)
+    return audio
+
+  def put(self, key, audio):
+    if len(audio) > self.max_bytes:
+      return
+    previous = self.entries.pop(key, None)
+    if previous is not None:
+      self.size -= len(previous)
+    self.entries[key] = audio
+    self.size += len(audio)
+    # Evict the least recently used entries until the cache fits again.
+    while self.size > self.max_bytes:
+      _, evicted = self.entries.popitem(last=False)
+      self.size -= len(evicted)
+
+
+class GCSCacheLayer:
+  """Persistent cache shared by every TTS worker: one GCS object per cached synthesis."""
+
+  def __init__(self, bucket_name, prefix='tts-cache'):
+    """
+    :param bucket_name: Name of the GCS bucket
+    :param prefix: Folder of the cached audio in the bucket
+    """
+    self.bucket_name = bucket_name
+    self.prefix = prefix
+
+  def blob_name(self, key):
+    return f"{self.prefix}/{key}.mp3"
+
+  def get(self, key):
+    return download_bytes_from_gcs(self.bucket_name, self.blob_name(key))
+
+  def put(self, key, audio):
+    with BytesIO(audio) as file_like:
+      upload_to_gcs(file_like, self.bucket_name, self.blob_name(key))
+
+
+class SynthesisCache:
+  """
+  Two-level synthesis cache: a bounded in-process LRU layer in front of an optional persistent layer. Hits in the
+  persistent layer are promoted to memory. Failures of the persistent layer are reported and treated as misses, so
+  the cache can never fail a TTS job.
+  """
+
+  def __init__(self, max_memory_bytes, persistent_layer=None):
+    """
+    :param max_memory_bytes: Size bound of the in-process layer; 0 disables it
+    :param persistent_layer: Shared layer with get(key) and put(key, audio), e.g. a GCSCacheLayer; None disables it
+    """
+    self.memory_layer = MemoryCacheLayer(max_memory_bytes) if max_memory_bytes > 0 else None
+    self.persistent_layer = persistent_layer
+    self.lock = threading.Lock()
+    self.memory_hits = 0
+    self.persistent_hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    """
+    Looks a synthesis up, in memory first.
+
+    :param key: Cache key from synthesis_cache_key
+    :return: The cached audio, or None on a miss
+    """
+    if self.memory_layer is not None:
+      with self.lock:
+        audio = self.memory_layer.get(key)
+        if audio is not None:
+          self.memory_hits += 1
+          return audio
+
+    audio = None
+    if self.persistent_layer is not None:
+      try:
+        audio = self.persistent_layer.get(key)
+      except Exception as e:
+        print(f"Error reading the persistent TTS cache: {e}")
+
+    with self.lock:
+      if audio is None:
+        self.misses += 1
+        return None
+      self.persistent_hits += 1
+      if self.memory_layer is not None:
+        self.memory_layer.put(key, audio)
+    return audio
+
+  def put(self, key, audio):
+    """
+    Stores a fresh synthesis in every layer.
+
+    :param key: Cache key from synthesis_cache_key
+    :param audio: Synthesized audio
+    """
+    if self.memory_layer is not None:
+      with self.lock:
+        self.memory_layer.put(key, audio)
+
+    if self.persistent_layer is not None:
+      try:
+        self.persistent_layer.put(key, audio)
+      except Exception as e:
+        print(f"Error writing the persistent TTS cache: {e}")
+
+  def stats(self):
+    """
+    :return: Dict with the lookup counters and the overall hit rate
+    """
+    with self.lock:
+      lookups = self.memory_hits + self.persistent_hits + self.misses
+      return {
+        "lookups": lookups,
+        "memory_hits": self.memory_hits,
+        "persistent_hits": self.persistent_hits,
+        "misses": self.misses,
+        "hit_rate": (self.memory_hits + self.persistent_hits) / lookups if lookups else 0.0,
+        "memory_bytes": self.memory_layer.size if self.memory_layer is not None else 0,
+      }
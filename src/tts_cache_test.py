@@ -0,0 +1,112 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+from tts_cache import (
+    normalize_text,
+    synthesis_cache_key,
+    MemoryCacheLayer,
+    GCSCacheLayer,
+    SynthesisCache
+)
+
+
+class DictLayer:
+    """Persistent layer kept in a dict."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, audio):
+        self.entries[key] = audio
+
+
+class TestTTSCache(unittest.TestCase):
+
+    def test_normalize_text(self):
+        self.assertEqual(normalize_text('  Café  au\t lait. \n\nNext line.  '), 'Café au lait. \n\nNext line.')
+
+    def test_cache_key_ignores_spacing_and_composition(self):
+        self.assertEqual(synthesis_cache_key('Hello  world.', 'voice', 'mp3'),
+                         synthesis_cache_key(' Hello world. ', 'voice', 'mp3'))
+        self.assertEqual(synthesis_cache_key('Café', 'voice', 'mp3'), synthesis_cache_key('Café', 'voice', 'mp3'))
+
+    def test_cache_key_depends_on_text_and_configuration(self):
+        keys = {
+            synthesis_cache_key('Hello world.', 'voice', 'mp3'),
+            synthesis_cache_key('Hello world!', 'voice', 'mp3'),
+            synthesis_cache_key('Hello\nworld.', 'voice', 'mp3'),
+            synthesis_cache_key('Hello world.', 'other voice', 'mp3'),
+            synthesis_cache_key('Hello world.', 'voice', 'ogg'),
+            # Parts are length-prefixed, so moving a boundary changes the key.
+            synthesis_cache_key('Hello world.', 'voicem', 'p3'),
+        }
+        self.assertEqual(len(keys), 6)
+
+    def test_memory_layer_evicts_least_recently_used(self):
+        layer = MemoryCacheLayer(10)
+        layer.put('a', b'1234')
+        layer.put('b', b'1234')
+        layer.get('a')
+        layer.put('c', b'1234')
+        self.assertIsNone(layer.get('b'))
+        self.assertEqual(layer.get('a'), b'1234')
+        self.assertEqual(layer.get('c'), b'1234')
+        self.assertEqual(layer.size, 8)
+
+    def test_memory_layer_skips_oversized_audio(self):
+        layer = MemoryCacheLayer(10)
+        layer.put('a', b'1234')
+        layer.put('big', b'x' * 11)
+        self.assertIsNone(layer.get('big'))
+        self.assertEqual(layer.get('a'), b'1234')
+
+    def test_cache_counts_hits_per_layer(self):
+        persistent = DictLayer()
+        cache = SynthesisCache(1024, persistent)
+        self.assertIsNone(cache.get('key'))
+        cache.put('key', b'audio')
+        self.assertEqual(persistent.entries, {'key': b'audio'})
+        self.assertEqual(cache.get('key'), b'audio')
+
+        # Another worker only shares the persistent layer; its hit is promoted to its memory layer.
+        other_cache = SynthesisCache(1024, persistent)
+        self.assertEqual(other_cache.get('key'), b'audio')
+        self.assertEqual(other_cache.get('key'), b'audio')
+
+        self.assertEqual(cache.stats(), {"lookups": 2, "memory_hits": 1, "persistent_hits": 0, "misses": 1,
+                                         "hit_rate": 0.5, "memory_bytes": 5})
+        self.assertEqual(other_cache.stats()["memory_hits"], 1)
+        self.assertEqual(other_cache.stats()["persistent_hits"], 1)
+
+    def test_cache_without_layers_always_misses(self):
+        cache = SynthesisCache(0)
+        cache.put('key', b'audio')
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(cache.stats()["hit_rate"], 0.0)
+
+    def test_persistent_layer_failures_are_misses(self):
+        persistent = MagicMock()
+        persistent.get.side_effect = RuntimeError("GCS is down")
+        persistent.put.side_effect = RuntimeError("GCS is down")
+        cache = SynthesisCache(0, persistent)
+        self.assertIsNone(cache.get('key'))
+        cache.put('key', b'audio')
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    @patch('tts_cache.upload_to_gcs')
+    @patch('tts_cache.download_bytes_from_gcs')
+    def test_gcs_layer(self, mock_download, mock_upload):
+        layer = GCSCacheLayer('bucket')
+        mock_download.return_value = None
+        self.assertIsNone(layer.get('abc'))
+        mock_download.assert_called_once_with('bucket', 'tts-cache/abc.mp3')
+
+        mock_upload.side_effect = lambda file_like, bucket, blob: self.assertEqual(file_like.read(), b'audio')
+        layer.put('abc', b'audio')
+        self.assertEqual(mock_upload.call_args.args[1:], ('bucket', 'tts-cache/abc.mp3'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import json
+import time
+
+import pika
+import redis
+
+from constants import RABBITMQ_HOST, RABBITMQ_PASSWORD, RABBITMQ_USER, TTS_QUEUE_NAME, REDIS_HOST, REDIS_PORT, \
+  TTS_PRIORITY_SCHEDULING, TTS_FAIR_SHARE_MAX_IN_FLIGHT_PER_BOOK, TTS_DISPATCH_QUEUE_DEPTH, TTS_DISPATCH_POLL_SECONDS
+from fair_scheduler import FairScheduler
+from messages import tts_queue_arguments
+
+# ---- Initialize RabbitMQ client to feed the TTS queue ----
+connection = pika.BlockingConnection(pika.ConnectionParameters(RABBITMQ_HOST, credentials=pika.PlainCredentials(username=RABBITMQ_USER, password=RABBITMQ_PASSWORD), heartbeat=3600))
+channel = connection.channel()
+
+# ---- Per-book sub-queues the chunker and splitter queue TTS jobs in ----
+scheduler = FairScheduler(
+  redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True),
+  TTS_FAIR_SHARE_MAX_IN_FLIGHT_PER_BOOK
+)
+
+# Seconds between two reports of the per-book backlog.
+BACKLOG_LOG_INTERVAL = 30
+
+def ready_job_count():
+  """
+  :return: Number of jobs waiting in the TTS queue
+  """
+  return channel.queue_declare(queue=TTS_QUEUE_NAME, passive=True).method.message_count
+
+def publish_job(message, priority):
+  channel.basic_publish(
+    exchange="",
+    routing_key=TTS_QUEUE_NAME,
+    body=json.dumps(message),
+    properties=pika.BasicProperties(priority=priority)
+  )
+
+def dispatch_once():
+  """
+  Tops the TTS queue up to TTS_DISPATCH_QUEUE_DEPTH jobs, taken round-robin over the books. Keeping the queue this
+  shallow is what makes the scheduling fair: a book queued behind another one only waits for the jobs already in the
+  TTS queue, not for the other book's whole backlog.
+
+  :return: Number of jobs dispatched
+  """
+  jobs = scheduler.dispatch(TTS_DISPATCH_QUEUE_DEPTH - ready_job_count())
+  for position, (book_uuid, message, priority) in enumerate(jobs):
+    try:
+      publish_job(message, priority)
+    except Exception:
+      # Jobs taken from Redis but not published go back to their book, so no chunk is lost.
+      for unpublished_book_uuid, unpublished_message, unpublished_priority in jobs[position:]:
+        scheduler.enqueue(unpublished_book_uuid, unpublished_message, unpublished_priority)
+        scheduler.release(unpublished_book_uuid, unpublished_message["chapter_uuid"],
+                          unpublished_message["chunk_index"])
+      raise
+  return len(jobs)
+
+def log_backlog():
+  backlog = scheduler.backlog()
+  queued = sum(counts["queued"] for counts in backlog.values())
+  print(f"TTS backlog: {queued} jobs queued over {len(backlog)} books")
+  for book_uuid, counts in backlog.items():
+    print(f"  {book_uuid}: {counts['queued']} queued, {counts['in_flight']} in flight")
+
+def start_service():
+  # Have the broker confirm every publish, so a job is only out of Redis once it is safely queued.
+  channel.confirm_delivery()
+
+  # ---- Queue to feed TTS jobs to ----
+  channel.queue_declare(queue=TTS_QUEUE_NAME, arguments=tts_queue_arguments(TTS_PRIORITY_SCHEDULING))
+  print("Dispatching TTS jobs.")
+
+  # ---- Keep the program running ----
+  last_log = 0.0
+  try:
+    while True:
+      if dispatch_once() == 0:
+        # Unlike time.sleep, connection.sleep keeps serving the connection's heartbeats.
+        connection.sleep(TTS_DISPATCH_POLL_SECONDS)
+      if time.monotonic() - last_log >= BACKLOG_LOG_INTERVAL:
+        log_backlog()
+        last_log = time.monotonic()
+  except KeyboardInterrupt:
+    print("Stopping the TTS dispatcher...")
+    connection.close()
+
+if __name__ == "__main__":
+  start_service()
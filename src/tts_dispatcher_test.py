@@ -0,0 +1,62 @@
+import json
+import unittest
+from unittest.mock import patch
+
+from tts_dispatcher import dispatch_once, start_service
+
+
+class TestTTSDispatcher(unittest.TestCase):
+
+    @patch('tts_dispatcher.TTS_DISPATCH_QUEUE_DEPTH', 10)
+    @patch('tts_dispatcher.scheduler')
+    @patch('tts_dispatcher.channel')
+    def test_dispatch_once_tops_up_the_queue(self, mock_channel, mock_scheduler):
+        mock_channel.queue_declare.return_value.method.message_count = 7
+        mock_scheduler.dispatch.return_value = [
+            ("book-1", {"book_uuid": "book-1", "chunk_index": 1}, 9),
+            ("book-2", {"book_uuid": "book-2", "chunk_index": 1}, None),
+        ]
+
+        self.assertEqual(dispatch_once(), 2)
+
+        mock_scheduler.dispatch.assert_called_once_with(3)
+        published = [c.kwargs for c in mock_channel.basic_publish.call_args_list]
+        self.assertEqual([json.loads(p["body"])["book_uuid"] for p in published], ["book-1", "book-2"])
+        self.assertEqual([p["properties"].priority for p in published], [9, None])
+
+    @patch('tts_dispatcher.scheduler')
+    @patch('tts_dispatcher.channel')
+    def test_dispatch_once_puts_back_unpublished_jobs(self, mock_channel, mock_scheduler):
+        mock_channel.queue_declare.return_value.method.message_count = 0
+        jobs = [("book-1", {"chapter_uuid": "chapter-1", "chunk_index": 1}, None),
+                ("book-1", {"chapter_uuid": "chapter-1", "chunk_index": 2}, None),
+                ("book-2", {"chapter_uuid": "chapter-9", "chunk_index": 1}, 5)]
+        mock_scheduler.dispatch.return_value = jobs
+        mock_channel.basic_publish.side_effect = [None, RuntimeError("Connection lost")]
+
+        with self.assertRaises(RuntimeError):
+            dispatch_once()
+
+        self.assertEqual([c.args for c in mock_scheduler.enqueue.call_args_list], jobs[1:])
+        self.assertEqual([c.args for c in mock_scheduler.release.call_args_list],
+                         [("book-1", "chapter-1", 2), ("book-2", "chapter-9", 1)])
+
+    @patch('tts_dispatcher.TTS_PRIORITY_SCHEDULING', True)
+    @patch('tts_dispatcher.log_backlog')
+    @patch('tts_dispatcher.dispatch_once')
+    @patch('tts_dispatcher.connection')
+    @patch('tts_dispatcher.channel')
+    def test_start_service(self, mock_channel, mock_connection, mock_dispatch, mock_log):
+        mock_dispatch.side_effect = [5, 0, KeyboardInterrupt]
+
+        start_service()
+
+        mock_channel.confirm_delivery.assert_called_once()
+        mock_channel.queue_declare.assert_called_once_with(queue='tts_queue', arguments={"x-max-priority": 10})
+        # Only an idle round waits before the next one.
+        mock_connection.sleep.assert_called_once()
+        mock_connection.close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+import asyncio
 import json
+import queue
 import tempfile
 import os
 
@@ -9,13 +11,27 @@ from tts import (
     notify_event_tracker,
     process_job,
     callback,
+    process_job_async,
+    synthesize_speech,
+    synthesize_speech_async,
+    hedge_admitted,
+    dispatch_job_async,
+    start_worker_loop,
+    create_backend,
     start_service
 )
+from tts_backends import GoogleTTSBackend, LocalTTSBackend
+from google.api_core.exceptions import ResourceExhausted
+
+from messages import tts_job, encode_payload, decode_payload
+from tts_cache import SynthesisCache
+from rate_limiter import RateLimiter, ACQUIRE_SCRIPT, TRY_ACQUIRE_SCRIPT
 
 class TestTTSService(unittest.TestCase):
 
-    @patch('tts.client.synthesize_speech')
-    def test_text_to_speech_mocked(self, mock_synthesize_speech):
+    @patch('tts.backend.client')
+    def test_text_to_speech_mocked(self, mock_client):
+        mock_synthesize_speech = mock_client.synthesize_speech
         # Create a mock response
         mock_response = MagicMock()
         mock_response.audio_content = b'mock audio content'
@@ -41,34 +57,252 @@ class TestTTSService(unittest.TestCase):
         os.unlink(temp_input.name)
         os.unlink(temp_output.name)
 
+    @patch('tts.synthesis_cache', new_callable=lambda: SynthesisCache(1024 * 1024))
+    @patch('tts.backend.client')
+    def test_text_to_speech_cache_hit_skips_api(self, mock_client, mock_cache):
+        mock_synthesize_speech = mock_client.synthesize_speech
+        mock_synthesize_speech.return_value = MagicMock(audio_content=b'mock audio content')
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            outputs = []
+            for number, text in enumerate(['Chapter One.', '  Chapter   One. ', 'Chapter Two.']):
+                input_path = os.path.join(temp_dir, f'input_{number}.txt')
+                output_path = os.path.join(temp_dir, f'output_{number}.mp3')
+                with open(input_path, 'w') as input_file:
+                    input_file.write(text)
+                text_to_speech(input_path, output_path)
+                with open(output_path, 'rb') as output_file:
+                    outputs.append(output_file.read())
+
+            # A different voice is a different synthesis.
+            with patch('tts.backend.voice_gender', 'MALE'):
+                text_to_speech(os.path.join(temp_dir, 'input_0.txt'), os.path.join(temp_dir, 'output_male.mp3'))
+
+        self.assertEqual(outputs, [b'mock audio content'] * 3)
+        self.assertEqual(mock_synthesize_speech.call_count, 3)
+        self.assertEqual(mock_cache.stats()["memory_hits"], 1)
+        self.assertEqual(mock_cache.stats()["misses"], 3)
+
     @patch('tts.channel')
     def test_notify_event_tracker(self, mock_channel):
         notify_event_tracker('TEST_OP', {'key': 'value'})
         mock_channel.basic_publish.assert_called_once()
 
+    @patch('tts.download_range_from_gcs')
+    @patch('tts.upload_bytes_to_gcs')
+    @patch('tts.synthesize_chunk')
+    @patch('tts.notify_event_tracker')
+    @patch('tts.NamedTemporaryFile')
+    def test_process_job(self, mock_temp_file, mock_notify, mock_synthesize, mock_upload, mock_download):
+        mock_download.return_value = b'Chunk text.'
+        mock_synthesize.return_value = b'audio'
+
+        process_job('book123', 'chapter456', 1)
+
+        # The text and the audio never touch the disk.
+        mock_download.assert_called_once_with(unittest.mock.ANY, 'book123/chunks/chapter456/chunk_1.txt', 0,
+                                              1024 * 1024 + 1)
+        mock_synthesize.assert_called_once_with('Chunk text.')
+        mock_upload.assert_called_once_with(b'audio', unittest.mock.ANY, 'book123/chunks/chapter456/audio/chunk_1.mp3',
+                                            content_type='audio/mpeg')
+        mock_temp_file.assert_not_called()
+        self.assertEqual(mock_notify.call_count, 2)
+
+    @patch('tts.fair_scheduler')
+    @patch('tts.download_range_from_gcs')
+    @patch('tts.upload_bytes_to_gcs')
+    @patch('tts.synthesize_chunk')
+    @patch('tts.notify_event_tracker')
+    def test_process_job_releases_fair_share_slot(self, mock_notify, mock_synthesize, mock_upload, mock_download,
+                                                  mock_scheduler):
+        mock_download.return_value = b'Chunk text.'
+        mock_synthesize.return_value = b'audio'
+
+        process_job('book123', 'chapter456', 1)
+        mock_scheduler.release.assert_called_once_with('book123', 'chapter456', 1)
+
+        # A failed chunk keeps its place: its job is requeued, and released once it succeeds.
+        mock_scheduler.reset_mock()
+        mock_upload.side_effect = RuntimeError("Error uploading to GCS")
+        with self.assertRaises(RuntimeError):
+            process_job('book123', 'chapter456', 1)
+        mock_scheduler.release.assert_not_called()
+
+    @patch('tts.TTS_IN_MEMORY_MAX_BYTES', 10)
+    @patch('tts.download_range_from_gcs')
     @patch('tts.download_file_from_gcs')
+    @patch('tts.upload_bytes_to_gcs')
     @patch('tts.upload_to_gcs')
     @patch('tts.text_to_speech')
     @patch('tts.notify_event_tracker')
-    def test_process_job(self, mock_notify, mock_tts, mock_upload, mock_download):
+    def test_process_job_large_chunk_uses_temp_files(self, mock_notify, mock_tts, mock_upload, mock_upload_bytes,
+                                                     mock_download, mock_download_range):
+        # The capped read comes back full: the chunk is over the limit.
+        mock_download_range.return_value = b'x' * 11
+
         process_job('book123', 'chapter456', 1)
+
         mock_download.assert_called_once()
+        self.assertEqual(mock_download.call_args.args[1], 'book123/chunks/chapter456/chunk_1.txt')
         mock_tts.assert_called_once()
         mock_upload.assert_called_once()
-        self.assertEqual(mock_notify.call_count, 2)
+        mock_upload_bytes.assert_not_called()
+
+        # A packed chunk's size is known up front, so only its byte range is downloaded, to a file.
+        mock_download.reset_mock()
+        mock_download_range.reset_mock()
+        process_job('book123', 'chapter456', 2, None, [100, 50])
+        mock_download_range.assert_not_called()
+        self.assertEqual(mock_download.call_args.args[1], 'book123/chunks/chapter456/chunks.pack')
+        self.assertEqual(mock_download.call_args.kwargs, {'start': 100, 'end': 149})
 
     @patch('tts.process_job')
     def test_callback_success(self, mock_process):
         ch = MagicMock()
-        method = MagicMock()
+        method = MagicMock(redelivered=False)
         properties = MagicMock()
         body = json.dumps({"book_uuid": "book123", "chapter_uuid": "chapter456", "chunk_index": 1})
         
         callback(ch, method, properties, body)
         
-        mock_process.assert_called_once_with("book123", "chapter456", 1)
+        mock_process.assert_called_once_with("book123", "chapter456", 1, None, None, skip_if_done=False)
         ch.basic_ack.assert_called_once()
 
+    @patch('tts.process_job')
+    def test_callback_inline_payload(self, mock_process):
+        ch = MagicMock()
+        for compression in ('zlib', 'none'):
+            mock_process.reset_mock()
+            body = json.dumps(tts_job("book123", "chapter456", 1, "Inline chunk text. " * 20, compression))
+
+            callback(ch, MagicMock(redelivered=False), MagicMock(), body)
+
+            mock_process.assert_called_once_with("book123", "chapter456", 1, "Inline chunk text. " * 20, None,
+                                                 skip_if_done=False)
+
+    @patch('tts.download_range_from_gcs')
+    @patch('tts.upload_bytes_to_gcs')
+    @patch('tts.synthesize_chunk')
+    @patch('tts.notify_event_tracker')
+    def test_process_job_inline_payload(self, mock_notify, mock_synthesize, mock_upload, mock_download):
+        process_job('book123', 'chapter456', 1, 'Inline café text.')
+
+        mock_download.assert_not_called()
+        mock_synthesize.assert_called_once_with('Inline café text.')
+        mock_upload.assert_called_once()
+
+    @patch('tts.process_job')
+    def test_callback_chunk_range(self, mock_process):
+        body = json.dumps(tts_job("book123", "chapter456", 2, chunk_range=(120, 45)))
+
+        callback(MagicMock(), MagicMock(redelivered=False), MagicMock(), body)
+
+        mock_process.assert_called_once_with("book123", "chapter456", 2, None, [120, 45], skip_if_done=False)
+
+    @patch('tts.process_job')
+    def test_callback_redelivered_checks_for_audio(self, mock_process):
+        body = json.dumps(tts_job("book123", "chapter456", 2))
+
+        callback(MagicMock(), MagicMock(redelivered=True), MagicMock(), body)
+        self.assertTrue(mock_process.call_args.kwargs['skip_if_done'])
+
+        with patch('tts.TTS_SKIP_EXISTING_AUDIO', 'never'):
+            callback(MagicMock(), MagicMock(redelivered=True), MagicMock(), body)
+        self.assertFalse(mock_process.call_args.kwargs['skip_if_done'])
+
+        with patch('tts.TTS_SKIP_EXISTING_AUDIO', 'always'):
+            callback(MagicMock(), MagicMock(redelivered=False), MagicMock(), body)
+        self.assertTrue(mock_process.call_args.kwargs['skip_if_done'])
+
+    @patch('tts.fair_scheduler')
+    @patch('tts.gcs_blob_exists', return_value=True)
+    @patch('tts.download_range_from_gcs')
+    @patch('tts.upload_bytes_to_gcs')
+    @patch('tts.synthesize_chunk')
+    @patch('tts.notify_event_tracker')
+    def test_process_job_skips_synthesized_chunk(self, mock_notify, mock_synthesize, mock_upload, mock_download,
+                                                 mock_exists, mock_scheduler):
+        process_job('book123', 'chapter456', 2, skip_if_done=True)
+
+        mock_exists.assert_called_once_with(unittest.mock.ANY, 'book123/chunks/chapter456/audio/chunk_2.mp3')
+        mock_download.assert_not_called()
+        mock_synthesize.assert_not_called()
+        mock_upload.assert_not_called()
+        # Only the completion event is sent again.
+        self.assertEqual([c.args[0] for c in mock_notify.call_args_list], ['remove_chunk'])
+        mock_scheduler.release.assert_called_once_with('book123', 'chapter456', 2)
+
+    @patch('tts.fair_scheduler')
+    @patch('tts.download_range_from_gcs', return_value=b'Chunk text.')
+    @patch('tts.synthesize_chunk', return_value=b'audio')
+    @patch('tts.notify_event_tracker')
+    def test_same_chunk_delivered_twice(self, mock_notify, mock_synthesize, mock_download, mock_scheduler):
+        uploaded = set()
+        body = json.dumps(tts_job("book123", "chapter456", 2))
+
+        with patch('tts.upload_bytes_to_gcs', side_effect=lambda data, bucket, blob, **kwargs: uploaded.add(blob)), \
+                patch('tts.gcs_blob_exists', side_effect=lambda bucket, blob: blob in uploaded):
+            callback(MagicMock(), MagicMock(redelivered=False), MagicMock(), body)
+            # The broker delivers the job again, e.g. because its ack was lost with the connection.
+            callback(MagicMock(), MagicMock(redelivered=True), MagicMock(), body)
+
+        mock_synthesize.assert_called_once_with('Chunk text.')
+        self.assertEqual([c.args[0] for c in mock_notify.call_args_list],
+                         ['update_chunk_status', 'remove_chunk', 'remove_chunk'])
+        # Both deliveries release the same chunk, which the scheduler counts once.
+        self.assertEqual([c.args for c in mock_scheduler.release.call_args_list],
+                         [('book123', 'chapter456', 2)] * 2)
+
+    @patch('tts.download_range_from_gcs', return_value=b'Chunk text.')
+    @patch('tts.upload_bytes_to_gcs')
+    @patch('tts.synthesize_chunk', return_value=b'audio')
+    @patch('tts.notify_event_tracker')
+    def test_process_job_synthesizes_missing_audio(self, mock_notify, mock_synthesize, mock_upload, mock_download):
+        for exists in (False, RuntimeError("GCS unavailable")):
+            mock_synthesize.reset_mock()
+            with patch('tts.gcs_blob_exists', side_effect=[exists]):
+                process_job('book123', 'chapter456', 2, skip_if_done=True)
+            # A failed lookup counts as missing audio.
+            mock_synthesize.assert_called_once_with('Chunk text.')
+
+    @patch('tts.connection')
+    @patch('tts.gcs_blob_exists', return_value=True)
+    @patch('tts.synthesize_async')
+    @patch('tts.notify_event_tracker')
+    def test_process_job_async_skips_synthesized_chunk(self, mock_notify, mock_synthesize, mock_exists,
+                                                       mock_connection):
+        mock_connection.add_callback_threadsafe.side_effect = lambda function: function()
+
+        asyncio.run(process_job_async('book123', 'chapter456', 2, 'Chunk text.', skip_if_done=True))
+
+        mock_synthesize.assert_not_called()
+        self.assertEqual([c.args[0] for c in mock_notify.call_args_list], ['remove_chunk'])
+
+    @patch('tts.download_range_from_gcs')
+    @patch('tts.download_file_from_gcs')
+    @patch('tts.upload_bytes_to_gcs')
+    @patch('tts.synthesize_chunk')
+    @patch('tts.notify_event_tracker')
+    def test_process_job_packed_chunk(self, mock_notify, mock_synthesize, mock_upload, mock_download,
+                                      mock_download_range):
+        mock_download_range.return_value = 'Packed café text.'.encode('utf-8')
+
+        process_job('book123', 'chapter456', 2, None, [120, 18])
+
+        mock_download_range.assert_called_once_with(unittest.mock.ANY, 'book123/chunks/chapter456/chunks.pack', 120, 18)
+        mock_download.assert_not_called()
+        mock_synthesize.assert_called_once_with('Packed café text.')
+
+    def test_payload_round_trip(self):
+        for text in ['', 'Short.', 'Unicode: café 日本語 \U0001F600. ' * 50]:
+            for compression in ('zlib', 'none'):
+                payload, encoding = encode_payload(text, compression)
+                self.assertEqual(decode_payload({"payload": payload, "payload_encoding": encoding}), text)
+        # Compression is only used when it pays off.
+        self.assertEqual(encode_payload('Short.', 'zlib'), ('Short.', 'utf-8'))
+        self.assertEqual(encode_payload('Repeated text. ' * 100, 'zlib')[1], 'zlib+base64')
+        self.assertIsNone(decode_payload({"book_uuid": "book123"}))
+
     @patch('tts.process_job')
     def test_callback_error(self, mock_process):
         ch = MagicMock()
@@ -95,5 +329,182 @@ class TestTTSService(unittest.TestCase):
         mock_channel.stop_consuming.assert_called_once()
         mock_connection.close.assert_called_once()
 
+    @patch('tts.synthesis_cache', new_callable=lambda: SynthesisCache(0))
+    @patch('tts.backend.async_client')
+    @patch('tts.connection')
+    @patch('tts.download_range_from_gcs')
+    @patch('tts.upload_bytes_to_gcs')
+    @patch('tts.notify_event_tracker')
+    def test_process_job_async(self, mock_notify, mock_upload, mock_download, mock_connection, mock_client, mock_cache):
+        mock_connection.add_callback_threadsafe.side_effect = lambda function: function()
+        mock_download.return_value = b'Chunk text.'
+        mock_client.synthesize_speech = AsyncMock(return_value=MagicMock(audio_content=b'audio'))
+
+        asyncio.run(process_job_async('book123', 'chapter456', 3))
+
+        self.assertEqual(mock_download.call_args.args[1], 'book123/chunks/chapter456/chunk_3.txt')
+        mock_upload.assert_called_once_with(b'audio', unittest.mock.ANY, 'book123/chunks/chapter456/audio/chunk_3.mp3',
+                                            content_type='audio/mpeg')
+        self.assertEqual([c.args[0] for c in mock_notify.call_args_list], ['update_chunk_status', 'remove_chunk'])
+
+    @patch('tts.TTS_CONCURRENCY', 4)
+    @patch('tts.process_job_async')
+    @patch('tts.connection')
+    def test_async_mode_keeps_chunks_in_flight(self, mock_connection, mock_process):
+        # Channel operations are queued for the connection thread, played here by the test.
+        connection_callbacks = queue.Queue()
+        mock_connection.add_callback_threadsafe.side_effect = connection_callbacks.put
+        in_flight = []
+        all_started = asyncio.Event()
+
+        async def process(book_uuid, chapter_uuid, chunk_index, chunk_text, chunk_range, skip_if_done=False):
+            in_flight.append(chunk_index)
+            if len(in_flight) == 4:
+                all_started.set()
+            # Every chunk waits until all four are in flight together.
+            await all_started.wait()
+            if chunk_index == 4:
+                raise RuntimeError("TTS API error")
+
+        mock_process.side_effect = process
+        loop = start_worker_loop()
+        ch = MagicMock()
+        try:
+            for chunk_index in range(1, 5):
+                body = json.dumps(tts_job("book123", "chapter456", chunk_index))
+                dispatch_job_async(loop, ch, MagicMock(delivery_tag=chunk_index), MagicMock(), body)
+            for _ in range(4):
+                connection_callbacks.get(timeout=5)()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+
+        self.assertEqual(sorted(in_flight), [1, 2, 3, 4])
+        self.assertEqual(sorted(c.kwargs['delivery_tag'] for c in ch.basic_ack.call_args_list), [1, 2, 3])
+        ch.basic_nack.assert_called_once_with(delivery_tag=4, requeue=True)
+
+    def test_dispatch_job_async_invalid_message(self):
+        ch = MagicMock()
+        loop = MagicMock()
+        dispatch_job_async(loop, ch, MagicMock(delivery_tag=7), MagicMock(), json.dumps({"book_uuid": "book123"}))
+        ch.basic_nack.assert_called_once_with(delivery_tag=7, requeue=True)
+
+    @patch('tts.TTS_WORKER_MODE', 'async')
+    @patch('tts.TTS_CONCURRENCY', 16)
+    @patch('tts.start_worker_loop')
+    @patch('tts.channel')
+    @patch('tts.connection')
+    def test_start_service_async(self, mock_connection, mock_channel, mock_start_loop):
+        mock_channel.start_consuming.side_effect = KeyboardInterrupt()
+
+        start_service()
+
+        mock_channel.basic_qos.assert_called_once_with(prefetch_count=16)
+        mock_start_loop.assert_called_once()
+        mock_channel.basic_consume.assert_called_once()
+
+    @patch('tts.rate_limiter')
+    @patch('tts.backend')
+    def test_synthesize_speech_is_rate_limited(self, mock_backend, mock_limiter):
+        mock_backend.synthesize.return_value = b'audio'
+        self.assertEqual(synthesize_speech("text"), b'audio')
+        mock_limiter.acquire.assert_called_once()
+        mock_limiter.record_success.assert_called_once()
+
+        mock_backend.synthesize.side_effect = ResourceExhausted("Quota exceeded")
+        with self.assertRaises(ResourceExhausted):
+            synthesize_speech("text")
+        mock_limiter.record_throttle.assert_called_once()
+        self.assertEqual(mock_limiter.record_success.call_count, 1)
+
+    @patch('tts.rate_limiter')
+    @patch('tts.backend')
+    def test_synthesize_speech_async_is_rate_limited(self, mock_backend, mock_limiter):
+        mock_limiter.acquire_async = AsyncMock()
+        mock_backend.synthesize_async = AsyncMock(side_effect=ResourceExhausted("Quota exceeded"))
+        with self.assertRaises(ResourceExhausted):
+            asyncio.run(synthesize_speech_async("text"))
+        mock_limiter.acquire_async.assert_awaited_once()
+        mock_limiter.record_throttle.assert_called_once()
+        mock_limiter.record_success.assert_not_called()
+
+    @patch('tts.rate_limiter')
+    @patch('tts.hedger')
+    @patch('tts.backend')
+    def test_synthesize_speech_is_hedged(self, mock_backend, mock_hedger, mock_limiter):
+        mock_hedger.call.side_effect = lambda function, text: function(text)
+        mock_backend.synthesize.return_value = b'audio'
+        mock_hedger.stats.return_value = {"calls": 1, "hedges": 0, "hedge_wins": 0, "hedge_rate": 0.0}
+        self.assertEqual(synthesize_speech("text"), b'audio')
+        mock_limiter.acquire.assert_called_once()
+        mock_hedger.call.assert_called_once()
+        mock_limiter.record_success.assert_called_once()
+
+    @patch('tts.rate_limiter')
+    @patch('tts.hedger')
+    @patch('tts.backend')
+    def test_synthesize_speech_async_is_hedged(self, mock_backend, mock_hedger, mock_limiter):
+        async def call_async(function, text):
+            return await function(text)
+        mock_hedger.call_async.side_effect = call_async
+        mock_hedger.stats.return_value = {"calls": 1, "hedges": 0, "hedge_wins": 0, "hedge_rate": 0.0}
+        mock_limiter.acquire_async = AsyncMock()
+        mock_backend.synthesize_async = AsyncMock(return_value=b'audio')
+        self.assertEqual(asyncio.run(synthesize_speech_async("text")), b'audio')
+        mock_hedger.call_async.assert_called_once()
+        mock_limiter.record_success.assert_called_once()
+
+    def test_rejected_hedge_leaves_the_bucket_untouched(self):
+        # A bucket in Redis shared by every pod, modelled by the effect of each script on its token count.
+        bucket = {'tokens': 0.0}
+
+        def reserve_script(keys, args):
+            bucket['tokens'] -= 1
+            return str(max(0.0, -bucket['tokens']) / 5)
+
+        def try_acquire_script(keys, args):
+            if bucket['tokens'] < 1:
+                return 0
+            bucket['tokens'] -= 1
+            return 1
+
+        redis_client = MagicMock()
+        redis_client.register_script.side_effect = lambda script: {
+            ACQUIRE_SCRIPT: reserve_script, TRY_ACQUIRE_SCRIPT: try_acquire_script
+        }.get(script, MagicMock())
+        limiter = RateLimiter(redis_client, 'tts:rate_limiter', initial_rate=5, min_rate=0.5, max_rate=16, burst=5)
+
+        with patch('tts.rate_limiter', limiter):
+            self.assertFalse(hedge_admitted())
+            self.assertEqual(bucket['tokens'], 0.0)
+
+            bucket['tokens'] = 2.0
+            self.assertTrue(hedge_admitted())
+            self.assertEqual(bucket['tokens'], 1.0)
+
+    @patch('tts.rate_limiter', None)
+    @patch('tts.backend')
+    def test_synthesize_speech_without_rate_limit(self, mock_backend):
+        synthesize_speech("text")
+        mock_backend.synthesize.assert_called_once_with("text")
+
+    def test_create_backend(self):
+        self.assertIsInstance(create_backend('google'), GoogleTTSBackend)
+        self.assertIsInstance(create_backend('local'), LocalTTSBackend)
+        # Chunks are uploaded as .mp3 and stitched as MP3.
+        self.assertEqual(create_backend('local').audio_format, 'mp3')
+        with self.assertRaises(ValueError):
+            create_backend('espeak')
+
+    @patch('tts.synthesis_cache', new_callable=lambda: SynthesisCache(0))
+    @patch('tts.backend', new_callable=lambda: LocalTTSBackend(latency_seconds=0, characters_per_second=0))
+    def test_text_to_speech_local_backend(self, mock_backend, mock_cache):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'input.txt')
+            with open(input_path, 'w') as input_file:
+                input_file.write('Offline narration. ' * 10)
+            text_to_speech(input_path, os.path.join(temp_dir, 'output.mp3'))
+            with open(os.path.join(temp_dir, 'output.mp3'), 'rb') as output_file:
+                self.assertEqual(output_file.read(), mock_backend.render('Offline narration. ' * 10))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,5 +1,7 @@
 import os
+from concurrent.futures import Future
 
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
 
 # ---- Initialize Google Cloud Storage client -----
@@ -23,23 +25,111 @@ def upload_to_gcs(file, bucket_name, destination_blob_name):
     raise RuntimeError(f"Error uploading to GCS: {e}")
 
 
-def download_file_from_gcs(bucket_name, source_blob_name, destination_file_name):
+def upload_bytes_to_gcs(data, bucket_name, destination_blob_name, content_type="application/octet-stream"):
+  """
+  Uploads bytes held in memory to Google Cloud Storage, without copying them into a file-like object first.
+
+  :param data: Bytes to upload
+  :param bucket_name: Name of the GCS bucket
+  :param destination_blob_name: Path in the bucket where the data will be saved
+  :param content_type: Content type of the stored object
+  """
+  try:
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(destination_blob_name)
+    blob.upload_from_string(data, content_type=content_type)
+  except Exception as e:
+    raise RuntimeError(f"Error uploading to GCS: {e}")
+
+
+def download_file_from_gcs(bucket_name, source_blob_name, destination_file_name, start=None, end=None):
   """
   Downloads a file from Google Cloud Storage.
 
   :param bucket_name: Name of the GCS bucket
   :param source_blob_name: Path to the file in the bucket
   :param destination_file_name: Local path to save the downloaded file
+  :param start: Offset of the first byte to download, to download only part of the file
+  :param end: Offset of the last byte to download (inclusive)
   """
   try:
     bucket = storage_client.bucket(bucket_name)
     blob = bucket.blob(source_blob_name)
-    blob.download_to_filename(destination_file_name)
+    blob.download_to_filename(destination_file_name, start=start, end=end)
     print(f"Downloaded {source_blob_name} from bucket {bucket_name} to {destination_file_name}")
   except Exception as e:
     raise RuntimeError(f"Failed to download file from GCS: {e}")
 
 
+def download_text_from_gcs(bucket_name, source_blob_name):
+  """
+  Downloads a text file from Google Cloud Storage straight into memory.
+
+  :param bucket_name: Name of the GCS bucket
+  :param source_blob_name: Path to the file in the bucket
+  :return: Content of the file decoded as UTF-8
+  """
+  try:
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(source_blob_name)
+    text = blob.download_as_bytes().decode('utf-8')
+    print(f"Downloaded {source_blob_name} from bucket {bucket_name} into memory")
+    return text
+  except Exception as e:
+    raise RuntimeError(f"Failed to download file from GCS: {e}")
+
+
+def download_bytes_from_gcs(bucket_name, source_blob_name):
+  """
+  Downloads a file from Google Cloud Storage straight into memory, if it exists.
+
+  :param bucket_name: Name of the GCS bucket
+  :param source_blob_name: Path to the file in the bucket
+  :return: Content of the file, or None when there is no such file
+  """
+  try:
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(source_blob_name)
+    return blob.download_as_bytes()
+  except NotFound:
+    return None
+  except Exception as e:
+    raise RuntimeError(f"Failed to download file from GCS: {e}")
+
+
+def download_range_from_gcs(bucket_name, source_blob_name, start, length):
+  """
+  Downloads a byte range of a file in Google Cloud Storage with a single ranged read.
+
+  :param bucket_name: Name of the GCS bucket
+  :param source_blob_name: Path to the file in the bucket
+  :param start: Offset of the first byte to read
+  :param length: Number of bytes to read
+  :return: The bytes read
+  """
+  try:
+    bucket = storage_client.bucket(bucket_name)
+    blob = bucket.blob(source_blob_name)
+    return blob.download_as_bytes(start=start, end=start + length - 1)  # end is inclusive
+  except Exception as e:
+    raise RuntimeError(f"Failed to download byte range from GCS: {e}")
+
+
+def gcs_blob_exists(bucket_name, blob_name):
+  """
+  Checks whether a file exists in Google Cloud Storage, with a metadata request only.
+
+  :param bucket_name: Name of the GCS bucket
+  :param blob_name: Path to the file in the bucket
+  :return: True if the file exists
+  """
+  try:
+    bucket = storage_client.bucket(bucket_name)
+    return bucket.blob(blob_name).exists()
+  except Exception as e:
+    raise RuntimeError(f"Failed to check file in GCS: {e}")
+
+
 def download_folder_from_gcs(bucket_name, folder_prefix, destination_directory):
   """
   Downloads all files in a GCS folder to a local directory.
@@ -69,3 +159,26 @@ def download_folder_from_gcs(bucket_name, folder_prefix, destination_directory):
 
   except Exception as e:
     raise RuntimeError(f"Failed to download folder from GCS: {e}")
+
+
+def call_threadsafe(connection, function, *args, **kwargs):
+  """
+  Runs function on the thread that drives a pika BlockingConnection and waits for its result. pika connections are
+  not thread-safe, so worker threads hand every channel operation (publish, ack, nack) over this way.
+
+  Must not be called from the connection's own thread, which would wait for itself.
+
+  :param connection: pika BlockingConnection
+  :param function: Callable to run on the connection's thread
+  :return: Return value of function; its exception is re-raised in the calling thread
+  """
+  result = Future()
+
+  def run():
+    try:
+      result.set_result(function(*args, **kwargs))
+    except Exception as e:
+      result.set_exception(e)
+
+  connection.add_callback_threadsafe(run)
+  return result.result()